@@ -1,7 +1,7 @@
 from flask import Flask
 from .config import configure_logging
 from flask_migrate import Migrate
-from .extensions import db
+from .extensions import db, configure_engine_options, init_read_bind, init_sqlite_profile
 
 migrate = Migrate()
 
@@ -13,12 +13,42 @@ def create_app(Config):
     configure_logging()
 
 
+    configure_engine_options(app)
     db.init_app(app)
+    init_sqlite_profile(app)
+    init_read_bind(app)
     migrate.init_app(app, db)
+    from .utils.group_commit import db_writer
+    db_writer.init_app(app)
 
 
 
     from app.models import models
+    from .state.session_cache import user_sessions
+    user_sessions.init_app(app)
+    from .core.messaging.ordering import user_serializer
+    user_serializer.init_app(app)
+    from .core.messaging.graph_http import graph_http
+    graph_http.init_app(app)
+    from .core.messaging.templates import message_templates
+    message_templates.init_app(app)
+    from .core.messaging.media import media_uploads
+    media_uploads.init_app(app)
+    from .utils.raw_store import raw_documents
+    raw_documents.init_app(app)
+    from .services.thread_store import thread_store
+    thread_store.init_app(app)
+    from .services.response_cache import response_cache
+    response_cache.init_app(app)
+    from .services.assistant_runner import assistant_runner
+    assistant_runner.init_app(app)
+    from .core.training.analytics import training_analytics
+    training_analytics.init_app(app)
+    from .core.messaging.capture import traffic_recorder
+    traffic_recorder.init_app(app)
+    from .state.states.states import init_app as init_state_machine
+    init_state_machine(app)
+
     from .api.webhooks.views import webhook_blueprint
     # Import and register blueprints, if any
     app.register_blueprint(webhook_blueprint)
@@ -0,0 +1,13 @@
+from app import create_app
+from .server import AsyncWebhookApp
+from .graph_client import AsyncGraphClient
+
+
+def create_asgi_app(Config) -> AsyncWebhookApp:
+    '''
+    Async serving mode: the same Flask app (config, database, state machine)
+    wrapped in an ASGI application whose network calls are coroutines.
+
+        uvicorn asgi:application
+    '''
+    return AsyncWebhookApp(create_app(Config))
@@ -0,0 +1,146 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Union
+
+import aiohttp
+
+from app.core.messaging.circuit_breaker import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(aiohttp.ClientConnectionError):
+    ''' Raised instead of calling the Graph API while its circuit is open '''
+
+
+class AsyncGraphClient:
+    '''
+    Coroutine version of the Graph API calls the bot makes: sending messages,
+    resolving media urls and downloading media. One aiohttp session (and its
+    connection pool) is shared by every in-flight conversation.
+    '''
+
+    def __init__(self, access_token: str, api_version: str, phone_number_id: str,
+                 base_url: str = "https://graph.facebook.com", timeout: float = 10.0,
+                 max_connections: int = 100, breaker: Optional[CircuitBreaker] = None):
+        self.access_token = access_token
+        self.api_version = api_version
+        self.phone_number_id = phone_number_id
+        self.base_url = f"{base_url.rstrip('/')}/{api_version}"
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.breaker = breaker
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @classmethod
+    def from_config(cls, config) -> "AsyncGraphClient":
+        return cls(
+            access_token=config.get("ACCESS_TOKEN"),
+            api_version=config.get("VERSION"),
+            phone_number_id=config.get("PHONE_NUMBER_ID"),
+            base_url=config.get("GRAPH_API_URL", "https://graph.facebook.com"),
+            timeout=config.get("GRAPH_API_TIMEOUT", 10.0),
+            max_connections=config.get("GRAPH_API_MAX_CONNECTIONS", 100),
+            breaker=CircuitBreaker.from_config(config) if config.get("GRAPH_BREAKER", True) else None,
+        )
+
+    def _get_headers(self) -> dict:
+        return {'Authorization': f'Bearer {self.access_token}'}
+
+    async def start(self) -> None:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                headers=self._get_headers(),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+            )
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @asynccontextmanager
+    async def _request(self, method: str, url: str, **kwargs):
+        ''' session.request() that fails fast while the circuit is open and reports outcomes to it '''
+        if self.breaker is None:
+            async with self._session.request(method, url, **kwargs) as response:
+                yield response
+            return
+
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Graph API circuit open, retry in {self.breaker.blocked_for():.1f}s")
+        started = time.monotonic()
+        success = False
+        try:
+            async with self._session.request(method, url, **kwargs) as response:
+                status_ok = response.status < 500
+                try:
+                    yield response
+                except aiohttp.ClientResponseError:
+                    success = status_ok  # raise_for_status() on a 4xx is not an outage
+                    raise
+                success = status_ok
+        finally:
+            self.breaker.record(success, time.monotonic() - started)
+
+    async def send_message(self, payload: Union[dict, bytes]) -> Optional[dict]:
+        ''' Posts a message payload or encoded body; returns the API response body or None on failure '''
+        url = f'{self.base_url}/{self.phone_number_id}/messages'
+        if isinstance(payload, bytes):
+            request = self._request("POST", url, data=payload, headers={"Content-Type": "application/json"})
+        else:
+            request = self._request("POST", url, json=payload)
+        try:
+            async with request as response:
+                response.raise_for_status()
+                return await response.json()
+        except aiohttp.ClientError as e:
+            logger.error(f"Request failed due to: {e}")
+        except TimeoutError:
+            logger.error("Timeout occurred while sending message")
+        return None
+
+    async def get_media_url(self, media_id: str) -> Optional[str]:
+        url = f"{self.base_url}/{media_id}/"
+        try:
+            async with self._request("GET", url) as response:
+                response.raise_for_status()
+                body = await response.json()
+        except aiohttp.ClientError as e:
+            logger.error(f"Request failed while fetching media URL for media_id {media_id}: {e}")
+            return None
+        except TimeoutError:
+            logger.error(f"Timeout occurred while fetching media URL for media_id: {media_id}")
+            return None
+
+        media_url = body.get("url")
+        if not media_url:
+            logger.error(f"'url' not found in the response body for media_id: {media_id}")
+        return media_url
+
+    async def iter_media(self, media_url: str, chunk_size: int = 64 * 1024,
+                         timeout: Optional[float] = None) -> AsyncIterator[bytes]:
+        '''
+        Yields the media body chunk by chunk. `timeout` bounds the whole
+        download (the session timeout otherwise); errors reach the caller.
+        '''
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout, sock_read=self.timeout)
+        async with self._request("GET", media_url, **kwargs) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(chunk_size):
+                yield chunk
+
+    async def download_media(self, media_url: str) -> Optional[bytes]:
+        try:
+            async with self._request("GET", media_url) as response:
+                response.raise_for_status()
+                return await response.read()
+        except aiohttp.ClientError as e:
+            logger.error(f"Failed to download media: {e}")
+        except TimeoutError:
+            logger.error("Timeout occurred while downloading media")
+        return None
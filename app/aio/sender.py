@@ -0,0 +1,75 @@
+import asyncio
+import logging
+from typing import Dict, List
+
+from app.core.messaging.message_sender import MessageSender
+from app.core.messaging.sendMessage_types import Message
+from .graph_client import AsyncGraphClient
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncBridgeSender(MessageSender):
+    '''
+    MessageSender used by the state machine in async mode.
+
+    Handlers run in executor threads; send() hands the payload to the event loop
+    and returns immediately. Messages to the same recipient are chained so they
+    leave in the order the handler produced them, while different recipients
+    are sent concurrently. Each message, batch parts included, starts once
+    the previous one to the recipient was answered.
+    '''
+
+    def __init__(self, graph_client: AsyncGraphClient, loop: asyncio.AbstractEventLoop):
+        self.graph_client = graph_client
+        self.loop = loop
+        self._tails: Dict[str, asyncio.Task] = {}
+
+    def send(self, message: Message) -> bool:
+        try:
+            payload = message.encode()
+        except Exception as e:
+            logger.error(f'Exception {e} while building the message', exc_info=True)
+            return False
+        # call_soon_threadsafe keeps the order of calls from the same thread
+        self.loop.call_soon_threadsafe(self._enqueue, message.to, [payload])
+        return True
+
+    def send_batch(self, messages: List[Message]) -> bool:
+        try:
+            payloads = [message.encode() for message in messages]
+        except Exception as e:
+            logger.error(f'Exception {e} while building the messages', exc_info=True)
+            return False
+        if payloads:
+            self.loop.call_soon_threadsafe(self._enqueue, messages[0].to, payloads)
+        return True
+
+    def _enqueue(self, to: str, payloads: List[bytes]) -> None:
+        previous = self._tails.get(to)
+        task = self.loop.create_task(self._send_after(previous, to, payloads))
+        self._tails[to] = task
+        task.add_done_callback(lambda done: self._forget(to, done))
+
+    def _forget(self, to: str, task: asyncio.Task) -> None:
+        if self._tails.get(to) is task:
+            del self._tails[to]
+
+    async def _send_after(self, previous, to: str, payloads: List[bytes]) -> None:
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        for payload in payloads:
+            if await self._send(payload) is None:
+                logger.error(f"Message to {to} was not sent")
+
+    async def _send(self, payload: bytes):
+        # Degraded mode: hold the reply while the Graph API circuit is open
+        breaker = getattr(self.graph_client, "breaker", None)
+        while breaker is not None and breaker.blocked_for() > 0:
+            await asyncio.sleep(breaker.blocked_for())
+        return await self.graph_client.send_message(payload)
+
+    async def drain(self) -> None:
+        ''' Waits until every queued message has been sent '''
+        while self._tails:
+            await asyncio.gather(*list(self._tails.values()), return_exceptions=True)
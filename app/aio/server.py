@@ -0,0 +1,254 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Optional, Union
+from urllib.parse import parse_qs
+
+import aiohttp
+from flask import Flask
+
+from app import db
+from app.api.webhooks.views import dispatch_webhook, validator
+from app.core.messaging.capture import traffic_recorder
+from app.core.messaging.ordering import Ticket, sender_wa_id, user_serializer
+from app.decorators.security import validate_signature
+from app.models.payload_models import ValidatedWebhookPayload
+from app.state.session_cache import user_sessions
+from app.state.states.states import create_state_machine
+from app.utils.document_utils import (
+    DOWNLOAD_CHUNK_SIZE, DocumentDownloadError, VerifiedDownload, find_ingested_document,
+)
+from .graph_client import AsyncGraphClient
+from .sender import AsyncBridgeSender
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncWebhookApp:
+    '''
+    ASGI application serving /webhook.
+
+    The webhook is verified, validated and acknowledged on the event loop, then
+    processed in a background task: Graph API calls and media downloads are
+    coroutines, and the state machine (database work and the pandas ingestion)
+    runs in a thread pool inside the Flask app context.
+
+    The user's ticket is taken when the webhook is received and held by the
+    task from the ledger check through the document download to the
+    dispatch, so a user's messages are handled in arrival order even when a
+    download is still running as the next message comes in.
+    '''
+
+    def __init__(self, flask_app: Flask, graph_client: AsyncGraphClient = None,
+                 executor: ThreadPoolExecutor = None):
+        self.flask_app = flask_app
+        self.graph_client = graph_client or AsyncGraphClient.from_config(flask_app.config)
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=flask_app.config.get("ASYNC_EXECUTOR_WORKERS", 8),
+            thread_name_prefix="webhook",
+        )
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.sender: Optional[AsyncBridgeSender] = None
+        self._tasks = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        await self.startup()
+        if scope["path"].rstrip("/") != "/webhook":
+            await self._respond(send, 404, {"status": "error", "message": "Not found"})
+        elif scope["method"] == "GET":
+            await self._verify(scope, send)
+        elif scope["method"] == "POST":
+            await self._webhook_post(scope, receive, send)
+        else:
+            await self._respond(send, 405, {"status": "error", "message": "Method not allowed"})
+
+    '''
+    Lifecycle
+    '''
+    async def startup(self) -> None:
+        if self.loop is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        await self.graph_client.start()
+        # Replies produced by the state machine are sent from the event loop
+        self.sender = AsyncBridgeSender(self.graph_client, self.loop)
+        self.flask_app.extensions["state_machine"] = create_state_machine(self.sender)
+
+    async def shutdown(self) -> None:
+        await self.drain()
+        await self.graph_client.close()
+        self.executor.shutdown(wait=True)
+        self.loop = None
+
+    async def drain(self) -> None:
+        ''' Waits for in-flight webhooks and their replies '''
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+        if self.sender is not None:
+            await self.sender.drain()
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    '''
+    Endpoints
+    '''
+    async def _verify(self, scope, send) -> None:
+        params = {key: values[0] for key, values in parse_qs(scope.get("query_string", b"").decode()).items()}
+        mode = params.get("hub.mode")
+        token = params.get("hub.verify_token")
+        if not (mode and token):
+            logger.info("MISSING_PARAMETER")
+            await self._respond(send, 400, {"status": "error", "message": "Missing parameters"})
+        elif mode == "subscribe" and token == self.flask_app.config["VERIFY_TOKEN"]:
+            logger.info("WEBHOOK_VERIFIED")
+            await self._respond(send, 200, params.get("hub.challenge", ""))
+        else:
+            logger.info("VERIFICATION_FAILED")
+            await self._respond(send, 403, {"status": "error", "message": "Verification failed"})
+
+    async def _webhook_post(self, scope, receive, send) -> None:
+        body = await self._read_body(receive)
+        headers = dict(scope.get("headers", []))
+        signature = headers.get(b"x-hub-signature-256", b"").decode()[7:]  # Removing 'sha256='
+
+        with self.flask_app.app_context():
+            valid = validate_signature(body.decode("utf-8"), signature)
+        if not valid:
+            logger.info("Signature verification failed!")
+            await self._respond(send, 403, {"status": "error", "message": "Invalid signature"})
+            return
+        traffic_recorder.record(body)
+        wa_id = sender_wa_id(body)
+        ticket = user_serializer.ticket(wa_id) if wa_id is not None else None
+
+        try:
+            payload = validator.parse(body.decode("utf-8"))
+        except ValueError as e:
+            logger.error(f"Validation failed! \n {e}")
+            if ticket is not None:
+                ticket.release()
+            await self._respond(send, 400, {"status": "error", "message": "Not a WhatsApp API event"})
+            return
+
+        if not payload.is_status():
+            task = asyncio.create_task(self.process(payload, ticket))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif ticket is not None:
+            ticket.release()
+
+        # Acknowledge right away, processing continues in the background
+        await self._respond(send, 200, {"status": "ok"})
+
+    '''
+    Processing
+    '''
+    async def process(self, payload: ValidatedWebhookPayload, ticket: Optional[Ticket] = None) -> None:
+        try:
+            if ticket is None:
+                ticket = user_serializer.ticket(payload.get_user_contact_info()[1])
+            async with ticket:
+                document = None
+                if payload.get_type_of_webhook() == "document":
+                    already_ingested = await self.loop.run_in_executor(self.executor, self._already_ingested, payload)
+                    if not already_ingested:
+                        document = await self.prefetch_document(payload)
+                await self.loop.run_in_executor(self.executor, self._dispatch, payload, document, ticket)
+        except Exception as e:
+            logger.error(f"Unexpected exception {e}", exc_info=True)
+
+    def _dispatch(self, payload: ValidatedWebhookPayload, document: Optional[IO[bytes]], ticket: Ticket) -> None:
+        try:
+            with self.flask_app.app_context():
+                dispatch_webhook(payload, document, ticket)
+        finally:
+            if document is not None:
+                document.close()  # Unused if the user was not adding a training
+
+    def _already_ingested(self, payload: ValidatedWebhookPayload) -> bool:
+        ''' Whether the sender already sent this file; the state machine then answers from the ledger '''
+        user_name, wa_id = payload.get_user_contact_info()
+        with self.flask_app.app_context():
+            session = user_sessions.resolve(wa_id, user_name)
+            document = payload.get_document_of_document_message()
+            ingested = find_ingested_document(session.user_id, document.sha256) is not None
+            db.session.commit()
+            return ingested
+
+    async def prefetch_document(self, payload: ValidatedWebhookPayload) -> Optional[IO[bytes]]:
+        '''
+        Downloads ADR documents before the state machine runs so no thread waits
+        on the network. The content stays in memory unless it is larger than
+        DOCUMENT_SPILL_BYTES; only writes past that go through the executor.
+        '''
+        document = payload.get_document_of_document_message()
+        if "adr" not in document.filename:
+            return None
+
+        media_url = await self.graph_client.get_media_url(document.id)
+        if media_url is None:
+            return None
+
+        config = self.flask_app.config
+        try:
+            with VerifiedDownload(document.sha256, config.get("DOCUMENT_MAX_BYTES", 16 * 1024 * 1024),
+                                  config.get("DOCUMENT_SPILL_BYTES", 4 * 1024 * 1024), document.filename) as download:
+                chunks = self.graph_client.iter_media(media_url, DOWNLOAD_CHUNK_SIZE,
+                                                      timeout=config.get("DOCUMENT_DOWNLOAD_TIMEOUT", 60))
+                async for chunk in chunks:
+                    if download.spills(chunk):
+                        await self.loop.run_in_executor(self.executor, download.write, chunk)
+                    else:
+                        download.write(chunk)
+                content = download.commit()
+        except (aiohttp.ClientError, TimeoutError) as e:
+            logger.error(f"Failed to download media: {e}")
+            return None
+        except DocumentDownloadError as e:
+            logger.error(f"Rejected media download: {e}")
+            return None
+
+        logger.info(f"Media {document.filename} downloaded successfully ({download.size} bytes).")
+        return content
+
+    '''
+    ASGI helpers
+    '''
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+        return body
+
+    @staticmethod
+    async def _respond(send, status: int, body: Union[dict, str]) -> None:
+        if isinstance(body, dict):
+            data, content_type = json.dumps(body).encode(), b"application/json"
+        else:
+            data, content_type = body.encode(), b"text/plain"
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type), (b"content-length", str(len(data)).encode())],
+        })
+        await send({"type": "http.response.body", "body": data})
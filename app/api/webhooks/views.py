@@ -1,5 +1,7 @@
 import logging
 import json
+from contextlib import nullcontext
+from typing import Optional
 from pydantic import ValidationError
 from flask import Blueprint, request, jsonify, current_app
 from ...utils.whatsapp_security import verify
@@ -9,8 +11,11 @@ from ...utils.send_utils import send_interactive_list
 from ...models.models import User
 
 from ...state.states.states import UserContext
+from ...state.session_cache import StateConflict, user_sessions
 from ... import db
 from app.core.messaging.processor import WhatsappRequestProcessor
+from app.core.messaging.ordering import Ticket, sender_wa_id, user_serializer
+from app.core.messaging.capture import traffic_recorder
 from app.core.messaging.validator import PydanticSchema, ValidatedWebhookPayload
 
 webhook_blueprint = Blueprint("webhook", __name__)
@@ -21,7 +26,34 @@ validator = PydanticSchema(ValidatedWebhookPayload)
 message_processor = WhatsappRequestProcessor(validator)
 
 
-def handle_message():
+def dispatch_webhook(processed_payload: ValidatedWebhookPayload, document=None, ticket: Optional[Ticket] = None):
+    '''
+    Runs a validated message webhook through the sender's state machine.
+    Shared by the Flask view and the async server, which passes the already
+    downloaded document buffer as `document`. Callers that took the user's
+    ticket on receipt and hold it pass it as `ticket`.
+    '''
+    user_name, wa_id = processed_payload.get_user_contact_info()
+
+    # Messages of the same user are handled one at a time and in arrival order
+    with nullcontext(ticket) if ticket is not None else user_serializer.hold(wa_id):
+        # Served from the session cache; only (id, state) is read on a miss
+        session = user_sessions.resolve(wa_id, user_name)
+        try:
+            UserContext(session, document=document).handle_webhook(processed_payload)
+        except StateConflict as e:
+            # The cached state was stale; write_state dropped it, so this resolve reads the stored one
+            logging.warning(f"{e}; handling the webhook again")
+            db.session.rollback()
+            if document is not None and document.closed:
+                document = None  # Consumed by the first run; downloaded again if needed
+            session = user_sessions.resolve(wa_id, user_name)
+            UserContext(session, document=document).handle_webhook(processed_payload)
+
+        db.session.commit()
+
+
+def handle_message(ticket: Optional[Ticket] = None):
     try:
 
         processed_payload = message_processor.process_request(request)
@@ -35,23 +67,7 @@ def handle_message():
             return jsonify({'status':'ok'}),200
 
 
-        user_name, wa_id = processed_payload.get_user_contact_info()
-        user = User.query.filter_by(phone_number=wa_id).one_or_none()
-
-        if user:
-            userContext = UserContext(user)
-            print(user)
-            print(user.state)
-            userContext.handle_webhook(processed_payload)
-
-        else:
-            user = User(name = user_name, phone_number = wa_id)
-            db.session.add(user)
-            db.session.commit()
-            userContext = UserContext(user)
-            userContext.handle_webhook(processed_payload)
-
-        db.session.commit()
+        dispatch_webhook(processed_payload, ticket=ticket)
 
         return jsonify({'status':'ok'}),200
 
@@ -78,7 +94,13 @@ def webhook_get():
 @webhook_blueprint.route("/webhook", methods=["POST"])
 @signature_required
 def webhook_post():
-
-    return handle_message()
+    body = request.get_data()
+    traffic_recorder.record(body)
+    wa_id = sender_wa_id(body)
+    if wa_id is None:
+        return handle_message()
+    # The user's place in line is taken on receipt, before the payload is validated
+    with user_serializer.hold(wa_id) as ticket:
+        return handle_message(ticket)
 
 
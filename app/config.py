@@ -17,6 +17,128 @@ class Config:
     VERSION = os.getenv("VERSION")
     PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
     VERIFY_TOKEN = os.getenv("VERIFY_TOKEN")
+
+    # wa_id -> (user id, state) cache used by the webhook path
+    USER_SESSION_CACHE_TTL = float(os.getenv("USER_SESSION_CACHE_TTL", 30))
+    USER_SESSION_CACHE_SIZE = int(os.getenv("USER_SESSION_CACHE_SIZE", 10000))
+
+    # Directory of per-user queue files that keep a user's messages in arrival order across worker processes
+    # on the host. Relative to the instance folder. Unset means the order is only kept within a process.
+    USER_LOCK_DIR = os.getenv("USER_LOCK_DIR")
+
+    # Graph API client and async serving mode (asgi.py)
+    GRAPH_API_URL = os.getenv("GRAPH_API_URL") or "https://graph.facebook.com"
+    GRAPH_API_TIMEOUT = float(os.getenv("GRAPH_API_TIMEOUT", 10))
+    GRAPH_API_MAX_CONNECTIONS = int(os.getenv("GRAPH_API_MAX_CONNECTIONS", 100))
+    GRAPH_API_RETRIES = int(os.getenv("GRAPH_API_RETRIES", 3))
+    GRAPH_API_BACKOFF = float(os.getenv("GRAPH_API_BACKOFF", 0.3))
+
+    # Circuit breaker around the Graph API: fail fast and hold replies during outages
+    GRAPH_BREAKER = os.getenv("GRAPH_BREAKER", "1") != "0"
+    GRAPH_BREAKER_WINDOW = float(os.getenv("GRAPH_BREAKER_WINDOW", 30))
+    GRAPH_BREAKER_MIN_CALLS = int(os.getenv("GRAPH_BREAKER_MIN_CALLS", 20))
+    GRAPH_BREAKER_FAILURE_RATE = float(os.getenv("GRAPH_BREAKER_FAILURE_RATE", 0.5))
+    GRAPH_BREAKER_SLOW_CALL_SECONDS = float(os.getenv("GRAPH_BREAKER_SLOW_CALL_SECONDS", 2))
+    GRAPH_BREAKER_SLOW_CALL_RATE = float(os.getenv("GRAPH_BREAKER_SLOW_CALL_RATE", 0.8))
+    GRAPH_BREAKER_OPEN_SECONDS = float(os.getenv("GRAPH_BREAKER_OPEN_SECONDS", 15))
+    GRAPH_BREAKER_HALF_OPEN_PROBES = int(os.getenv("GRAPH_BREAKER_HALF_OPEN_PROBES", 3))
+
+    # Outbound queue: replies are rate limited and retried off the webhook workers
+    OUTBOUND_QUEUE = os.getenv("OUTBOUND_QUEUE", "1") != "0"
+    OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", 80))  # messages per second
+    OUTBOUND_BURST = float(os.getenv("OUTBOUND_BURST", 80))
+    OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", 8))
+    OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", 5))
+    OUTBOUND_BACKOFF_BASE = float(os.getenv("OUTBOUND_BACKOFF_BASE", 0.5))
+    OUTBOUND_BACKOFF_MAX = float(os.getenv("OUTBOUND_BACKOFF_MAX", 30))
+    OUTBOUND_REPORT_INTERVAL = float(os.getenv("OUTBOUND_REPORT_INTERVAL", 60))
+    ASYNC_EXECUTOR_WORKERS = int(os.getenv("ASYNC_EXECUTOR_WORKERS", 8))
+
+    # Incoming documents are streamed to disk and checked against the webhook's sha256
+    DOCUMENT_MAX_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES", 16 * 1024 * 1024))
+    DOCUMENT_DOWNLOAD_TIMEOUT = float(os.getenv("DOCUMENT_DOWNLOAD_TIMEOUT", 60))
+    # Documents are parsed from memory; larger ones spill to an anonymous temporary file
+    DOCUMENT_SPILL_BYTES = int(os.getenv("DOCUMENT_SPILL_BYTES", 4 * 1024 * 1024))
+
+    # Content-addressed, gzip-compressed archive of raw ADR uploads, relative to the instance folder. Unset disables it.
+    RAW_STORE_DIR = os.getenv("RAW_STORE_DIR")
+    RAW_STORE_MAX_BYTES = int(os.getenv("RAW_STORE_MAX_BYTES", 256 * 1024 * 1024))
+    RAW_STORE_MAX_AGE = float(os.getenv("RAW_STORE_MAX_AGE_DAYS", 365)) * 24 * 3600
+
+    # Ids of uploaded media (reports, charts) are reused for identical files until they expire
+    MEDIA_ID_TTL = float(os.getenv("MEDIA_ID_TTL", 29 * 24 * 3600))
+    MEDIA_ID_CACHE_SIZE = int(os.getenv("MEDIA_ID_CACHE_SIZE", 1000))
+    MEDIA_UPLOAD_WORKERS = int(os.getenv("MEDIA_UPLOAD_WORKERS", 2))
+
+    # Per-user training figures (1RM, last session) answering text commands without the assistant
+    ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", 600))
+    ANALYTICS_CACHE_SIZE = int(os.getenv("ANALYTICS_CACHE_SIZE", 5000))
+    ANALYTICS_WINDOW_DAYS = int(os.getenv("ANALYTICS_WINDOW_DAYS", 90))
+    # Free text that is not a command goes to the OpenAI assistant instead of the menu
+    ASSISTANT_FALLBACK = bool(os.getenv("OPENAI_ASSISTANT_ID")) and os.getenv("ASSISTANT_FALLBACK", "1") != "0"
+    # wa_id -> OpenAI thread id store shared by the workers, relative to the instance folder.
+    # The old shelve file is imported once with `flask import-threads [path]`.
+    OPENAI_THREADS_DB = os.getenv("OPENAI_THREADS_DB") or "threads_db.sqlite"
+    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+    OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
+    # A run gets this many seconds before it is cancelled; followed through its event stream unless OPENAI_RUN_STREAM=0
+    OPENAI_RUN_TIMEOUT = float(os.getenv("OPENAI_RUN_TIMEOUT", 60))
+    OPENAI_RUN_STREAM = os.getenv("OPENAI_RUN_STREAM", "1") != "0"
+    OPENAI_RUN_WORKERS = int(os.getenv("OPENAI_RUN_WORKERS", 4))
+    # Edits to the assistant take effect (and invalidate cached answers) within this many seconds
+    OPENAI_ASSISTANT_TTL = float(os.getenv("OPENAI_ASSISTANT_TTL", 300))
+    # Answers to common questions; OPENAI_CACHE_BYPASS lists wa_ids (comma separated) that always get a fresh run
+    OPENAI_CACHE = os.getenv("OPENAI_CACHE", "1") != "0"
+    OPENAI_CACHE_TTL = float(os.getenv("OPENAI_CACHE_TTL", 24 * 3600))
+    OPENAI_CACHE_SIZE = int(os.getenv("OPENAI_CACHE_SIZE", 1000))
+    OPENAI_CACHE_BYPASS = [wa_id for wa_id in os.getenv("OPENAI_CACHE_BYPASS", "").split(",") if wa_id]
+
+    # SQLite settings applied to every connection of the app's engines (app.extensions).
+    # "default" keeps SQLite's own: rollback journal, full sync, no mmap.
+    SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "default")
+    SQLITE_PROFILES = {
+        "default": {},
+        "performance": {
+            "pragmas": {
+                # Readers never block the writer and commits append to the log
+                "journal_mode": "WAL",
+                # Durable at checkpoints; a power cut may lose the last commits, never corrupts
+                "synchronous": "NORMAL",
+                "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 10000)),
+                "cache_size": -int(os.getenv("SQLITE_CACHE_KIB", 64 * 1024)),
+                "mmap_size": int(os.getenv("SQLITE_MMAP_BYTES", 256 * 1024 * 1024)),
+                "temp_store": "MEMORY",
+            },
+            "engine": {
+                # One connection per worker thread; a connection is cheap to keep and costly to open with mmap
+                "pool_size": int(os.getenv("SQLITE_POOL_SIZE", 10)),
+                "max_overflow": int(os.getenv("SQLITE_POOL_OVERFLOW", 10)),
+                "pool_timeout": float(os.getenv("SQLITE_POOL_TIMEOUT", 30)),
+                # sqlite3's own lock wait, matches busy_timeout
+                "connect_args": {"timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 10000)) / 1000},
+            },
+        },
+    }
+
+    # Heavy history reads (analytics) go to a read-only bind: a replica at READ_DATABASE_URL, or with
+    # SQLITE_READ_ONLY_BIND a second, read-only pool on the primary SQLite file. With neither they use the primary.
+    READ_DATABASE_URI = os.getenv("READ_DATABASE_URL")
+    SQLITE_READ_ONLY_BIND = os.getenv("SQLITE_READ_ONLY_BIND", "0") != "0"
+
+    # State changes of concurrent requests share one transaction and commit. Only the transition goes
+    # through the writer, the rest of the webhook still commits on its own: with it on, a transition costs
+    # one commit more, so it stays off until the webhook's own commit is funnelled too
+    GROUP_COMMIT = os.getenv("GROUP_COMMIT", "0") != "0"
+    GROUP_COMMIT_WINDOW = float(os.getenv("GROUP_COMMIT_WINDOW", 0.002))
+    GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", 64))
+    GROUP_COMMIT_TIMEOUT = float(os.getenv("GROUP_COMMIT_TIMEOUT", 30))
+
+    # Capture of incoming webhooks for replay (tools/replay.py). Unset disables it.
+    TRAFFIC_CAPTURE_DIR = os.getenv("TRAFFIC_CAPTURE_DIR")
+    # Key of the phone number pseudonyms, required with TRAFFIC_CAPTURE_DIR; not a secret used for anything else
+    TRAFFIC_CAPTURE_SALT = os.getenv("TRAFFIC_CAPTURE_SALT")
+    TRAFFIC_CAPTURE_MAX_BYTES = int(os.getenv("TRAFFIC_CAPTURE_MAX_BYTES", 64 * 1024 * 1024))
+    TRAFFIC_CAPTURE_MAX_FILES = int(os.getenv("TRAFFIC_CAPTURE_MAX_FILES", 50))
     RPE_TO_PERCENTAGE_1RM_TABLE = {
     10: {
         1: 100.0, 2: 95.0, 3: 91.0, 4: 87.0, 5: 85.0, 6: 83.0, 7: 81.0, 8: 79.0
@@ -87,9 +209,13 @@ class ProductionConfig(Config):
 
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         f'sqlite:///{basedir / "app.db"}'
+    SQLITE_PROFILE = os.getenv("SQLITE_PROFILE") or "performance"
+    SQLITE_READ_ONLY_BIND = os.getenv("SQLITE_READ_ONLY_BIND", "1") != "0"
     
     # Paths and other variables
     DOWNLOAD_DATA_PATH = os.getenv("DOWNLOAD_DATA_PATH") or 'data'
+    USER_LOCK_DIR = os.getenv("USER_LOCK_DIR") or "locks"
+    RAW_STORE_DIR = os.getenv("RAW_STORE_DIR") or "raw"
     TEMPORARY_DATAFRAME_TRAINING_FILE = os.getenv("TEMPORARY_DATAFRAME_TRAINING") or 'training_data.csv'
 
 class TestingConfig(Config):
@@ -99,4 +225,5 @@ class TestingConfig(Config):
     
     # Paths and other variables
     DOWNLOAD_DATA_PATH = os.getenv("DOWNLOAD_DATA_PATH_TESTING") or 'data'
+    ASSISTANT_FALLBACK = False
     TEMPORARY_DATAFRAME_TRAINING_FILE = os.getenv("TEMPORARY_DATAFRAME_TRAINING_TESTING") or 'training_data.csv'
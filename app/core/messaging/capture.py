@@ -0,0 +1,216 @@
+import atexit
+import gzip
+import hashlib
+import heapq
+import hmac
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+from .ordering import pid_alive
+
+logger = logging.getLogger(__name__)
+
+# Phone numbers are a small space: the pseudonym key must be a secret too long to guess
+MIN_SALT_LENGTH = 16
+
+
+class TrafficRecorder:
+    '''
+    Appends incoming webhook bodies to compressed, rotating capture files.
+
+    record() only enqueues the raw body; a background thread anonymises phone
+    numbers, names and message ids, then writes batches as gzip members appended to the
+    current file (`traffic-<start>-<pid>.jsonl.gz`, one JSON record per line).
+    The file is rotated once it exceeds `max_bytes` and only the newest
+    `max_files` files are kept: a process prunes the files it closed and those
+    of processes that have exited, never one another worker is writing.
+
+    The original signature cannot survive anonymisation, so captured bodies
+    are re-signed with the target app's secret when they are replayed.
+    '''
+
+    def __init__(self):
+        self.directory: Optional[Path] = None
+        self.salt = b""
+        self.max_bytes = 64 * 1024 * 1024
+        self.max_files = 50
+        self.batch_size = 200
+        self.flush_interval = 1.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._current: Optional[Path] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def init_app(self, app) -> None:
+        directory = app.config.get("TRAFFIC_CAPTURE_DIR")
+        if not directory:
+            return
+        self.configure(
+            directory,
+            salt=app.config.get("TRAFFIC_CAPTURE_SALT") or "",
+            max_bytes=app.config.get("TRAFFIC_CAPTURE_MAX_BYTES", self.max_bytes),
+            max_files=app.config.get("TRAFFIC_CAPTURE_MAX_FILES", self.max_files),
+            batch_size=app.config.get("TRAFFIC_CAPTURE_BATCH_SIZE", self.batch_size),
+            flush_interval=app.config.get("TRAFFIC_CAPTURE_FLUSH_INTERVAL", self.flush_interval),
+        )
+
+    def configure(self, directory, salt: str, max_bytes: int = None, max_files: int = None,
+                  batch_size: int = None, flush_interval: float = None) -> None:
+        # Without a secret key the pseudonyms are reversed by hashing every phone number
+        if len(salt or "") < MIN_SALT_LENGTH:
+            raise ValueError(
+                f"Traffic capture needs TRAFFIC_CAPTURE_SALT, a secret of at least {MIN_SALT_LENGTH} characters "
+                f"of its own (e.g. python -c 'import secrets; print(secrets.token_hex(32))')"
+            )
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.salt = salt.encode()
+        self.max_bytes = max_bytes or self.max_bytes
+        self.max_files = max_files or self.max_files
+        self.batch_size = batch_size or self.batch_size
+        self.flush_interval = flush_interval or self.flush_interval
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="traffic-capture", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def record(self, body: bytes) -> None:
+        ''' Queues a verified webhook body; never blocks the request '''
+        if self.enabled:
+            self._queue.put((time.time(), body))
+
+    def close(self) -> None:
+        ''' Flushes pending records and stops the writer '''
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    '''
+    Anonymisation
+    '''
+    def pseudonym(self, phone_number: str) -> str:
+        ''' Stable, numeric stand-in for a phone number (same input -> same output) '''
+        digest = hmac.new(self.salt, phone_number.encode(), hashlib.sha256).hexdigest()
+        return "99" + str(int(digest[:15], 16)).zfill(13)[:13]
+
+    def message_id(self, message_id: str) -> str:
+        ''' Message ids (wamid.*) embed the phone number, they get a stable stand-in too '''
+        return "wamid." + hmac.new(self.salt, message_id.encode(), hashlib.sha256).hexdigest()[:40]
+
+    def anonymise(self, payload: dict) -> dict:
+        for entry in payload.get("entry", []):
+            for change in entry.get("changes", []):
+                value = change.get("value", {})
+                for contact in value.get("contacts", []):
+                    if "wa_id" in contact:
+                        contact["wa_id"] = self.pseudonym(contact["wa_id"])
+                    if "profile" in contact:
+                        contact["profile"]["name"] = f"Athlete {contact['wa_id'][-4:]}"
+                for message in value.get("messages", []):
+                    if "from" in message:
+                        message["from"] = self.pseudonym(message["from"])
+                    if "id" in message:
+                        message["id"] = self.message_id(message["id"])
+                for status in value.get("statuses", []):
+                    if "recipient_id" in status:
+                        status["recipient_id"] = self.pseudonym(status["recipient_id"])
+                    if "id" in status:
+                        status["id"] = self.message_id(status["id"])
+        return payload
+
+    '''
+    Writer thread
+    '''
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.error(f"Failed to write {len(batch)} captured webhooks: {e}", exc_info=True)
+
+    def _write(self, batch: List[tuple]) -> None:
+        lines = []
+        for received_at, body in batch:
+            try:
+                payload = self.anonymise(json.loads(body))
+            except ValueError:
+                continue
+            lines.append(json.dumps({"ts": received_at, "body": json.dumps(payload)}))
+        if not lines:
+            return
+
+        path = self._current_file()
+        # Each batch is its own gzip member; concatenated members read back as one stream
+        with open(path, "ab") as file:
+            file.write(gzip.compress(("\n".join(lines) + "\n").encode()))
+
+    def _current_file(self) -> Path:
+        if self._current is None or self._current.stat().st_size >= self.max_bytes:
+            self._current = self.directory / f"traffic-{time.strftime('%Y%m%dT%H%M%S')}-{time.time_ns() % 10**9:09d}-{os.getpid()}.jsonl.gz"
+            self._current.touch()
+            self._prune()
+        return self._current
+
+    def _prune(self) -> None:
+        for path in capture_files(self.directory)[:-self.max_files]:
+            if not self._in_use(path):
+                path.unlink(missing_ok=True)
+
+    def _in_use(self, path: Path) -> bool:
+        ''' Whether the file may still be written: ours and current, or of a live process '''
+        try:
+            pid = int(path.name[:-len(".jsonl.gz")].rsplit("-", 1)[1])
+        except (IndexError, ValueError):
+            return True
+        if pid == os.getpid():
+            return path == self._current
+        return pid_alive(pid)
+
+
+def capture_files(directory) -> List[Path]:
+    ''' Capture files of a directory, oldest first '''
+    return sorted(Path(directory).glob("traffic-*.jsonl.gz"), key=lambda path: (path.stat().st_mtime, path.name))
+
+
+def _read_file(path: Path) -> Iterator[dict]:
+    with gzip.open(path, "rt") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_capture(paths: Iterable[Path]) -> Iterator[dict]:
+    '''
+    Yields {"ts": arrival time, "body": anonymised json} records of all files,
+    merged by arrival time (each worker process writes its own files).
+    '''
+    return heapq.merge(*(_read_file(path) for path in paths), key=lambda record: record["ts"])
+
+
+traffic_recorder = TrafficRecorder()
@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    '''
+    Stops calling an upstream that is failing or too slow.
+
+    closed     calls go through; outcomes are counted in a rolling window of
+               `window` seconds (in `buckets` slices). Once it holds at least
+               `min_calls` calls and the share of failures reaches
+               `failure_rate`, or the share of calls slower than
+               `slow_call_seconds` reaches `slow_call_rate`, the circuit opens.
+    open       calls are refused straight away for `open_seconds`.
+    half_open  up to `half_open_probes` calls are let through. If they all
+               succeed the circuit closes with a fresh window; any failure
+               opens it again.
+
+    Callers ask allow() before a call and must record() its outcome.
+    '''
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str = "graph", window: float = 30.0, buckets: int = 10, min_calls: int = 20,
+                 failure_rate: float = 0.5, slow_call_seconds: float = 2.0, slow_call_rate: float = 0.8,
+                 open_seconds: float = 15.0, half_open_probes: int = 3,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.bucket_width = window / buckets
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.clock = clock
+
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_passed = 0
+        # [slot, calls, failures, slow calls] per bucket
+        self._buckets: List[list] = [[-1, 0, 0, 0] for _ in range(buckets)]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, name: str = "graph") -> "CircuitBreaker":
+        return cls(
+            name=name,
+            window=config.get("GRAPH_BREAKER_WINDOW", 30.0),
+            min_calls=config.get("GRAPH_BREAKER_MIN_CALLS", 20),
+            failure_rate=config.get("GRAPH_BREAKER_FAILURE_RATE", 0.5),
+            slow_call_seconds=config.get("GRAPH_BREAKER_SLOW_CALL_SECONDS", 2.0),
+            slow_call_rate=config.get("GRAPH_BREAKER_SLOW_CALL_RATE", 0.8),
+            open_seconds=config.get("GRAPH_BREAKER_OPEN_SECONDS", 15.0),
+            half_open_probes=config.get("GRAPH_BREAKER_HALF_OPEN_PROBES", 3),
+        )
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._check_open_timeout(self.clock())
+            return self._state
+
+    def allow(self) -> bool:
+        ''' Whether a call may go out now; in half-open this takes one of the probe slots '''
+        with self._lock:
+            self._check_open_timeout(self.clock())
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and self._probes_started < self.half_open_probes:
+                self._probes_started += 1
+                return True
+            return False
+
+    def blocked_for(self) -> float:
+        ''' Seconds until calls may be attempted again, 0 if they may go now '''
+        with self._lock:
+            now = self.clock()
+            self._check_open_timeout(now)
+            if self._state == self.OPEN:
+                return max(0.0, self._opened_at + self.open_seconds - now)
+            if self._state == self.HALF_OPEN and self._probes_started >= self.half_open_probes:
+                # Probes in flight, look again shortly
+                return min(1.0, self.open_seconds)
+            return 0.0
+
+    def record(self, success: bool, duration: float) -> None:
+        slow = duration >= self.slow_call_seconds
+        with self._lock:
+            now = self.clock()
+            if self._state == self.HALF_OPEN:
+                if success and not slow:
+                    self._probes_passed += 1
+                    if self._probes_passed >= self.half_open_probes:
+                        self._close()
+                else:
+                    self._open(now, "probe failed")
+                return
+            if self._state == self.OPEN:
+                return  # Calls that started before the circuit opened
+
+            bucket = self._bucket(now)
+            bucket[1] += 1
+            bucket[2] += 0 if success else 1
+            bucket[3] += 1 if slow else 0
+            calls, failures, slow_calls = self._totals(now)
+            if calls >= self.min_calls:
+                if failures / calls >= self.failure_rate:
+                    self._open(now, f"{failures}/{calls} calls failed")
+                elif slow_calls / calls >= self.slow_call_rate:
+                    self._open(now, f"{slow_calls}/{calls} calls slower than {self.slow_call_seconds}s")
+
+    def stats(self) -> dict:
+        with self._lock:
+            now = self.clock()
+            self._check_open_timeout(now)
+            calls, failures, slow_calls = self._totals(now)
+            return {"state": self._state, "calls": calls, "failures": failures, "slow_calls": slow_calls}
+
+    '''
+    Internals, called with the lock held
+    '''
+    def _bucket(self, now: float) -> list:
+        slot = int(now // self.bucket_width)
+        bucket = self._buckets[slot % len(self._buckets)]
+        if bucket[0] != slot:
+            bucket[:] = [slot, 0, 0, 0]
+        return bucket
+
+    def _totals(self, now: float) -> tuple:
+        oldest = int(now // self.bucket_width) - len(self._buckets) + 1
+        live = [bucket for bucket in self._buckets if bucket[0] >= oldest]
+        return (sum(bucket[1] for bucket in live), sum(bucket[2] for bucket in live),
+                sum(bucket[3] for bucket in live))
+
+    def _check_open_timeout(self, now: float) -> None:
+        if self._state == self.OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probes_started = 0
+            self._probes_passed = 0
+            logger.info(f"Circuit {self.name} half-open, probing")
+
+    def _open(self, now: float, reason: str) -> None:
+        self._state = self.OPEN
+        self._opened_at = now
+        logger.warning(f"Circuit {self.name} open for {self.open_seconds}s: {reason}")
+
+    def _close(self) -> None:
+        self._state = self.CLOSED
+        for bucket in self._buckets:
+            bucket[:] = [-1, 0, 0, 0]
+        logger.info(f"Circuit {self.name} closed")
@@ -0,0 +1,120 @@
+import re
+import unicodedata
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Pattern, Tuple
+
+# Trie key marking the end of a command phrase
+_END = ""
+_DECIMAL_COMMA = re.compile(r"(\d),(\d)")
+_SPACES = re.compile(r"\s+")
+_PUNCTUATION = "¿?¡!.,;:\"'()"
+
+
+def normalize_text(text: str) -> str:
+    ''' Lower case, no accents, decimal points, single spaces: "RM  Sentadilla 0,6" -> "rm sentadilla 0.6" '''
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _SPACES.sub(" ", _DECIMAL_COMMA.sub(r"\1.\2", stripped)).strip()
+
+
+@dataclass(frozen=True)
+class Command:
+    name: str
+    # Words after the command phrase ("rm sentadilla" -> ("sentadilla",))
+    args: Tuple[str, ...] = ()
+    # Named groups of the pattern that matched
+    values: Dict[str, str] = field(default_factory=dict)
+
+
+class CommandRouter:
+    '''
+    Recognises structured commands in a text message before anything else
+    looks at it.
+
+    Keyword commands live in a trie of words, so a message is matched with
+    one walk over its first words whatever the number of commands; the
+    longest phrase wins and the remaining words are the arguments. Pattern
+    commands ("100kg 0.6 m/s") are regular expressions compiled once and tried
+    in order. A few keywords ("finitto") count anywhere in the message.
+    Anything else is free text and route() returns None.
+    '''
+
+    def __init__(self):
+        self._trie: dict = {}
+        self._anywhere: Dict[str, str] = {}
+        self._patterns: List[Tuple[str, Pattern]] = []
+
+    def keyword(self, name: str, *phrases: str, anywhere: bool = False, exact: bool = False) -> "CommandRouter":
+        '''
+        anywhere: the (one word) phrase counts wherever it appears in the message.
+        exact: the phrase must be the whole message, "hola" is a command but
+        "hola, ¿qué es el RIR?" is a question.
+        '''
+        for phrase in phrases:
+            words = self._words(normalize_text(phrase))
+            if anywhere and len(words) == 1:
+                self._anywhere[words[0]] = name
+            node = self._trie
+            for word in words:
+                node = node.setdefault(word, {})
+            node[_END] = (name, exact)
+        return self
+
+    def pattern(self, name: str, regex: str) -> "CommandRouter":
+        ''' regex is matched against the start of the normalized text; named groups become values '''
+        self._patterns.append((name, re.compile(regex)))
+        return self
+
+    def route(self, text: str) -> Optional[Command]:
+        normalized = normalize_text(text)
+        words = self._words(normalized)
+
+        node, matched = self._trie, None
+        for position, word in enumerate(words):
+            node = node.get(word)
+            if node is None:
+                break
+            if _END in node:
+                name, exact = node[_END]
+                if not exact or position + 1 == len(words):
+                    matched = (name, position + 1)
+        if matched is not None:
+            name, used = matched
+            return Command(name, tuple(words[used:]))
+
+        for name, pattern in self._patterns:
+            match = pattern.match(normalized)
+            if match is not None:
+                return Command(name, tuple(self._words(normalized[match.end():])), match.groupdict())
+
+        for word in words:
+            name = self._anywhere.get(word)
+            if name is not None:
+                return Command(name)
+        return None
+
+    def matches(self, text: str, name: str) -> bool:
+        command = self.route(text)
+        return command is not None and command.name == name
+
+    '''
+    Internals
+    '''
+    @staticmethod
+    def _words(text: str) -> List[str]:
+        return [word for word in (token.strip(_PUNCTUATION) for token in text.split()) if word]
+
+
+def create_command_router() -> CommandRouter:
+    ''' The bot's commands; their answers are in app.core.training.analytics and the states '''
+    return (CommandRouter()
+            .keyword("finish", "finitto", anywhere=True)
+            .keyword("finish", "fin", "terminar", exact=True)
+            .keyword("menu", "menu", "hola", "buenas", "opciones", "ayuda", exact=True)
+            .keyword("summary", "resumen", "resumen sesion", "resumen de la sesion", "ultima sesion")
+            .keyword("one_rm", "rm", "1rm", "rm estimado", "mi rm", "mi rm en", "rm de", "rm en")
+            .pattern("load_velocity",
+                     r"(?P<kg>\d+(?:\.\d+)?)\s*kg?\s*(?:a\s+|@\s*)?(?P<velocity>\d*\.\d+|\d+)\s*m\s*/?\s*s\b"))
+
+
+command_router = create_command_router()
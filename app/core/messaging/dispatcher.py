@@ -0,0 +1,338 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple, Union
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from .circuit_breaker import CircuitBreaker
+from .graph_http import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# Answers of a message the Graph API did not take: throttled or unavailable. Other 5xx may have been delivered
+RETRY_STATUSES = frozenset({429, 503})
+
+
+def never_sent(error: requests.RequestException) -> bool:
+    '''
+    True when a request failed before reaching the Graph API (refused, name
+    resolution, connect timeout, open circuit), so resending it cannot
+    deliver a message twice. Read timeouts and dropped connections may not.
+    '''
+    if isinstance(error, (requests.ConnectTimeout, CircuitOpenError)):
+        return True
+    if isinstance(error, requests.ConnectionError) and not isinstance(error, requests.Timeout):
+        reason = error.args[0] if error.args else None
+        # urllib3 wraps the cause in a MaxRetryError
+        return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+    return False
+
+
+class TokenBucket:
+    ''' Allows `rate` acquisitions per second on average and bursts of up to `capacity` '''
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        ''' Takes a token and returns 0, or returns the seconds until one is available '''
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+
+class Outbound:
+    ''' One queue entry: a single message or a reply batch for the same recipient '''
+    __slots__ = ("payloads", "attempts", "queued_at")
+
+    def __init__(self, payloads: List[dict]):
+        self.payloads = payloads
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+
+
+class OutboundDispatcher:
+    '''
+    Queue between the state machine and the Graph API.
+
+    submit() returns immediately; `workers` threads send the messages through
+    `transmit` (a callable posting one payload and returning the response).
+
+    - A global token bucket keeps the send rate under Meta's throughput limit.
+    - Messages to the same recipient leave one at a time, in submission order;
+      different recipients are sent in parallel.
+    - Only sends that surely did not deliver are retried: 429, 503 and errors
+      while connecting, with jittered exponential backoff (or the Retry-After
+      the API asked for). A read timeout or another 5xx may have delivered the
+      message, so it is given up rather than sent twice; so are other 4xx
+      answers. A recipient's later messages wait behind the one being
+      retried, but the worker is free to serve other recipients meanwhile.
+    - With a circuit breaker, nothing is sent while the Graph API circuit is
+      open: queued replies wait (degraded mode) and go out once it recovers,
+      without using up their retries.
+    - A reply batch (submit_batch) is one queue entry: its messages go out back
+      to back on the worker that took it, each once the previous one was
+      acknowledged (requests started on separate connections may arrive in
+      any order). After a retriable failure the batch resumes from the failed
+      part; parts already acknowledged are never sent again.
+    '''
+
+    def __init__(self, transmit: Callable[[Union[dict, bytes]], requests.Response], rate: float = 80.0,
+                 burst: Optional[float] = None, workers: int = 8, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0, report_interval: float = 60.0,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.transmit = transmit
+        self.bucket = TokenBucket(rate, burst or rate)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.report_interval = report_interval
+        self.breaker = breaker
+
+        self._queues: Dict[str, Deque[Outbound]] = {}
+        # Recipients with messages to send: (not_before, seq, recipient)
+        self._ready: List[tuple] = []
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.deferred = 0
+        self._pending = 0
+        self._sent_times: Deque[float] = deque()
+        self._started = time.monotonic()
+        self._reported = self._started
+
+    @classmethod
+    def from_config(cls, config, transmit: Callable[[Union[dict, bytes]], requests.Response],
+                    breaker: Optional[CircuitBreaker] = None) -> "OutboundDispatcher":
+        return cls(
+            transmit,
+            rate=config.get("OUTBOUND_RATE", 80.0),
+            burst=config.get("OUTBOUND_BURST"),
+            workers=config.get("OUTBOUND_WORKERS", 8),
+            max_retries=config.get("OUTBOUND_MAX_RETRIES", 5),
+            backoff_base=config.get("OUTBOUND_BACKOFF_BASE", 0.5),
+            backoff_max=config.get("OUTBOUND_BACKOFF_MAX", 30.0),
+            report_interval=config.get("OUTBOUND_REPORT_INTERVAL", 60.0),
+            breaker=breaker,
+        )
+
+    def submit(self, payload: Union[dict, bytes], to: Optional[str] = None) -> None:
+        ''' Queues a message (payload dict, or encoded body with its recipient `to`) '''
+        self.submit_batch([payload], to)
+
+    def submit_batch(self, payloads: List[Union[dict, bytes]], to: Optional[str] = None) -> None:
+        ''' Queues messages for one recipient, sent back to back and in this order '''
+        if not payloads:
+            return
+        self._start()
+        recipient = to if to is not None else payloads[0].get("to")
+        with self._condition:
+            queue = self._queues.get(recipient)
+            if queue is None:
+                queue = self._queues[recipient] = deque()
+                # Recipient idle: schedule it. Otherwise the worker serving it picks this up.
+                heapq.heappush(self._ready, (0.0, next(self._seq), recipient))
+            queue.append(Outbound(list(payloads)))
+            self._pending += len(payloads)
+            self._condition.notify()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        ''' Waits until every queued message was sent or given up; False on timeout '''
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        self.drain(timeout)
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        if any(thread.is_alive() for thread in self._threads):
+            return  # Still sending; the daemon threads end with the process
+        self._threads = []
+
+    '''
+    Throughput
+    '''
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._condition:
+            while self._sent_times and self._sent_times[0] < now - 60:
+                self._sent_times.popleft()
+            return {
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "deferred": self.deferred,
+                "pending": self._pending,
+                "recipients": len(self._queues),
+                "per_second_last_minute": len(self._sent_times) / min(60.0, max(now - self._started, 1e-9)),
+            }
+
+    def report(self) -> str:
+        stats = self.stats()
+        return (f"Outbound messages: {stats['per_second_last_minute']:.1f}/s over the last minute, "
+                f"sent={stats['sent']} retried={stats['retried']} failed={stats['failed']} deferred={stats['deferred']} "
+                f"pending={stats['pending']} recipients={stats['recipients']}")
+
+    '''
+    Workers
+    '''
+    def _start(self) -> None:
+        if self._threads:
+            return
+        with self._condition:
+            if self._threads:
+                return
+            self._stopping = False
+            for number in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"outbound-{number}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _next_recipient(self) -> Optional[str]:
+        with self._condition:
+            while True:
+                if self._stopping:
+                    return None
+                if self._ready:
+                    not_before = self._ready[0][0]
+                    wait = not_before - time.monotonic()
+                    if wait <= 0:
+                        return heapq.heappop(self._ready)[2]
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+
+    def _run(self) -> None:
+        while True:
+            recipient = self._next_recipient()
+            if recipient is None:
+                return
+            self._send_head(recipient)
+            if self.report_interval and time.monotonic() - self._reported >= self.report_interval:
+                self._reported = time.monotonic()
+                logger.info(self.report())
+
+    def _send_head(self, recipient: str) -> None:
+        if self.breaker is not None:
+            blocked_for = self.breaker.blocked_for()
+            if blocked_for > 0:
+                with self._condition:
+                    self.deferred += 1
+                    heapq.heappush(self._ready, (time.monotonic() + blocked_for, next(self._seq), recipient))
+                    self._condition.notify()
+                return
+
+        with self._condition:
+            message = self._queues[recipient][0]
+
+        message.attempts += 1
+        remaining = list(message.payloads)
+        sent, dropped, retry_after = 0, 0, None
+        while remaining:
+            self.bucket.acquire()
+            status, after = self._transmit(recipient, remaining[0])
+            if status is not None and 200 <= status < 300:
+                sent += 1
+            elif (status is None or status in RETRY_STATUSES) and message.attempts <= self.max_retries:
+                retry_after = after
+                break
+            else:
+                logger.error(f"Giving up on message to {recipient} after {message.attempts} attempts (status {status})")
+                dropped += 1
+            remaining.pop(0)
+
+        with self._condition:
+            self._count(sent, dropped)
+            if remaining:
+                if len(remaining) < len(message.payloads):
+                    message.attempts = 1  # The earlier attempts belong to parts that are done
+                message.payloads = remaining
+                delay = self._backoff(message.attempts, retry_after)
+                logger.info(f"Retrying {len(remaining)} message(s) to {recipient} in {delay:.2f}s (attempt {message.attempts})")
+                self.retried += 1
+                heapq.heappush(self._ready, (time.monotonic() + delay, next(self._seq), recipient))
+                self._condition.notify()
+            else:
+                self._finish(recipient)
+
+    def _transmit(self, recipient: str, payload) -> Tuple[Optional[int], Optional[str]]:
+        '''
+        Sends one payload; returns (status, Retry-After). Status is None when
+        the request never reached the API and 0 when it failed after that
+        '''
+        try:
+            response = self.transmit(payload)
+            return response.status_code, response.headers.get("Retry-After")
+        except requests.RequestException as e:
+            logger.warning(f"Sending to {recipient} failed: {e}")
+            return (None if never_sent(e) else 0), None
+        except Exception as e:
+            logger.error(f"Unexpected exception {e} while sending to {recipient}", exc_info=True)
+            return 0, None
+
+    def _count(self, sent: int, failed: int) -> None:
+        self._pending -= sent + failed
+        self.sent += sent
+        self.failed += failed
+        if sent:
+            now = time.monotonic()
+            self._sent_times.extend([now] * sent)
+            while self._sent_times[0] < now - 60:
+                self._sent_times.popleft()
+
+    def _finish(self, recipient: str) -> None:
+        ''' Moves on to the recipient's next queued entry; call with the condition held '''
+        queue = self._queues[recipient]
+        queue.popleft()
+        if queue:
+            heapq.heappush(self._ready, (0.0, next(self._seq), recipient))
+        else:
+            del self._queues[recipient]
+        self._condition.notify_all()
+
+    def _backoff(self, attempt: int, retry_after: Optional[str]) -> float:
+        ''' Full jitter: uniform in [0, min(max, base * 2^attempt)], never less than Retry-After '''
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
@@ -0,0 +1,150 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Uploaded media stays on WhatsApp's servers for 30 days; reuse ids for a day less
+MEDIA_ID_TTL = 29 * 24 * 3600.0
+
+
+class MediaUploadError(Exception):
+    ''' The Graph API did not return a media id for an upload '''
+
+
+class MediaUploader:
+    '''
+    Uploads outbound media (reports, charts) and remembers the returned ids.
+
+    Files are keyed by sha256 of their bytes and their mime type: sending the
+    same report again reuses the media id while it is younger than `ttl`
+    instead of uploading it again. Identical uploads in flight share one
+    request.
+
+    start() uploads in the background and returns a Future, so the upload
+    runs while the reply text is composed:
+
+        upload = media_uploads.start(chart, "image/png", "progreso.png")
+        with state.reply_batch(webhook) as reply:
+            reply.text(summary)
+            reply.media(upload, "image")
+    '''
+
+    def __init__(self, upload: Optional[Callable[[bytes, str, str], requests.Response]] = None,
+                 ttl: float = MEDIA_ID_TTL, max_entries: int = 1000, workers: int = 2,
+                 clock: Callable[[], float] = time.time):
+        self.upload_function = upload
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.workers = workers
+        self.clock = clock
+        # key -> (media id, expires at)
+        self._ids: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+        self._in_flight: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.uploads = 0
+        self.reused = 0
+
+    def init_app(self, app) -> None:
+        from .message_sender import WhatsappAPIClient
+
+        self.upload_function = WhatsappAPIClient.from_config(app.config).upload_media
+        self.ttl = app.config.get("MEDIA_ID_TTL", self.ttl)
+        self.max_entries = app.config.get("MEDIA_ID_CACHE_SIZE", self.max_entries)
+        self.workers = app.config.get("MEDIA_UPLOAD_WORKERS", self.workers)
+        self.clear()
+
+    def get(self, data: bytes, mime_type: str) -> Optional[str]:
+        ''' Cached media id for these bytes, None if never uploaded or expired '''
+        return self._cached(self._key(data, mime_type))
+
+    def upload(self, data: bytes, mime_type: str, filename: str = "file") -> str:
+        ''' Media id for these bytes, uploading them only if no valid id is cached '''
+        return self.start(data, mime_type, filename).result()
+
+    def start(self, data: bytes, mime_type: str, filename: str = "file") -> Future:
+        ''' Like upload() but returns at once; the Future resolves to the media id '''
+        key = self._key(data, mime_type)
+        media_id = self._cached(key)
+        if media_id is not None:
+            future = Future()
+            future.set_result(media_id)
+            return future
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.reused += 1
+                return future
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="media-upload")
+            future = self._executor.submit(self._upload, key, data, mime_type, filename)
+            self._in_flight[key] = future
+        return future
+
+    def forget(self, media_id: str) -> None:
+        ''' Drops an id the Graph API no longer accepts, the next send uploads again '''
+        with self._lock:
+            for key, (cached_id, _) in list(self._ids.items()):
+                if cached_id == media_id:
+                    del self._ids[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._ids.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"cached": len(self._ids), "uploads": self.uploads, "reused": self.reused}
+
+    '''
+    Internals
+    '''
+    @staticmethod
+    def _key(data: bytes, mime_type: str) -> Tuple[str, str]:
+        return hashlib.sha256(data).hexdigest(), mime_type
+
+    def _cached(self, key: Tuple[str, str]) -> Optional[str]:
+        with self._lock:
+            entry = self._ids.get(key)
+            if entry is None:
+                return None
+            media_id, expires_at = entry
+            if self.clock() >= expires_at:
+                del self._ids[key]
+                return None
+            self._ids.move_to_end(key)
+            self.reused += 1
+            return media_id
+
+    def _upload(self, key: Tuple[str, str], data: bytes, mime_type: str, filename: str) -> str:
+        try:
+            uploaded_at = self.clock()
+            response = self.upload_function(data, mime_type, filename)
+            try:
+                media_id = response.json().get("id") if response.status_code == 200 else None
+            except ValueError:
+                media_id = None
+            if not media_id:
+                raise MediaUploadError(f"Upload of {filename} failed with status {response.status_code}")
+            with self._lock:
+                self.uploads += 1
+                self._ids[key] = (media_id, uploaded_at + self.ttl)
+                self._ids.move_to_end(key)
+                while len(self._ids) > self.max_entries:
+                    self._ids.popitem(last=False)
+            logger.info(f"Uploaded {filename} ({len(data)} bytes) as media {media_id}")
+            return media_id
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+
+media_uploads = MediaUploader()
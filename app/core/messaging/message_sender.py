@@ -1,25 +1,97 @@
 from abc import ABC, abstractmethod
-from typing import Protocol, Optional, Union
+from concurrent.futures import Future
+from typing import List, Protocol, Optional, Union
 import requests
 import logging
 from dataclasses import asdict
 from flask import jsonify
 import json
 
-from .sendMessage_types import Message, TextMessage, InteractiveMessage, MediaMessage
+from .sendMessage_types import Message, TextMessage, InteractiveMessage, MediaMessage, text_message, payload_message
+from .graph_http import GraphSession, graph_http
+from .dispatcher import OutboundDispatcher
+from .templates import message_templates
 
 
 class MessageSender(Protocol):
     def send(self, message: Message) -> bool:
         '''Send a message and return whether it was succesful'''
 
+    def send_batch(self, messages: List[Message]) -> bool:
+        '''Send several messages to one recipient, in order'''
+        return all([self.send(message) for message in messages])
+
+
+class ReplyBatch:
+    '''
+    Collects the messages of a multi-part reply and hands them to the sender in
+    one call, which sends them back to back as a single queue entry.
+
+        with ReplyBatch(sender, to) as reply:
+            reply.text("Elige una opción")
+            reply.template("main_menu")
+    '''
+
+    def __init__(self, sender: MessageSender, to: str):
+        self.sender = sender
+        self.to = to
+        self.messages: List[Message] = []
+
+    def add(self, message: Message) -> "ReplyBatch":
+        self.messages.append(message)
+        return self
+
+    def text(self, body: str) -> "ReplyBatch":
+        return self.add(text_message(self.to, body))
+
+    def payload(self, payload: Union[str, dict]) -> "ReplyBatch":
+        return self.add(payload_message(self.to, payload))
+
+    def template(self, name: str) -> "ReplyBatch":
+        return self.add(message_templates.message(name, self.to))
+
+    def media(self, media: Union[str, Future], media_type: str, filename: Optional[str] = None) -> "ReplyBatch":
+        ''' Media by id, or by the Future of a MediaUploader upload (waits for it) '''
+        media_id = media.result() if isinstance(media, Future) else media
+        return self.add(MediaMessage(to=self.to, status="", type=media_type, messaging_product="whatsapp",
+                                     media_id=media_id, media_type=media_type, filename=filename))
+
+    def send(self) -> bool:
+        messages, self.messages = self.messages, []
+        if not messages:
+            return True
+        send_batch = getattr(self.sender, "send_batch", None)
+        if send_batch is None:  # Senders that only implement send()
+            return all([self.sender.send(message) for message in messages])
+        return send_batch(messages)
+
+    def __enter__(self) -> "ReplyBatch":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.send()
+
 
 class WhatsappAPIClient:
-    def __init__(self, access_token: str, api_version: str, phone_number_id:str):
+    def __init__(self, access_token: str, api_version: str, phone_number_id:str, graph_url: str = "https://graph.facebook.com",
+                 http: GraphSession = None):
         self.access_token = access_token
         self.api_version = api_version
         self.phone_number_id = phone_number_id
-        self.base_url = f"https://graph.facebook.com/{api_version}"
+        self.base_url = f"{graph_url.rstrip('/')}/{api_version}"
+        # Pooled keep-alive session shared by every Graph API call of the process
+        self.http = http or graph_http
+
+    @classmethod
+    def from_config(cls, config) -> "WhatsappAPIClient":
+        ''' Build the client from the Flask app config '''
+        return cls(
+            access_token=config.get("ACCESS_TOKEN"),
+            api_version=config.get("VERSION"),
+            phone_number_id=config.get("PHONE_NUMBER_ID"),
+            graph_url=config.get("GRAPH_API_URL", "https://graph.facebook.com"),
+        )
 
     def _get_headers(self, payload: dict) -> dict:
         ''' Get headers for API response '''
@@ -28,14 +100,27 @@ class WhatsappAPIClient:
             "Content-Type": "application/json"
         }
     
-    def send_request(self, payload: dict) -> requests.Response:
-        ''' Send request to whatsapp API '''
+    def post_message(self, payload: Union[dict, bytes]) -> requests.Response:
+        ''' POSTs a message (payload dict or encoded body) and returns the raw response, whatever its status '''
         url = f'{self.base_url}/{self.phone_number_id}/messages'
+        if isinstance(payload, bytes):
+            return self.http.post(url, headers=self._get_headers(payload), data=payload)
+        return self.http.post(url, headers=self._get_headers(payload), json=payload)
 
+    def upload_media(self, data: bytes, mime_type: str, filename: str) -> requests.Response:
+        ''' Uploads a file to the media endpoint; the response body holds its media id '''
+        url = f'{self.base_url}/{self.phone_number_id}/media'
+        return self.http.post(
+            url,
+            headers={'Authorization': f'Bearer {self.access_token}'},
+            data={'messaging_product': 'whatsapp', 'type': mime_type},
+            files={'file': (filename, data, mime_type)},
+        )
+
+    def send_request(self, payload: Union[dict, bytes]) -> requests.Response:
+        ''' Send request to whatsapp API '''
         try:
-            response = requests.post(
-                url, headers=self._get_headers,json = payload, timeout=10
-            )  # 10 seconds timeout as an example
+            response = self.post_message(payload)
             response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
         except requests.Timeout:
             logging.error("Timeout occurred while sending message")
@@ -43,21 +128,40 @@ class WhatsappAPIClient:
         except requests.RequestException as e:  # This will catch any general request exception
             logging.error(f"Request failed due to: {e}")
             return jsonify({"status": "error", "message": "Failed to send message"}), 500
+        else:
+            return response
 
 
 class WhatsappMessageSender(MessageSender):
     ''' Concrete implementation of Whatsapp Message Sender '''
 
-    def __init__(self, api_client: WhatsappAPIClient):
+    def __init__(self, api_client: WhatsappAPIClient, dispatcher: Optional[OutboundDispatcher] = None):
         self.api_client = api_client
+        self.dispatcher = dispatcher
 
     def send(self, message: Message) -> bool:
-        '''Send message through whatsapp API'''
+        '''Send message through whatsapp API, or queue it when a dispatcher is set'''
         try:
-            payload = message.to_dict()
+            payload = message.encode()
+            if self.dispatcher is not None:
+                self.dispatcher.submit(payload, to=message.to)
+                return True
             response = self.api_client.send_request(payload)
+            return isinstance(response, requests.Response)
         except Exception as e:
             logging.error(f'Exception {e} while sending the message',exc_info=True)
+            return False
+
+    def send_batch(self, messages: List[Message]) -> bool:
+        '''Queue a multi-part reply as one entry; without a dispatcher they are sent one by one'''
+        if self.dispatcher is None:
+            return all([self.send(message) for message in messages])
+        try:
+            self.dispatcher.submit_batch([message.encode() for message in messages], to=messages[0].to)
+            return True
+        except Exception as e:
+            logging.error(f'Exception {e} while queueing the messages',exc_info=True)
+            return False
 
 
 
@@ -0,0 +1,255 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.utils.path_utils import instance_path
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process ordering is available
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class Ticket:
+    '''
+    A place in a user's queue. Entering the ticket blocks until every ticket
+    taken earlier for the same key has been released; `async with` waits the
+    same way without holding a thread. A ticket is not bound to the thread
+    that entered it, so the turn can be held across executor calls.
+    '''
+
+    def __init__(self, serializer: "UserSerializer", key: str):
+        self.serializer = serializer
+        self.key = key
+        self._turn = threading.Event()
+        self._on_turn: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        # Place in the key's queue file shared by the worker processes, None without a lock_dir
+        self.number: Optional[int] = None
+
+    def __enter__(self) -> "Ticket":
+        try:
+            self._turn.wait()
+            delay = 0.001
+            while not self.serializer._file_turn(self):
+                time.sleep(delay)
+                delay = min(delay * 2, self.serializer.poll_max)
+        except BaseException:
+            self.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+    async def __aenter__(self) -> "Ticket":
+        loop = asyncio.get_running_loop()
+        turn = asyncio.Event()
+        try:
+            self._when_turn(lambda: loop.call_soon_threadsafe(turn.set))
+            await turn.wait()
+            delay = 0.001
+            while not self.serializer._file_turn(self):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.serializer.poll_max)
+        except BaseException:
+            self.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        self.release()
+
+    def release(self) -> None:
+        ''' Gives up the place, whether the ticket was entered or is still waiting '''
+        self.serializer._release(self)
+
+    '''
+    Internals
+    '''
+    def _when_turn(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if not self._turn.is_set():
+                self._on_turn.append(callback)
+                return
+        callback()
+
+    def _give_turn(self) -> None:
+        with self._lock:
+            self._turn.set()
+            callbacks, self._on_turn = self._on_turn, []
+        for callback in callbacks:
+            callback()
+
+
+class UserSerializer:
+    '''
+    Runs work for the same wa_id one at a time and in the order tickets were
+    taken, while different wa_ids proceed in parallel.
+
+    Within a process, each key has a FIFO queue of tickets. When `lock_dir` is
+    set, ticket() also takes a number in the key's queue file in that
+    directory, so the order holds across every worker process on the host
+    that shares it: a ticket is entered once the smallest number in the file
+    is its own. The file is only locked (flock) while a number is taken,
+    checked or dropped; the work itself holds no lock, and each user has a
+    file of their own, so one user's long ingest never holds up another's.
+    Numbers left by a process that died are skipped.
+    '''
+
+    def __init__(self, lock_dir: Optional[str] = None, poll_max: float = 0.02):
+        self.lock_dir = Path(lock_dir) if lock_dir else None
+        self.poll_max = poll_max
+        self._queues: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        lock_dir = app.config.get("USER_LOCK_DIR")
+        self.lock_dir = instance_path(app, lock_dir) if lock_dir else None
+        if self.lock_dir is not None:
+            if fcntl is None:
+                logger.warning("fcntl not available, per-user ordering is limited to this process")
+                self.lock_dir = None
+            else:
+                self.lock_dir.mkdir(parents=True, exist_ok=True)
+
+    def ticket(self, key: str) -> Ticket:
+        ''' Reserves the next place in the queue for key without waiting for it '''
+        ticket = Ticket(self, key)
+        with self._lock:
+            queue = self._queues.setdefault(key, deque())
+            queue.append(ticket)
+            if len(queue) == 1:
+                ticket._give_turn()
+        if self.lock_dir is not None:
+            try:
+                ticket.number = self._update_queue_file(key, self._take_number)
+            except BaseException:
+                self._release(ticket)
+                raise
+        return ticket
+
+    @contextmanager
+    def hold(self, key: str):
+        ''' Blocks until it is key's turn and holds it for the duration of the block '''
+        with self.ticket(key) as ticket:
+            yield ticket
+
+    def pending(self, key: str) -> int:
+        with self._lock:
+            return len(self._queues.get(key, ()))
+
+    '''
+    Internals
+    '''
+    def _release(self, ticket: Ticket) -> None:
+        try:
+            if ticket.number is not None:
+                number, ticket.number = ticket.number, None
+                self._update_queue_file(ticket.key, lambda queue: self._drop_number(queue, number))
+        finally:
+            self._release_in_process(ticket)
+
+    def _release_in_process(self, ticket: Ticket) -> None:
+        with self._lock:
+            queue = self._queues.get(ticket.key)
+            if not queue:
+                return
+            if queue[0] is ticket:
+                queue.popleft()
+                if queue:
+                    queue[0]._give_turn()
+            elif ticket in queue:
+                queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.key]
+
+    def _file_turn(self, ticket: Ticket) -> bool:
+        ''' Whether no live process holds an earlier number for the ticket's key '''
+        if ticket.number is None:
+            return True
+        return self._update_queue_file(ticket.key, lambda queue: self._is_first(queue, ticket.number))
+
+    def _update_queue_file(self, key: str, update: Callable[["_QueueFile"], object]):
+        ''' Calls update() on the key's queue file, locked, and writes its changes back; returns its result '''
+        name = re.sub(r"[^0-9A-Za-z_-]", "_", key)
+        with open(self.lock_dir / f"user-{name}.queue", "a+") as handle:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX)  # Released when the file is closed
+            handle.seek(0)
+            queue = _QueueFile.parse(handle.read())
+            result = update(queue)
+            handle.seek(0)
+            handle.truncate()
+            handle.write(queue.dump())
+            handle.flush()
+        return result
+
+    @staticmethod
+    def _take_number(queue: "_QueueFile") -> int:
+        number = queue.next_number
+        queue.entries.append((number, os.getpid()))
+        queue.next_number += 1
+        return number
+
+    @staticmethod
+    def _drop_number(queue: "_QueueFile", number: int) -> None:
+        queue.entries = [entry for entry in queue.entries if entry[0] != number]
+
+    @staticmethod
+    def _is_first(queue: "_QueueFile", number: int) -> bool:
+        # Tickets of a process that died without releasing them would hold the user forever
+        queue.entries = [(queued, pid) for queued, pid in queue.entries if pid == os.getpid() or pid_alive(pid)]
+        return queue.entries[0][0] == number
+
+
+class _QueueFile:
+    ''' Contents of a key's queue file: the next number to hand out and a (number, pid) per ticket, oldest first '''
+
+    def __init__(self, next_number: int, entries: List[Tuple[int, int]]):
+        self.next_number = next_number
+        self.entries = entries
+
+    @classmethod
+    def parse(cls, text: str) -> "_QueueFile":
+        values = [int(value) for value in text.split()]
+        return cls(values[0] if values else 0, list(zip(values[1::2], values[2::2])))
+
+    def dump(self) -> str:
+        return " ".join(str(value) for value in (self.next_number, *itertools.chain(*self.entries)))
+
+
+def sender_wa_id(body: bytes) -> Optional[str]:
+    '''
+    wa_id of the user who sent a raw webhook body, read before the payload is
+    validated so the ticket is taken in arrival order. None for status
+    updates and for bodies that are not a message webhook.
+    '''
+    try:
+        return json.loads(body)["entry"][0]["changes"][0]["value"]["contacts"][0]["wa_id"]
+    except (ValueError, LookupError, TypeError):
+        return None
+
+
+def pid_alive(pid: int) -> bool:
+    ''' Whether a process with this pid runs on the host '''
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+user_serializer = UserSerializer()
@@ -1,6 +1,27 @@
 from enum import Enum
 from dataclasses import dataclass, field
-from typing import Optional, List, Literal
+from typing import Optional, List, Literal, Union
+from json.encoder import encode_basestring
+import json
+
+'''
+Outbound message types are frozen and slotted: no per-instance __dict__, and a
+message can be shared between threads (the reply queue) without copying.
+
+Besides to_dict(), every object writes itself as JSON fragments into a list
+(`_encode`), so Message.encode() builds the request body in a single pass,
+without the intermediate dicts. Slotted dataclasses can't use zero-argument
+super(), parent methods are called by class name.
+'''
+
+def encode_payload(payload: dict) -> bytes:
+    '''Compact UTF-8 JSON, the wire format of every outbound message'''
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+# JSON string literal of a str, same escaping as json.dumps(..., ensure_ascii=False)
+_str = encode_basestring
+
 
 class MessageType(Enum):
     TEXT = "text"
@@ -8,7 +29,7 @@ class MessageType(Enum):
     INTERACTIVE = "interactive"
     STATUS = "status"
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Message:
     to: str  # Identificador de WhatsApp o número de teléfono del cliente
     status: str
@@ -24,6 +45,26 @@ class Message:
             "type": self.type
         }
 
+    def encode(self) -> bytes:
+        """Request body sent to the Graph API"""
+        out = []
+        self._encode(out)
+        return "".join(out).encode()
+
+    def _encode(self, out: list) -> None:
+        out.append('{')
+        self._encode_fields(out)
+        out.append('}')
+
+    def _encode_fields(self, out: list) -> None:
+        """Fields between the braces, subclasses append theirs"""
+        out.append('"messaging_product":')
+        out.append(_str(self.messaging_product))
+        out.append(',"recipient_type":"individual","to":')
+        out.append(_str(self.to))
+        out.append(',"type":')
+        out.append(_str(self.type))
+
     def send_reply(self, content: str) -> None:
         '''Send reply to this message'''
         pass
@@ -31,7 +72,7 @@ class Message:
 '''
 Text message and related objects
 '''
-@dataclass
+@dataclass(frozen=True, slots=True)
 class TextObject:
     body: str  # Body of the message
     preview_url: bool
@@ -39,39 +80,59 @@ class TextObject:
     def to_dict(self) -> dict:
         return {'body': self.body, 'preview_url': self.preview_url}
 
-@dataclass
+    def _encode(self, out: list) -> None:
+        out.append('{"body":')
+        out.append(_str(self.body))
+        out.append(',"preview_url":true}' if self.preview_url else ',"preview_url":false}')
+
+@dataclass(frozen=True, slots=True)
 class TextMessage(Message):
     '''Text message implementation'''
     text: TextObject
-    
+
     def __post_init__(self):
-        self.type = "text"
+        object.__setattr__(self, "type", "text")
 
     def to_dict(self) -> dict:
-        base_dict = super().to_dict()
+        base_dict = Message.to_dict(self)
         return {
             **base_dict,
             'text': self.text.to_dict()
         }
 
+    def _encode_fields(self, out: list) -> None:
+        Message._encode_fields(self, out)
+        out.append(',"text":')
+        self.text._encode(out)
+
 '''
 Interactive message and related objects
 '''
-@dataclass
+@dataclass(frozen=True, slots=True)
 class InteractiveBodyObject:
     text: str  # 60 char max
 
     def to_dict(self) -> dict:
         return {"text": self.text}
 
-@dataclass
+    def _encode(self, out: list) -> None:
+        out.append('{"text":')
+        out.append(_str(self.text))
+        out.append('}')
+
+@dataclass(frozen=True, slots=True)
 class FooterObject:
     text: str  # 60 char max
 
     def to_dict(self) -> dict:
         return {"text": self.text}
 
-@dataclass
+    def _encode(self, out: list) -> None:
+        out.append('{"text":')
+        out.append(_str(self.text))
+        out.append('}')
+
+@dataclass(frozen=True, slots=True)
 class Row:
     id: str  # max 24 char
     title: str  # max 200 char
@@ -84,7 +145,7 @@ class Row:
             raise ValueError("Title must be 200 characters or less")
         if self.description and len(self.description) > 72:
             raise ValueError("Description must be 72 characters or less")
-        
+
     def to_dict(self) -> dict:
         row_dict = {
             "id": self.id,
@@ -94,7 +155,17 @@ class Row:
             row_dict["description"] = self.description
         return row_dict
 
-@dataclass
+    def _encode(self, out: list) -> None:
+        out.append('{"id":')
+        out.append(_str(self.id))
+        out.append(',"title":')
+        out.append(_str(self.title))
+        if self.description:
+            out.append(',"description":')
+            out.append(_str(self.description))
+        out.append('}')
+
+@dataclass(frozen=True, slots=True)
 class SectionObject:
     rows: Optional[List[Row]] = None
     title: Optional[str] = None  # Obligatory if there are more than 1 section
@@ -107,7 +178,23 @@ class SectionObject:
             section_dict["rows"] = [row.to_dict() for row in self.rows]
         return section_dict
 
-@dataclass
+    def _encode(self, out: list) -> None:
+        separator = '{'
+        if self.title:
+            out.append('{"title":')
+            out.append(_str(self.title))
+            separator = ','
+        if self.rows:
+            out.append(separator + '"rows":[')
+            for index, row in enumerate(self.rows):
+                if index:
+                    out.append(',')
+                row._encode(out)
+            out.append(']}')
+        else:
+            out.append('{}' if separator == '{' else '}')
+
+@dataclass(frozen=True, slots=True)
 class ActionObject:
     sections: List[SectionObject]
 
@@ -116,7 +203,15 @@ class ActionObject:
             'sections': [section.to_dict() for section in self.sections]
         }
 
-@dataclass
+    def _encode(self, out: list) -> None:
+        out.append('{"sections":[')
+        for index, section in enumerate(self.sections):
+            if index:
+                out.append(',')
+            section._encode(out)
+        out.append(']}')
+
+@dataclass(frozen=True, slots=True)
 class HeaderObject:
     type: str
     sub_text: Optional[str]
@@ -127,18 +222,35 @@ class HeaderObject:
             "sub_text": self.sub_text
         }
 
-@dataclass
+    def _encode(self, out: list) -> None:
+        out.append('{')
+        self._encode_fields(out)
+        out.append('}')
+
+    def _encode_fields(self, out: list) -> None:
+        """Fields between the braces, subclasses append theirs"""
+        out.append('"type":')
+        out.append(_str(self.type))
+        out.append(',"sub_text":')
+        out.append('null' if self.sub_text is None else _str(self.sub_text))
+
+@dataclass(frozen=True, slots=True)
 class TextHeader(HeaderObject):
     text: str  # Max 60 char
 
     def to_dict(self) -> dict:
-        base_dict = super().to_dict()
+        base_dict = HeaderObject.to_dict(self)
         return {
             **base_dict,
             'text': self.text
         }
 
-@dataclass
+    def _encode_fields(self, out: list) -> None:
+        HeaderObject._encode_fields(self, out)
+        out.append(',"text":')
+        out.append(_str(self.text))
+
+@dataclass(frozen=True, slots=True)
 class InteractiveObject:
     type: Literal["list"]
     action: ActionObject
@@ -158,24 +270,44 @@ class InteractiveObject:
             interactive_dict['footer'] = self.footer.to_dict()
         return interactive_dict
 
-@dataclass
+    def _encode(self, out: list) -> None:
+        out.append('{"type":')
+        out.append(_str(self.type))
+        out.append(',"action":')
+        self.action._encode(out)
+        out.append(',"header":')
+        self.header._encode(out)
+        if self.body:
+            out.append(',"body":')
+            self.body._encode(out)
+        if self.footer:
+            out.append(',"footer":')
+            self.footer._encode(out)
+        out.append('}')
+
+@dataclass(frozen=True, slots=True)
 class InteractiveMessage(Message):
     interactive: InteractiveObject
 
     def __post_init__(self):
-        self.type = "interactive"
+        object.__setattr__(self, "type", "interactive")
 
     def to_dict(self) -> dict:
-        base_dict = super().to_dict()
+        base_dict = Message.to_dict(self)
         return {
             **base_dict,
             'interactive': self.interactive.to_dict()
         }
 
+    def _encode_fields(self, out: list) -> None:
+        Message._encode_fields(self, out)
+        out.append(',"interactive":')
+        self.interactive._encode(out)
+
 '''
 Multimedia message and related objects
 '''
-@dataclass
+@dataclass(frozen=True, slots=True)
 class MediaMessage(Message):
     media_id: str
     media_type: str  # document, image, video, etc.
@@ -183,21 +315,70 @@ class MediaMessage(Message):
     filename: Optional[str] = None  # Only use with documents
 
     def __post_init__(self):
-        self.type = self.media_type
+        object.__setattr__(self, "type", self.media_type)
 
     def to_dict(self) -> dict:
-        base_dict = super().to_dict()
+        base_dict = Message.to_dict(self)
         media_dict = {}
-        
+
         if self.media_id:
             media_dict["id"] = self.media_id
         elif self.link:
             media_dict["link"] = self.link
-            
+
         if self.media_type == "document" and self.filename:
             media_dict["filename"] = self.filename
 
         return {
             **base_dict,
             self.media_type: media_dict
-        }
\ No newline at end of file
+        }
+
+    def _encode_fields(self, out: list) -> None:
+        Message._encode_fields(self, out)
+        out.append(',')
+        out.append(_str(self.media_type))
+        fields = []
+        if self.media_id:
+            fields.append('"id":' + _str(self.media_id))
+        elif self.link:
+            fields.append('"link":' + _str(self.link))
+        if self.media_type == "document" and self.filename:
+            fields.append('"filename":' + _str(self.filename))
+        out.append(':{' + ','.join(fields) + '}')
+
+
+'''
+Ready-made payloads (interactive list templates) and shortcuts
+'''
+@dataclass(frozen=True, slots=True)
+class PayloadMessage(Message):
+    '''Message whose body is a prebuilt payload, addressed to `to` when sent'''
+    payload: dict
+
+    def __post_init__(self):
+        object.__setattr__(self, "type", self.payload.get("type", self.type))
+
+    def to_dict(self) -> dict:
+        return {
+            **self.payload,
+            **Message.to_dict(self)
+        }
+
+    def encode(self) -> bytes:
+        return encode_payload(self.to_dict())
+
+
+def text_message(to: str, body: str, preview_url: bool = False) -> TextMessage:
+    '''Plain text reply to `to`'''
+    return TextMessage(
+        to=to, status="", type="text", messaging_product="whatsapp",
+        text=TextObject(body=body, preview_url=preview_url)
+    )
+
+
+def payload_message(to: str, payload: Union[str, dict]) -> PayloadMessage:
+    '''Template payload (JSON string or dict) addressed to `to`'''
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    return PayloadMessage(to=to, status="", type="", messaging_product="whatsapp", payload=payload)
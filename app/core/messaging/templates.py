@@ -0,0 +1,107 @@
+import json
+import logging
+from dataclasses import dataclass
+from typing import Dict, Type
+
+from pydantic import BaseModel
+
+from app.models.payload_send_models import SendInteractivePayload, SendTextPayload
+from .sendMessage_types import Message, encode_payload
+
+logger = logging.getLogger(__name__)
+
+# Stands in for the recipient while the template is serialized
+_RECIPIENT_SLOT = "\x00to\x00"
+
+
+class MessageTemplate:
+    '''
+    A payload validated and serialized once. Sending it only splices the
+    recipient's JSON string between the cached bytes before and after `to`.
+    '''
+
+    __slots__ = ("name", "type", "_payload", "_head", "_tail")
+
+    def __init__(self, name: str, payload: dict, model: Type[BaseModel]):
+        model.model_validate(payload)
+        self.name = name
+        self.type = payload["type"]
+        self._payload = payload
+        body = encode_payload({**payload, "to": _RECIPIENT_SLOT})
+        slot = json.dumps(_RECIPIENT_SLOT).encode()
+        self._head, self._tail = body.split(slot)
+
+    def body(self, to: str) -> bytes:
+        return self._head + json.dumps(to).encode() + self._tail
+
+    def payload(self, to: str) -> dict:
+        return {**self._payload, "to": to}
+
+    def message(self, to: str) -> "TemplateMessage":
+        return TemplateMessage(to=to, status="", type=self.type, messaging_product="whatsapp", template=self)
+
+
+@dataclass(frozen=True, slots=True)
+class TemplateMessage(Message):
+    ''' Message built from a template; encode() returns the cached bytes with the recipient spliced in '''
+    template: MessageTemplate
+
+    def to_dict(self) -> dict:
+        return self.template.payload(self.to)
+
+    def encode(self) -> bytes:
+        return self.template.body(self.to)
+
+
+class TemplateRegistry:
+    '''
+    Named outbound templates: the interactive lists of app.static and the text
+    prompts the bot repeats verbatim. init_app validates all of them against
+    payload_send_models, so a broken template stops the app at startup instead
+    of failing on a user's first message.
+    '''
+
+    def __init__(self):
+        self._templates: Dict[str, MessageTemplate] = {}
+
+    def init_app(self, app) -> None:
+        self.load_static_templates()
+
+    def load_static_templates(self) -> None:
+        from app.static.interactive_list_template import interactive_list_1, interactive_list_2
+        from app.static.text_templates import text_templates
+
+        self.register("main_menu", json.loads(interactive_list_1))
+        self.register("training_menu", json.loads(interactive_list_2))
+        for name, body in text_templates.items():
+            self.register_text(name, body)
+        logger.info(f"Loaded {len(self._templates)} message templates")
+
+    def register(self, name: str, payload: dict, model: Type[BaseModel] = SendInteractivePayload) -> MessageTemplate:
+        template = MessageTemplate(name, payload, model)
+        self._templates[name] = template
+        return template
+
+    def register_text(self, name: str, body: str, preview_url: bool = False) -> MessageTemplate:
+        payload = {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": "",
+            "type": "text",
+            "text": {"preview_url": preview_url, "body": body},
+        }
+        return self.register(name, payload, SendTextPayload)
+
+    def __getitem__(self, name: str) -> MessageTemplate:
+        if not self._templates:
+            self.load_static_templates()
+        return self._templates[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._templates
+
+    def message(self, name: str, to: str) -> TemplateMessage:
+        return self[name].message(to)
+
+
+message_templates = TemplateRegistry()
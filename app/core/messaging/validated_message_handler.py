@@ -1,13 +1,21 @@
-from typing import Protocol, Optional
+import logging
+from typing import IO, Protocol, Optional
 from .validator import ValidatedWebhookPayload
-from .message_sender import WhatsappMessageSender, MessageSender
-from app.static.interactive_list_template import interactive_list_1, interactive_list_2
+from .message_sender import WhatsappMessageSender, MessageSender, ReplyBatch
+from .templates import message_templates
+from .commands import command_router
 from app.utils.document_utils import download_adr_document_from_webhook
 
 class MessageHandler(Protocol):
     def handle_message(self, validated_message: ValidatedWebhookPayload) -> None: ...
 
 
+def get_recipient(validated_message: ValidatedWebhookPayload) -> str:
+    '''Replies go back to the wa_id that sent the message'''
+    _, wa_id = validated_message.get_user_contact_info()
+    return wa_id
+
+
 class IdleStateMessageHandler(MessageHandler):
     '''
     Returns 
@@ -35,9 +43,10 @@ class IdleStateMessageHandler(MessageHandler):
     def _handle_text(self, validated_message: ValidatedWebhookPayload) -> None:
         body = validated_message.get_body_of_text_message()
 
-        print(f'User replied {body}')
-        self.message_sender.send("Por favor, elige una opcion de la lista")
-        self.message_sender.send(interactive_list_1)
+        logging.debug(f'User replied {body}')
+        with ReplyBatch(self.message_sender, get_recipient(validated_message)) as reply:
+            reply.template("choose_option")
+            reply.template("main_menu")
 
 
     def _handle_interactive(self, validated_message: ValidatedWebhookPayload) -> Optional[str]:
@@ -45,7 +54,7 @@ class IdleStateMessageHandler(MessageHandler):
         id,title = message_content.list_reply.get_list_reply_content()
 
         if id == 'training' and title == 'Opciones entrenamiento':
-            response_list = self.message_sender.send(interactive_list_2)
+            response_list = self.message_sender.send(message_templates.message("training_menu", get_recipient(validated_message)))
             return "TRAINING SELECTED"
 
 
@@ -67,17 +76,18 @@ class TrainingManagementStateMessageHandler(MessageHandler):
             return None
         
         except Exception as e:
-            self.message_sender("Ha habido un error con tu petición, vuelve a seleccionar la opción")
+            self.message_sender.send(message_templates.message("request_error", get_recipient(validated_message)))
             raise Exception(f"Unexpected error {str(e)}")
 
     def _handle_text(self, validated_message: ValidatedWebhookPayload) -> Optional[str]:
         body = validated_message.get_body_of_text_message()
-        print(f'User replied {body}')
-        if 'finitto' in body.lower():
+        logging.debug(f'User replied {body}')
+        if command_router.matches(body, "finish"):
             return "END"
         else:
-            self.message_sender.send("Elige qué quieres hacer en tu entrenamiento")
-            self.message_sender.send(interactive_list_2)
+            with ReplyBatch(self.message_sender, get_recipient(validated_message)) as reply:
+                reply.template("choose_training_option")
+                reply.template("training_menu")
 
 
     def _handle_interactive(self, validated_message: ValidatedWebhookPayload) -> Optional[str]:
@@ -87,7 +97,7 @@ class TrainingManagementStateMessageHandler(MessageHandler):
         if id == 'add_training' and title == 'Añade un entrenamiento':
             return "ADD TRAINING"
         else:
-            self.message_sender.send("Selecciona otra opción, esta aun no está lista.")
+            self.message_sender.send(message_templates.message("option_not_ready", get_recipient(validated_message)))
 
 
 
@@ -107,10 +117,10 @@ class AddTrainingStateMessageHandler(MessageHandler):
                 return action
             
             elif webhook_type == 'document':
-                document_path = self._handle_document(validated_message)
-                if document_path:
-                    self.message_sender.send("ADR document recibido correctamente")
-                    return document_path
+                document = self._handle_document(validated_message)
+                if document:
+                    self.message_sender.send(message_templates.message("document_received", get_recipient(validated_message)))
+                    return document
 
                 return None
             
@@ -118,22 +128,22 @@ class AddTrainingStateMessageHandler(MessageHandler):
             return None
         
         except Exception as e:
-            self.message_sender.send("Ha habido un error con tu petición, vuelve a seleccionar la opción")
+            self.message_sender.send(message_templates.message("request_error", get_recipient(validated_message)))
             raise Exception(f"Unexpected error {str(e)}")
 
     def _handle_text(self, validated_message: ValidatedWebhookPayload) -> Optional[str]:
         body = validated_message.get_body_of_text_message()
-        print(f'User replied {body}')
-        if 'finitto' in body.lower():
+        logging.debug(f'User replied {body}')
+        if command_router.matches(body, "finish"):
             return "END"
         else:
-            self.message_sender.send("Manda tus datos en csv o envía finitto para acabar la sesión.")
-            self.message_sender.send(interactive_list_2)
+            with ReplyBatch(self.message_sender, get_recipient(validated_message)) as reply:
+                reply.template("send_csv")
+                reply.template("training_menu")
 
 
     def _handle_interactive(self, validated_message: ValidatedWebhookPayload) -> Optional[str]:
-        self.message_sender.send("Ya has seleccionado una opción. Actualmente estás REGISTRANDO ENTRENAMIENTO\nPara acabar esta sesión, responde finitto")
+        self.message_sender.send(message_templates.message("already_adding_training", get_recipient(validated_message)))
 
-    def _handle_document(self, validated_message: ValidatedWebhookPayload) -> Optional[str]:
-        download_path = download_adr_document_from_webhook(validated_message)
-        return download_path
\ No newline at end of file
+    def _handle_document(self, validated_message: ValidatedWebhookPayload) -> Optional[IO[bytes]]:
+        return download_adr_document_from_webhook(validated_message)
\ No newline at end of file
@@ -0,0 +1,248 @@
+import logging
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import sqlalchemy as sa
+
+from app.extensions import run_read
+from app.core.messaging.commands import Command, normalize_text
+from app.models.models import Exercise, TrainingDetail
+
+logger = logging.getLogger(__name__)
+
+# Mean propulsive velocity at 1RM when the exercise is not in EXERCISE_V1RM
+DEFAULT_V1RM = 0.3
+
+
+@dataclass(frozen=True)
+class LoadVelocityProfile:
+    '''
+    Load-velocity relation of one exercise, fitted on the fastest rep of each
+    set: kg = intercept + slope * vmp. With a single load there is no line and
+    one_rm is the encoder's own estimate.
+    '''
+    exercise: str
+    v1rm: float
+    one_rm: Optional[float]
+    slope: Optional[float]
+    intercept: Optional[float]
+    sets: int
+    last_seen: datetime
+
+
+@dataclass(frozen=True)
+class ExerciseSummary:
+    exercise: str
+    sets: int
+    reps: int
+    max_kg: float
+    best_vmp: Optional[float]
+
+
+@dataclass(frozen=True)
+class UserAnalytics:
+    profiles: Dict[str, LoadVelocityProfile]
+    last_session: Optional[datetime]
+    last_session_exercises: Tuple[ExerciseSummary, ...]
+
+    def find_profile(self, words: Sequence[str]) -> Optional[LoadVelocityProfile]:
+        ''' Profile whose exercise name contains every word, the most recently trained if several do '''
+        if not words:
+            candidates = list(self.profiles.values())
+        else:
+            candidates = [profile for name, profile in self.profiles.items()
+                          if all(word in name for word in words)]
+        return max(candidates, key=lambda profile: profile.last_seen, default=None)
+
+
+class TrainingAnalytics:
+    '''
+    Per-user training figures the bot answers commands with (1RM per
+    exercise, last session), computed once from the reps of the last
+    `window_days` and kept `ttl` seconds. Ingesting a document calls
+    invalidate() for its user in this process; other workers see the new
+    data when their entry expires.
+    '''
+
+    def __init__(self, ttl: float = 600.0, max_entries: int = 5000, window_days: int = 90,
+                 v1rm: Optional[Dict[str, float]] = None, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.window_days = window_days
+        self.clock = clock
+        self._v1rm = {normalize_text(name): value for name, value in (v1rm or {}).items()}
+        # user id -> (analytics, expires at)
+        self._entries: "OrderedDict[int, Tuple[UserAnalytics, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app) -> None:
+        self.ttl = app.config.get("ANALYTICS_CACHE_TTL", self.ttl)
+        self.max_entries = app.config.get("ANALYTICS_CACHE_SIZE", self.max_entries)
+        self.window_days = app.config.get("ANALYTICS_WINDOW_DAYS", self.window_days)
+        self._v1rm = {normalize_text(name): value for name, value in app.config.get("EXERCISE_V1RM", {}).items()}
+        self.clear()
+
+    def for_user(self, user_id: int) -> UserAnalytics:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and self.clock() < entry[1]:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        analytics = self._compute(user_id)
+        with self._lock:
+            self._entries[user_id] = (analytics, self.clock() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return analytics
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def v1rm(self, exercise: str) -> float:
+        return self._v1rm.get(normalize_text(exercise), DEFAULT_V1RM)
+
+    '''
+    Internals
+    '''
+    def _compute(self, user_id: int) -> UserAnalytics:
+        since = datetime.now(timezone.utc) - timedelta(days=self.window_days)
+        query = (
+            sa.select(TrainingDetail.session_id, TrainingDetail.serie, TrainingDetail.kg, TrainingDetail.vmp,
+                      TrainingDetail.rm, TrainingDetail.timestamp, Exercise.name)
+            .join(Exercise, TrainingDetail.ejercicio_id == Exercise.id)
+            .where(TrainingDetail.atleta_id == user_id, TrainingDetail.timestamp >= since)
+        )
+        # (exercise, session, serie) -> [kg, best vmp, encoder rm of that rep, reps, last timestamp]
+        sets: Dict[Tuple[str, int, int], list] = {}
+        last_session, last_seen = None, None
+        rows = run_read(lambda session: session.execute(query).all())
+        for session_id, serie, kg, vmp, rm, timestamp, name in rows:
+            current = sets.get((name, session_id, serie))
+            if current is None:
+                sets[(name, session_id, serie)] = [kg, vmp, rm, 1, timestamp]
+            else:
+                current[3] += 1
+                if vmp is not None and (current[1] is None or vmp > current[1]):
+                    current[0], current[1], current[2] = kg, vmp, rm
+                current[4] = max(current[4], timestamp)
+            if last_seen is None or timestamp > last_seen:
+                last_session, last_seen = session_id, timestamp
+
+        by_exercise: Dict[str, List[list]] = {}
+        for (name, _, _), values in sets.items():
+            by_exercise.setdefault(name, []).append(values)
+        profiles = {normalize_text(name): self._profile(name, values) for name, values in by_exercise.items()}
+
+        summaries = []
+        for name in sorted({name for name, session_id, _ in sets if session_id == last_session}):
+            session_sets = [values for (set_name, session_id, _), values in sets.items()
+                            if set_name == name and session_id == last_session]
+            velocities = [values[1] for values in session_sets if values[1] is not None]
+            summaries.append(ExerciseSummary(
+                exercise=name,
+                sets=len(session_sets),
+                reps=sum(values[3] for values in session_sets),
+                max_kg=max(values[0] for values in session_sets),
+                best_vmp=max(velocities, default=None),
+            ))
+        return UserAnalytics(profiles, last_seen, tuple(summaries))
+
+    def _profile(self, exercise: str, sets: List[list]) -> LoadVelocityProfile:
+        v1rm = self.v1rm(exercise)
+        points = [(values[0], values[1]) for values in sets if values[1] is not None]
+        slope = intercept = one_rm = None
+        if len({kg for kg, _ in points}) >= 2:
+            mean_v = statistics.fmean(v for _, v in points)
+            mean_kg = statistics.fmean(kg for kg, _ in points)
+            spread = sum((v - mean_v) ** 2 for _, v in points)
+            fitted = sum((v - mean_v) * (kg - mean_kg) for kg, v in points) / spread if spread else 0.0
+            # Heavier loads have to move slower; anything else is noise, not a profile
+            if fitted < 0:
+                slope, intercept = fitted, mean_kg - fitted * mean_v
+                one_rm = intercept + slope * v1rm
+        if one_rm is None:
+            estimates = [values[2] for values in sets if values[2]]
+            one_rm = statistics.median(estimates) if estimates else None
+        return LoadVelocityProfile(exercise, v1rm, one_rm, slope, intercept, len(sets),
+                                   max(values[4] for values in sets))
+
+
+training_analytics = TrainingAnalytics()
+
+
+'''
+Answers to the router's commands
+'''
+def answer_command(command: Command, user_id: int) -> Optional[str]:
+    ''' Reply text for an analytics command, None for commands that are not about training data '''
+    if command.name == "summary":
+        return summary_text(training_analytics.for_user(user_id))
+    if command.name == "one_rm":
+        return one_rm_text(training_analytics.for_user(user_id), command.args)
+    if command.name == "load_velocity":
+        return load_velocity_text(training_analytics.for_user(user_id), float(command.values["kg"]),
+                                  float(command.values["velocity"]), command.args)
+    return None
+
+
+NO_DATA_TEXT = "Todavía no tengo entrenamientos tuyos. Envía tu exportación del encoder (csv) para empezar."
+
+
+def summary_text(analytics: UserAnalytics) -> str:
+    if analytics.last_session is None:
+        return NO_DATA_TEXT
+    lines = [f"Tu última sesión ({analytics.last_session:%d/%m/%Y}):"]
+    for summary in analytics.last_session_exercises:
+        line = f"• {summary.exercise}: {summary.sets} series, {summary.reps} repeticiones, hasta {summary.max_kg:g} kg"
+        if summary.best_vmp is not None:
+            line += f", mejor VMP {summary.best_vmp:.2f} m/s"
+        profile = analytics.profiles.get(normalize_text(summary.exercise))
+        if profile is not None and profile.one_rm is not None:
+            line += f", RM estimado {profile.one_rm:.0f} kg"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def one_rm_text(analytics: UserAnalytics, words: Sequence[str]) -> str:
+    if not analytics.profiles:
+        return NO_DATA_TEXT
+    profile = analytics.find_profile(words)
+    if profile is None:
+        known = ", ".join(sorted(known.exercise for known in analytics.profiles.values()))
+        return f"No tengo datos de «{' '.join(words)}». Ejercicios registrados: {known}."
+    if profile.one_rm is None:
+        return f"No tengo suficientes datos de {profile.exercise} para estimar tu RM."
+    if profile.slope is None:
+        return (f"{profile.exercise}: RM estimado {profile.one_rm:.0f} kg (estimación del encoder; "
+                f"entrena con al menos dos cargas distintas para calcular tu perfil carga-velocidad).")
+    return (f"{profile.exercise}: RM estimado {profile.one_rm:.0f} kg, según tu perfil carga-velocidad "
+            f"de {profile.sets} series (VMP en el RM {profile.v1rm:.2f} m/s).")
+
+
+def load_velocity_text(analytics: UserAnalytics, kg: float, velocity: float, words: Sequence[str]) -> str:
+    profile = analytics.find_profile(words)
+    if profile is None or profile.slope is None:
+        return ("Para estimar tu RM con una serie necesito tu perfil carga-velocidad: "
+                "registra series con al menos dos cargas distintas de ese ejercicio.")
+    if velocity <= profile.v1rm:
+        return f"A {velocity:.2f} m/s {kg:g} kg ya es tu RM en {profile.exercise}."
+    # Same slope as the athlete's profile, moved to pass through today's set
+    one_rm = kg + profile.slope * (profile.v1rm - velocity)
+    return (f"{profile.exercise}: {kg:g} kg a {velocity:.2f} m/s es el {100 * kg / one_rm:.0f}% "
+            f"de un RM estimado de {one_rm:.0f} kg.")
@@ -1,3 +1,125 @@
+import logging
+from typing import Callable, TypeVar
+
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy()
+
+logger = logging.getLogger(__name__)
+
+# app.extensions key of the read-only engine for heavy reads
+READ_BIND = "read_bind"
+# PRAGMAs that write the database file, a read-only connection cannot run them
+WRITING_PRAGMAS = ("journal_mode",)
+
+T = TypeVar("T")
+
+
+def sqlite_profile(app) -> dict:
+    ''' The SQLITE_PROFILES entry named by SQLITE_PROFILE, {} for SQLite's own defaults '''
+    name = app.config.get("SQLITE_PROFILE") or "default"
+    profiles = app.config.get("SQLITE_PROFILES", {})
+    if name not in profiles:
+        raise ValueError(f"Unknown SQLITE_PROFILE {name}, expected one of {sorted(profiles)}")
+    return profiles[name]
+
+
+def configure_engine_options(app) -> None:
+    '''
+    Merges the pool settings of the SQLite profile into
+    SQLALCHEMY_ENGINE_OPTIONS. Must run before db.init_app, which builds the
+    engines; options set explicitly in the config win.
+    '''
+    uri = str(app.config.get("SQLALCHEMY_DATABASE_URI") or "")
+    # In-memory databases live in a single connection, there is no pool to size
+    if not uri.startswith("sqlite") or uri in ("sqlite://", "sqlite:///:memory:"):
+        return
+    options = dict(sqlite_profile(app).get("engine", {}))
+    options.update(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = options
+
+
+def apply_sqlite_pragmas(engine: sa.engine.Engine, pragmas: dict) -> None:
+    ''' Runs the PRAGMAs on every new DBAPI connection of the engine, before the pool hands it out '''
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+        finally:
+            cursor.close()
+
+    sa.event.listen(engine, "connect", on_connect)
+    logger.info(f"SQLite PRAGMAs for {engine.url}: {pragmas}")
+
+
+def init_sqlite_profile(app) -> None:
+    ''' Applies the profile's PRAGMAs to every SQLite engine of the app, after db.init_app '''
+    pragmas = sqlite_profile(app).get("pragmas", {})
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, pragmas)
+
+
+def sqlite_read_only_uri(url: sa.engine.URL) -> sa.engine.URL:
+    ''' URL opening the same SQLite file in read-only mode '''
+    database = url.database if url.query.get("uri") else f"file:{url.database}"
+    return url.set(database=database, query={**url.query, "mode": "ro", "uri": "true"})
+
+
+def init_read_bind(app) -> None:
+    '''
+    Creates the read-only engine for heavy reads, after init_sqlite_profile:
+    READ_DATABASE_URI (a replica) when set, otherwise with SQLITE_READ_ONLY_BIND
+    a second pool on the primary's SQLite file, opened read-only. Without
+    either, run_read() uses the primary.
+
+    It is not one of db's binds, those are for models: create_all and the
+    migrations must not see it.
+    '''
+    with app.app_context():
+        primary = db.engine.url
+    url = app.config.get("READ_DATABASE_URI")
+    # An in-memory database is private to its connection, there is no file to open twice
+    if not url and app.config.get("SQLITE_READ_ONLY_BIND") and primary.get_backend_name() == "sqlite" \
+            and primary.database not in (None, "", ":memory:"):
+        url = sqlite_read_only_uri(primary)
+    engine = sa.create_engine(url, **app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})) if url else None
+    if engine is not None:
+        pragmas = {name: value for name, value in sqlite_profile(app).get("pragmas", {}).items()
+                   if name not in WRITING_PRAGMAS}
+        apply_sqlite_pragmas(engine, {**pragmas, "query_only": 1})
+    previous = app.extensions.get(READ_BIND)
+    if previous is not None:
+        previous.dispose()
+    app.extensions[READ_BIND] = engine
+
+
+def run_read(work: Callable[[so.Session], T], fresh: bool = False) -> T:
+    '''
+    Runs work(session) for a read that does not need this request's own
+    uncommitted writes: on a session of the read bind when there is one, so
+    long history reads keep off the primary's pool and write locks. Falls
+    back to db.session when there is no read bind or it fails (replica down
+    or behind on migrations); work must therefore only read.
+
+    fresh=True is for reads that must see every commit, as a read-then-write:
+    they skip a replica, which may lag, and only use the read-only pool on the
+    primary's own file.
+    '''
+    engine = current_app.extensions.get(READ_BIND)
+    if fresh and current_app.config.get("READ_DATABASE_URI"):
+        engine = None
+    if engine is not None:
+        try:
+            with so.Session(engine) as session:
+                return work(session)
+        except sa.exc.OperationalError as e:
+            logger.warning(f"Read bind failed, reading from the primary: {e}")
+    return work(db.session)
@@ -40,6 +40,10 @@ class User(db.Model):
 
 class TrainingSession(db.Model):
     __tablename__ = 'training_sessions'
+    __table_args__ = (
+        # add_or_return_training_session: a user's sessions of the last hours
+        sa.Index('ix_training_sessions_user_id_created_at', 'user_id', 'created_at'),
+    )
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('users.id'), nullable=False)
@@ -59,6 +63,12 @@ class TrainingSession(db.Model):
 
 class TrainingDetail(db.Model):
     __tablename__ = 'training_details'
+    __table_args__ = (
+        # get_training_detail_to_dataframe: the reps of one session of a user
+        sa.Index('ix_training_details_atleta_id_session_id', 'atleta_id', 'session_id'),
+        # TrainingAnalytics: a user's reps of the last days
+        sa.Index('ix_training_details_atleta_id_timestamp', 'atleta_id', 'timestamp'),
+    )
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
     session_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey('training_sessions.id'), nullable=False)
@@ -79,7 +89,7 @@ class TrainingDetail(db.Model):
         sa.ForeignKey('users.id', name='fk_training_details_user'),
         nullable=False
     )
-    hash_id: so.Mapped[str] = so.mapped_column(sa.String(255), nullable=True)
+    hash_id: so.Mapped[str] = so.mapped_column(sa.String(255), index=True, nullable=True)
     created_at: so.Mapped[datetime] = so.mapped_column(
         sa.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), index=True
     )
@@ -118,7 +128,7 @@ class Exercise(db.Model):
     __tablename__ = 'exercises'
 
     id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
-    name: so.Mapped[str] = so.mapped_column(sa.String, nullable=False)
+    name: so.Mapped[str] = so.mapped_column(sa.String, index=True, unique=True, nullable=False)
 
     # Relationships
     training_details: so.Mapped[List['TrainingDetail']] = so.relationship('TrainingDetail', back_populates='ejercicio')
@@ -142,3 +152,26 @@ class UserStats(db.Model):
     exercise: so.Mapped['Exercise'] = so.relationship('Exercise', back_populates='user_stats')
 
 
+class IngestedDocument(db.Model):
+    '''
+    Ledger of the ADR exports already ingested, keyed by the sha256 WhatsApp
+    sends with the document. A file the user sends again is answered from
+    here without downloading or parsing it.
+    '''
+    __tablename__ = 'ingested_documents'
+    __table_args__ = (
+        sa.UniqueConstraint('user_id', 'sha256', name='uq_ingested_documents_user_sha256'),
+    )
+
+    id: so.Mapped[int] = so.mapped_column(primary_key=True, autoincrement=True)
+    user_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey('users.id', name='fk_ingested_documents_user'),
+        nullable=False
+    )
+    sha256: so.Mapped[str] = so.mapped_column(sa.String(64), nullable=False)
+    filename: so.Mapped[str] = so.mapped_column(sa.String(255), nullable=False)
+    reps_added: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False, default=0)
+    sets_added: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False, default=0)
+    created_at: so.Mapped[datetime] = so.mapped_column(
+        sa.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False
+    )
@@ -0,0 +1,284 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .response_cache import ResponseCache, assistant_fingerprint, response_cache
+from .thread_store import ThreadStore, thread_store
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = frozenset({"completed", "failed", "cancelled", "expired", "incomplete", "requires_action"})
+
+
+class AssistantRunError(Exception):
+    ''' A run ended without an answer: failed, expired, cancelled, needed a tool or ran out of time '''
+
+    def __init__(self, message: str, status: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class AssistantRunner:
+    '''
+    Runs the OpenAI assistant on a user's thread and returns its answer.
+
+    The assistant object is cached for `assistant_ttl` seconds, so edits to it
+    reach the runs (and the response cache) without a restart. A run is followed
+    through its event stream (`stream=True`), so the answer is picked up as
+    soon as the run ends; without streaming, its status is polled with
+    exponential backoff (`poll_initial` up to `poll_max` seconds). Either way a
+    run gets `timeout` seconds in total, is cancelled past that with an
+    AssistantRunError of status "timeout", and every terminal status is
+    handled: anything but "completed" raises AssistantRunError.
+
+    With a ResponseCache, a question already answered by the same assistant
+    configuration is answered from it without a run. Only answers given on a
+    new thread are stored: they depend on the question alone, nothing an
+    athlete said before. A cached answer is returned straight away and added
+    to the asker's thread with the question afterwards, in the background;
+    the athlete's next exchange waits for it, so a follow-up is asked in
+    context.
+
+    submit() does the whole exchange on the runner's own threads, so the
+    webhook worker is free as soon as the message is queued.
+    '''
+
+    def __init__(self, client=None, assistant_id: Optional[str] = None, threads: ThreadStore = thread_store,
+                 timeout: float = 60.0,
+                 stream: bool = True, poll_initial: float = 0.1, poll_max: float = 0.5, workers: int = 4,
+                 cache: Optional[ResponseCache] = None, assistant_ttl: float = 300.0):
+        self.client = client
+        self.assistant_id = assistant_id
+        self.threads = threads
+        self.timeout = timeout
+        self.stream = stream
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.workers = workers
+        self.cache = cache
+        self.assistant_ttl = assistant_ttl
+        self._assistant = None
+        self._assistant_expires = 0.0
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # wa_id -> [lock, holders and waiters]; dropped when the count is back to 0
+        self._turns: Dict[str, List] = {}
+        self._turns_lock = threading.Lock()
+        self._recorders: Set[threading.Thread] = set()
+
+    def init_app(self, app) -> None:
+        api_key = app.config.get("OPENAI_API_KEY")
+        if api_key:
+            from openai import OpenAI
+            self.client = OpenAI(api_key=api_key)
+        self.assistant_id = app.config.get("OPENAI_ASSISTANT_ID")
+        self.timeout = app.config.get("OPENAI_RUN_TIMEOUT", self.timeout)
+        self.stream = app.config.get("OPENAI_RUN_STREAM", self.stream)
+        self.workers = app.config.get("OPENAI_RUN_WORKERS", self.workers)
+        self.assistant_ttl = app.config.get("OPENAI_ASSISTANT_TTL", self.assistant_ttl)
+        self.cache = response_cache if app.config.get("OPENAI_CACHE", True) else None
+        self._assistant = None
+
+    @property
+    def assistant(self):
+        with self._lock:
+            if self._assistant is None or time.monotonic() >= self._assistant_expires:
+                self._assistant = self.client.beta.assistants.retrieve(self.assistant_id)
+                self._assistant_expires = time.monotonic() + self.assistant_ttl
+            return self._assistant
+
+    def thread_id(self, wa_id: str, name: str) -> str:
+        ''' The user's thread, created on first contact '''
+        return self._thread(wa_id, name)[0]
+
+    def generate_response(self, message_body: str, wa_id: str, name: str, use_cache: bool = True) -> str:
+        key = None
+        if use_cache and self.cache is not None and not self.cache.skips(wa_id):
+            key = self.cache.key(message_body, assistant_fingerprint(self.assistant))
+            cached = self.cache.get(key) if key is not None else None
+            if cached is not None:
+                logger.info(f"Answered {wa_id} from the response cache")
+                self._record_later(message_body, cached, wa_id, name)
+                return cached
+
+        answer, new_thread = self._exchange(message_body, wa_id, name)
+        # Later in a conversation the answer may build on what the athlete said; it is not everyone's answer
+        if key is not None and new_thread:
+            self.cache.put(key, answer)
+        return answer
+
+    def run(self, thread_id: str) -> str:
+        ''' Runs the assistant on the thread and returns the text of its answer '''
+        deadline = time.monotonic() + self.timeout
+        if self.stream:
+            new_message = self._run_streaming(thread_id, deadline)
+        else:
+            new_message = self._run_polling(thread_id, deadline)
+        logger.info(f"Generated message: {new_message}")
+        return new_message
+
+    def submit(self, message_body: str, wa_id: str, name: str,
+               on_reply: Optional[Callable[[str], None]] = None,
+               on_error: Optional[Callable[[Exception], None]] = None) -> Future:
+        '''
+        generate_response() in the background; on_reply gets the answer when
+        there is one, on_error the exception of a failed or timed-out run
+        '''
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="assistant")
+        future = self._executor.submit(self.generate_response, message_body, wa_id, name)
+        if on_reply is not None or on_error is not None:
+            future.add_done_callback(lambda done: self._deliver(done, on_reply, on_error, wa_id))
+        return future
+
+    def close(self) -> None:
+        ''' Waits for the runs and the cached exchanges still being recorded '''
+        with self._turns_lock:
+            recorders = list(self._recorders)
+        for recorder in recorders:
+            recorder.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    '''
+    Internals
+    '''
+    def _thread(self, wa_id: str, name: str) -> Tuple[str, bool]:
+        ''' The user's thread and whether it was created by this call '''
+        thread_id = self.threads.get(wa_id)
+        if thread_id is not None:
+            return thread_id, False
+        logger.info(f"Creating new thread for {name} with wa_id {wa_id}")
+        created = self.client.beta.threads.create().id
+        # Another worker may have created one meanwhile; everyone uses the first stored
+        thread_id = self.threads.setdefault(wa_id, created)
+        return thread_id, thread_id == created
+
+    def _exchange(self, message_body: str, wa_id: str, name: str) -> Tuple[str, bool]:
+        ''' Asks on the user's thread; returns the answer and whether the thread was new '''
+        # A thread takes no new message while a run is active: one exchange per user at a time
+        with self._user_turn(wa_id):
+            thread_id, new_thread = self._thread(wa_id, name)
+            self.client.beta.threads.messages.create(thread_id=thread_id, role="user", content=message_body)
+            return self.run(thread_id), new_thread
+
+    def _record_later(self, question: str, answer: str, wa_id: str, name: str) -> None:
+        ''' Takes the user's turn now, so the next exchange comes after the record, and records off this thread '''
+        lock = self._take_turn(wa_id)
+        recorder = threading.Thread(target=self._record, args=(question, answer, wa_id, name, lock),
+                                    name=f"assistant-record-{wa_id}", daemon=True)
+        with self._turns_lock:
+            self._recorders.add(recorder)
+        recorder.start()
+
+    def _record(self, question: str, answer: str, wa_id: str, name: str, lock: threading.Lock) -> None:
+        ''' Adds a cached exchange to the user's thread and gives the turn back; the answer is already sent '''
+        try:
+            thread_id = self.thread_id(wa_id, name)
+            self.client.beta.threads.messages.create(thread_id=thread_id, role="user", content=question)
+            self.client.beta.threads.messages.create(thread_id=thread_id, role="assistant", content=answer)
+        except Exception as e:
+            logger.warning(f"Could not add the cached answer to the thread of {wa_id}: {e}")
+        finally:
+            self._give_turn(wa_id, lock)
+            with self._turns_lock:
+                self._recorders.discard(threading.current_thread())
+
+    def _run_streaming(self, thread_id: str, deadline: float) -> str:
+        # The client's timeout only bounds each read of the stream; a run that keeps sending events is
+        # stopped here, between events
+        with self.client.beta.threads.runs.stream(thread_id=thread_id, assistant_id=self.assistant.id,
+                                                  timeout=max(0.0, deadline - time.monotonic())) as stream:
+            try:
+                for _ in stream:
+                    if time.monotonic() >= deadline:
+                        raise AssistantRunError(f"Run did not finish in {self.timeout}s", "timeout")
+            except Exception as e:
+                if stream.current_run is not None:
+                    self._cancel(thread_id, stream.current_run.id)
+                # The client's own read timeout (openai.APITimeoutError) is the same deadline
+                if not isinstance(e, AssistantRunError) and time.monotonic() >= deadline:
+                    raise AssistantRunError(f"Run did not finish in {self.timeout}s", "timeout") from e
+                raise
+            run = stream.get_final_run()
+            self._check(run)
+            messages = stream.get_final_messages()
+        if not messages:
+            raise AssistantRunError(f"Run {run.id} completed without a message", run.status)
+        return messages[-1].content[0].text.value
+
+    def _run_polling(self, thread_id: str, deadline: float) -> str:
+        runs = self.client.beta.threads.runs
+        run = runs.create(thread_id=thread_id, assistant_id=self.assistant.id)
+        delay = self.poll_initial
+        while run.status not in TERMINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._cancel(thread_id, run.id)
+                raise AssistantRunError(f"Run {run.id} did not finish in {self.timeout}s", "timeout")
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, self.poll_max)
+            run = runs.retrieve(thread_id=thread_id, run_id=run.id)
+        self._check(run)
+
+        messages = self.client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=1)
+        return messages.data[0].content[0].text.value
+
+    @staticmethod
+    def _check(run) -> None:
+        if run.status != "completed":
+            error = getattr(run, "last_error", None)
+            detail = f": {error.message}" if error is not None else ""
+            raise AssistantRunError(f"Run {run.id} ended {run.status}{detail}", run.status)
+
+    @contextmanager
+    def _user_turn(self, wa_id: str):
+        lock = self._take_turn(wa_id)
+        try:
+            yield
+        finally:
+            self._give_turn(wa_id, lock)
+
+    def _take_turn(self, wa_id: str) -> threading.Lock:
+        with self._turns_lock:
+            turn = self._turns.setdefault(wa_id, [threading.Lock(), 0])
+            turn[1] += 1
+        turn[0].acquire()
+        return turn[0]
+
+    def _give_turn(self, wa_id: str, lock: threading.Lock) -> None:
+        ''' Releases the user's lock, forgetting it once nobody holds or waits for it '''
+        with self._turns_lock:
+            lock.release()
+            turn = self._turns[wa_id]
+            turn[1] -= 1
+            if turn[1] == 0:
+                del self._turns[wa_id]
+
+    def _cancel(self, thread_id: str, run_id: str) -> None:
+        try:
+            self.client.beta.threads.runs.cancel(thread_id=thread_id, run_id=run_id)
+        except Exception as e:
+            logger.warning(f"Could not cancel run {run_id}: {e}")
+
+    @staticmethod
+    def _deliver(done: Future, on_reply: Optional[Callable[[str], None]],
+                 on_error: Optional[Callable[[Exception], None]], wa_id: str) -> None:
+        error = done.exception()
+        if error is not None:
+            logger.error(f"Assistant run for {wa_id} failed: {error}", exc_info=error)
+        try:
+            if error is None and on_reply is not None:
+                on_reply(done.result())
+            elif error is not None and on_error is not None:
+                on_error(error)
+        except Exception as e:
+            logger.error(f"Could not deliver the assistant reply to {wa_id}: {e}", exc_info=True)
+
+
+assistant_runner = AssistantRunner()
@@ -1,14 +1,19 @@
 from openai import OpenAI
-import shelve
 from dotenv import load_dotenv
 import os
-import time
 import logging
 
+from .assistant_runner import assistant_runner
+from .thread_store import thread_store
+
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
-client = OpenAI(api_key=OPENAI_API_KEY)
+if assistant_runner.client is None:
+    # Imported outside create_app(), which configures the runner from the OPENAI_* settings in config.py
+    assistant_runner.client = OpenAI(api_key=OPENAI_API_KEY)
+    assistant_runner.assistant_id = OPENAI_ASSISTANT_ID
+client = assistant_runner.client
 
 
 def upload_file(path):
@@ -32,66 +37,23 @@ def create_assistant(file):
     return assistant
 
 
-# Use context manager to ensure the shelf file is closed properly
 def check_if_thread_exists(wa_id):
-    with shelve.open("threads_db") as threads_shelf:
-        return threads_shelf.get(wa_id, None)
+    return thread_store.get(wa_id)
 
 
 def store_thread(wa_id, thread_id):
-    with shelve.open("threads_db", writeback=True) as threads_shelf:
-        threads_shelf[wa_id] = thread_id
+    thread_store.put(wa_id, thread_id)
 
 
 def run_assistant(thread, name):
-    # Retrieve the Assistant
-    assistant = client.beta.assistants.retrieve(OPENAI_ASSISTANT_ID)
-
-    # Run the assistant
-    run = client.beta.threads.runs.create(
-        thread_id=thread.id,
-        assistant_id=assistant.id,
-        # instructions=f"You are having a conversation with {name}",
-    )
+    # Streams the run (or polls it with backoff) against the cached assistant, with a deadline
+    return assistant_runner.run(thread.id)
 
-    # Wait for completion
-    # https://platform.openai.com/docs/assistants/how-it-works/runs-and-run-steps#:~:text=under%20failed_at.-,Polling%20for%20updates,-In%20order%20to
-    while run.status != "completed":
-        # Be nice to the API
-        time.sleep(0.5)
-        run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-
-    # Retrieve the Messages
-    messages = client.beta.threads.messages.list(thread_id=thread.id)
-    new_message = messages.data[0].content[0].text.value
-    logging.info(f"Generated message: {new_message}")
-    return new_message
-
-
-def generate_response(message_body, wa_id, name):
-    # Check if there is already a thread_id for the wa_id
-    thread_id = check_if_thread_exists(wa_id)
-
-    # If a thread doesn't exist, create one and store it
-    if thread_id is None:
-        logging.info(f"Creating new thread for {name} with wa_id {wa_id}")
-        thread = client.beta.threads.create()
-        store_thread(wa_id, thread.id)
-        thread_id = thread.id
-
-    # Otherwise, retrieve the existing thread
-    else:
-        logging.info(f"Retrieving existing thread for {name} with wa_id {wa_id}")
-        thread = client.beta.threads.retrieve(thread_id)
-
-    # Add message to thread
-    message = client.beta.threads.messages.create(
-        thread_id=thread_id,
-        role="user",
-        content=message_body,
-    )
 
-    # Run the assistant and get the new message
-    new_message = run_assistant(thread, name)
+def generate_response(message_body, wa_id, name, use_cache=True):
+    # Cached answer, or thread lookup, new message and assistant run; submit_response() does it off the webhook worker
+    return assistant_runner.generate_response(message_body, wa_id, name, use_cache)
+
 
-    return new_message
+def submit_response(message_body, wa_id, name, on_reply=None, on_error=None):
+    return assistant_runner.submit(message_body, wa_id, name, on_reply, on_error)
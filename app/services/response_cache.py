@@ -0,0 +1,110 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional, Tuple
+
+_NOT_WORD = re.compile(r"[^\w]+")
+
+
+def normalize_question(text: str) -> str:
+    '''
+    Question text reduced to what changes its meaning: lower case, no accents,
+    no punctuation, single spaces. "¿Qué es la pérdida de velocidad?" and
+    "que es la perdida de velocidad" are the same question.
+    '''
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return _NOT_WORD.sub(" ", stripped).strip()
+
+
+def assistant_fingerprint(assistant) -> str:
+    ''' Identifies what produced an answer: editing the assistant's model, instructions or tools invalidates it '''
+    parts = [getattr(assistant, name, None) for name in ("id", "model", "instructions", "tools")]
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class ResponseCache:
+    '''
+    Assistant answers to questions many athletes ask, keyed by the normalized
+    question and the assistant configuration. Nothing about the asker is part
+    of the key: only answers that do not depend on a conversation may be put
+    (AssistantRunner stores those given on a new thread).
+
+    Entries live `ttl` seconds and the least recently used go first past
+    `max_entries`. Questions shorter than `min_words` are never cached: "¿y
+    eso?" only means something inside a conversation. Users in `bypass`
+    always get a fresh run (testers, coaches checking a new prompt).
+    '''
+
+    def __init__(self, ttl: float = 24 * 3600.0, max_entries: int = 1000, min_words: int = 3,
+                 bypass: Iterable[str] = (), clock: Callable[[], float] = time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_words = min_words
+        self.bypass = set(bypass)
+        self.clock = clock
+        # key -> (answer, expires at)
+        self._answers: "OrderedDict[Tuple[str, str], Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def init_app(self, app) -> None:
+        self.ttl = app.config.get("OPENAI_CACHE_TTL", self.ttl)
+        self.max_entries = app.config.get("OPENAI_CACHE_SIZE", self.max_entries)
+        self.bypass = set(app.config.get("OPENAI_CACHE_BYPASS", self.bypass))
+        self.clear()
+
+    def key(self, question: str, fingerprint: str) -> Optional[Tuple[str, str]]:
+        ''' Cache key for the question, None if it is too short to stand on its own '''
+        normalized = normalize_question(question)
+        if len(normalized.split()) < self.min_words:
+            return None
+        return fingerprint, normalized
+
+    def skips(self, wa_id: str) -> bool:
+        if wa_id in self.bypass:
+            with self._lock:
+                self.bypassed += 1
+            return True
+        return False
+
+    def get(self, key: Tuple[str, str]) -> Optional[str]:
+        with self._lock:
+            entry = self._answers.get(key)
+            if entry is not None and self.clock() >= entry[1]:
+                del self._answers[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._answers.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Tuple[str, str], answer: str) -> None:
+        with self._lock:
+            self._answers[key] = (answer, self.clock() + self.ttl)
+            self._answers.move_to_end(key)
+            while len(self._answers) > self.max_entries:
+                self._answers.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._answers.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"cached": len(self._answers), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "bypassed": self.bypassed, "evictions": self.evictions}
+
+
+response_cache = ResponseCache()
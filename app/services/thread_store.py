@@ -0,0 +1,124 @@
+import logging
+import shelve
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import click
+
+from app.utils.path_utils import instance_path
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadStore:
+    '''
+    wa_id -> OpenAI thread id, shared by every worker process.
+
+    Backed by a SQLite file in WAL mode: readers never block the writer and
+    each worker keeps one connection per thread instead of reopening a file on
+    every call. Found mappings are cached in process (a thread id never
+    changes once assigned), so a repeated lookup is a dict hit. Misses are not
+    cached, another worker may create the thread meanwhile.
+    '''
+
+    def __init__(self, path: str = "threads_db.sqlite", cache_size: int = 10000, timeout: float = 5.0):
+        self.path = path
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def init_app(self, app) -> None:
+        self.configure(instance_path(app, app.config.get("OPENAI_THREADS_DB") or self.path))
+
+        @app.cli.command("import-threads")
+        @click.argument("shelve_path", default="threads_db")
+        def import_threads(shelve_path):
+            ''' Copies the wa_id -> thread mappings of the old shelve file into the thread store '''
+            click.echo(f"{self.import_shelve(shelve_path)} threads read from {shelve_path} into {self.path}")
+
+    def configure(self, path) -> None:
+        ''' Points the store at another file; connections to the previous one are dropped '''
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(path)
+        self._local = threading.local()
+        self.clear_cache()
+
+    def get(self, wa_id: str) -> Optional[str]:
+        with self._lock:
+            thread_id = self._cache.get(wa_id)
+            if thread_id is not None:
+                self._cache.move_to_end(wa_id)
+                return thread_id
+
+        row = self._connection().execute("SELECT thread_id FROM threads WHERE wa_id = ?", (wa_id,)).fetchone()
+        if row is None:
+            return None
+        self._remember(wa_id, row[0])
+        return row[0]
+
+    def put(self, wa_id: str, thread_id: str) -> None:
+        ''' Maps wa_id to thread_id, replacing any previous thread '''
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO threads (wa_id, thread_id) VALUES (?, ?) "
+                "ON CONFLICT (wa_id) DO UPDATE SET thread_id = excluded.thread_id",
+                (wa_id, thread_id),
+            )
+        self._remember(wa_id, thread_id)
+
+    def setdefault(self, wa_id: str, thread_id: str) -> str:
+        '''
+        Stores thread_id unless wa_id already has a thread, and returns the one
+        that is stored: when two workers create a thread for the same user at
+        once, both end up using the first one written.
+        '''
+        with self._connection() as connection:
+            connection.execute("INSERT OR IGNORE INTO threads (wa_id, thread_id) VALUES (?, ?)", (wa_id, thread_id))
+            stored = connection.execute("SELECT thread_id FROM threads WHERE wa_id = ?", (wa_id,)).fetchone()[0]
+        self._remember(wa_id, stored)
+        return stored
+
+    def import_shelve(self, path: str = "threads_db") -> int:
+        ''' Copies the mappings of the old shelve file, keeping any already stored; returns how many were read '''
+        try:
+            with shelve.open(path, flag="r") as threads_shelf:
+                mappings = list(threads_shelf.items())
+        except Exception:  # dbm raises its own errors when there is no such file
+            return 0
+        with self._connection() as connection:
+            connection.executemany("INSERT OR IGNORE INTO threads (wa_id, thread_id) VALUES (?, ?)", mappings)
+        logger.info(f"Imported {len(mappings)} threads from {path}")
+        return len(mappings)
+
+    def clear_cache(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    '''
+    Internals
+    '''
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS threads (wa_id TEXT PRIMARY KEY, thread_id TEXT NOT NULL)")
+            connection.commit()
+            self._local.connection = connection
+        return connection
+
+    def _remember(self, wa_id: str, thread_id: str) -> None:
+        with self._lock:
+            self._cache[wa_id] = thread_id
+            self._cache.move_to_end(wa_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+thread_store = ThreadStore()
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from typing import Optional
+
+import sqlalchemy as sa
+
+from app import db
+from app.models.models import User
+from app.utils.group_commit import db_writer
+
+logger = logging.getLogger(__name__)
+
+
+class StateConflict(Exception):
+    ''' A state change was rejected because another worker moved the user first '''
+
+
+@dataclass(frozen=True)
+class UserSession:
+    '''
+    Minimal view of a User needed to route a webhook: the id and the current state.
+    '''
+    user_id: int
+    wa_id: str
+    state: str
+    loaded_at: float = field(default_factory=time.monotonic)
+
+
+class UserSessionCache:
+    '''
+    Process-local cache wa_id -> UserSession.
+
+    Reads are served from memory while the entry is younger than `ttl`, with
+    no query. Another worker may have moved the user meanwhile: state changes
+    are written through to the database with a compare-and-set UPDATE
+    (`WHERE state = <cached state>`), so a transition made from a stale entry
+    is rejected and the entry dropped, and dispatch_webhook runs the webhook
+    again on the stored state.
+    '''
+
+    def __init__(self, ttl: float = 30.0, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, UserSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.ttl = app.config.get("USER_SESSION_CACHE_TTL", self.ttl)
+        self.max_entries = app.config.get("USER_SESSION_CACHE_SIZE", self.max_entries)
+        self.clear()
+
+    def get(self, wa_id: str) -> Optional[UserSession]:
+        with self._lock:
+            session = self._entries.get(wa_id)
+            if session is None:
+                return None
+            if time.monotonic() - session.loaded_at > self.ttl:
+                del self._entries[wa_id]
+                return None
+            self._entries.move_to_end(wa_id)
+            return session
+
+    def put(self, session: UserSession) -> None:
+        with self._lock:
+            self._entries[session.wa_id] = session
+            self._entries.move_to_end(session.wa_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, wa_id: str) -> None:
+        with self._lock:
+            self._entries.pop(wa_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def resolve(self, wa_id: str, user_name: Optional[str] = None) -> UserSession:
+        '''
+        Returns the session for wa_id, loading only (id, state) on a miss and
+        creating the User if the number has never written before.
+        '''
+        session = self.get(wa_id)
+        if session is not None:
+            return session
+
+        query = sa.select(User.id, User.state).where(User.phone_number == wa_id)
+        row = db.session.execute(query).one_or_none()
+
+        if row is None:
+            user = User(name=user_name, phone_number=wa_id)
+            db.session.add(user)
+            db.session.flush()
+            session = UserSession(user_id=user.id, wa_id=wa_id, state=user.state)
+            db.session.commit()
+            logger.info(f"Created user {user.id} for wa_id {wa_id}")
+        else:
+            session = UserSession(user_id=row.id, wa_id=wa_id, state=row.state)
+
+        self.put(session)
+        return session
+
+    def write_state(self, session: UserSession, new_state: str) -> Optional[UserSession]:
+        '''
+        Persists a state change and updates the cache.
+
+        Returns the updated session, or None if the row no longer holds the
+        state this worker expected (another worker changed it first).
+        '''
+        query = (
+            sa.update(User)
+            .where(User.id == session.user_id, User.state == session.state)
+            .values(state=new_state)
+        )
+        if db_writer.enabled:
+            # Ends this request's own transaction first, the writer would wait on its locks
+            db.session.commit()
+            rowcount = db_writer.execute(query).rowcount
+        else:
+            rowcount = db.session.execute(query).rowcount
+            db.session.commit()
+
+        if rowcount != 1:
+            logger.warning(
+                f"State of user {session.user_id} changed concurrently, "
+                f"expected {session.state}; dropping cached session"
+            )
+            self.invalidate(session.wa_id)
+            return None
+
+        updated = replace(session, state=new_state, loaded_at=time.monotonic())
+        self.put(updated)
+        return updated
+
+
+user_sessions = UserSessionCache()
@@ -1,13 +1,21 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from typing import IO, Dict, Optional
+import atexit
+import logging
 from app.models.payload_models import *
-from app.utils.send_utils import send_message, send_interactive_list
-from app.models.models import User
+from app.models.models import IngestedDocument, User
 from app import db
 from flask import current_app
-from app.utils.document_utils import process_document_webhook
-from app.core.messaging.validated_message_handler import MessageHandler,IdleStateMessageHandler, AddTrainingStateMessageHandler, TrainingManagementStateMessageHandler
-from app.core.messaging.message_sender import WhatsappMessageSender, WhatsappAPIClient
+from app.utils.document_utils import find_ingested_document, process_document_webhook
+from app.core.messaging.validated_message_handler import MessageHandler,IdleStateMessageHandler, AddTrainingStateMessageHandler, TrainingManagementStateMessageHandler, get_recipient
+from app.core.messaging.message_sender import WhatsappMessageSender, WhatsappAPIClient, MessageSender, ReplyBatch
+from app.core.messaging.dispatcher import OutboundDispatcher
+from app.core.messaging.sendMessage_types import text_message
+from app.core.messaging.templates import message_templates
+from app.core.messaging.commands import Command, command_router
+from app.core.training.analytics import answer_command
+from app.state.session_cache import StateConflict, UserSession, user_sessions
 
 
 
@@ -22,143 +30,276 @@ class UserContext:
     A reference to the current state
     '''
 
-    # When initializing the Context, we assign a state
-    def __init__(self, user: User) -> None:
-        self.user = user
-        self.transition_to(self.get_state_instance(user.state))
+    # When initializing the Context, we restore the persisted state without writing it back
+    def __init__(self, session: UserSession, machine: StateMachine = None, document: IO[bytes] = None) -> None:
+        self.session = session
+        self.machine = machine or current_app.extensions["state_machine"]
+        # Content of the webhook's document when it was already downloaded (async mode)
+        self.document = document
+        self._user = None
+        self._state = self.machine.get_state(session.state)
 
+    @property
+    def user(self) -> User:
+        '''Full User row, only loaded when a state actually needs it'''
+        if self._user is None:
+            self._user = db.session.get(User, self.session.user_id)
+        return self._user
 
-    # Get state instance of User
-    def get_state_instance(self, state_name: str ) -> State:
-        state_mapping = {
-        'IdleState': IdleState,
-        'TrainingManagementState': TrainingManagementState,
-        'AddTrainingState': AddTrainingState,
-        #'EstimateOneRMState': EstimateOneRMState,
-        #'CreateVelocityProfileState': CreateVelocityProfileState
-        # Add other states as needed
-        }
-
-        # Retrieve the state_class
-        state_class = state_mapping.get(state_name)
-        if not state_class:
-            raise ValueError(f"State not defined {state_name}")
-        
-        # Instantiate the state_class setting the context to self
-        state_instance = state_class(self)
-        return state_instance
+    @property
+    def state(self) -> State:
+        return self._state
 
-    # We need this back-reference to dynamically be able to change states
+    # States are shared singletons, so a transition only swaps the reference and persists the name
     def transition_to(self, state: State):
-        print(f'Context: Transition from {type(self._state).__name__} to {type(state).__name__}')
+        if state is self._state:
+            return
+
+        logging.debug(f'Context: Transition from {self._state.name} to {state.name}')
+        # Write-through: persists the new state and refreshes the cached session
+        updated = user_sessions.write_state(self.session, state.name)
+        if updated is None:
+            # Another worker moved the user first; dispatch_webhook runs the webhook again on the stored state
+            raise StateConflict(f"User {self.session.user_id} is no longer in {self._state.name}, "
+                                f"the transition to {state.name} was not applied")
+        self.session = updated
         self._state = state
-        self.user.state = type(state).__name__
-        db.session.commit()
     '''
     Here we define the functions that we delegate to the States
     '''
     # In my case the functionality i need to delegate is the webhook management
     def handle_webhook(self, webhook):
-        return self._state.handle_webhook(webhook)
-    
-class State(ABC):
+        action = self._state.handle_webhook(self, webhook)
+        next_state = self.machine.next_state(self._state, action)
+        if next_state is not None:
+            self.transition_to(next_state)
+        return action
 
-    def __init__(self, context: UserContext = None):
-        self.context = context
-        self.message_handler = self._create_message_handler()
-
-    def _create_message_handler(self) -> MessageHandler:
-        """Create the appropriate message handler for this state"""
-        handler_mapping = {
-            'IdleState': IdleStateMessageHandler,
-            'TrainingManagementState': TrainingManagementStateMessageHandler,
-            'AddTrainingState': AddTrainingStateMessageHandler,
-        }
-        # Get current state class name
-        whatsapp_api_client = WhatsappAPIClient(access_token= current_app.config.get("ACCESS_TOKEN")  , api_version= current_app.config.get("VERSION"), phone_number_id= current_app.config.get("PHONE_NUMBER_ID"))
-        state_name = self.__class__.__name__
-        handler_class = handler_mapping.get(state_name)
-        
-        if not handler_class:
-            raise ValueError(f"No handler defined for state {state_name}")
-            
-        # Create handler with dependencies
-        message_sender = WhatsappMessageSender(whatsapp_api_client) 
-        return handler_class(message_sender)
 
+class State(ABC):
+    '''
+    Stateless behaviour of a conversation state. One instance per state is shared by
+    every user; per-user data lives in the UserContext passed to handle_webhook.
+    '''
+
+    def __init__(self, message_handler: MessageHandler = None):
+        self.message_handler = message_handler
 
+    @property
+    def name(self) -> str:
+        return type(self).__name__
 
     @abstractmethod
-    def handle_webhook(self, webhook):
-        pass
+    def handle_webhook(self, context: UserContext, webhook) -> Optional[str]:
+        '''Handles the webhook and returns the action to look up in the transition table'''
+
+    def reply(self, webhook, body: str) -> bool:
+        '''Sends a text back to the author of the webhook'''
+        return self.message_handler.message_sender.send(text_message(get_recipient(webhook), body))
+
+    def reply_template(self, webhook, name: str) -> bool:
+        '''Sends a registered template (see app.core.messaging.templates) to the author of the webhook'''
+        return self.message_handler.message_sender.send(message_templates.message(name, get_recipient(webhook)))
+
+    def reply_batch(self, webhook) -> ReplyBatch:
+        '''Multi-part reply to the author of the webhook, sent when the with block exits'''
+        return ReplyBatch(self.message_handler.message_sender, get_recipient(webhook))
+
+    def route_text(self, context: UserContext, webhook) -> Optional[Command]:
+        '''
+        Routes a text message through the command router. Commands about the
+        user's training (summary, 1RM, load-velocity) are answered here from
+        cached analytics; any other command is returned for the state to act
+        on. None for free text and for other webhook types.
+        '''
+        if webhook.get_type_of_webhook() != 'text':
+            return None
+        command = command_router.route(webhook.get_body_of_text_message())
+        if command is not None:
+            answer = answer_command(command, context.session.user_id)
+            if answer is not None:
+                self.reply(webhook, answer)
+        return command
 
-    def set_context(self, context: UserContext):
-        self.context = context
 
 class IdleState(State):
 
-    def handle_webhook(self,webhook):
+    def handle_webhook(self, context, webhook):
         try:
-            action = self.message_handler.handle_message(webhook)
-            if action == "TRAINING SELECTED":
-                    self.context.transition_to(TrainingManagementState())
+            command = self.route_text(context, webhook)
+            if command is not None and command.name not in ("menu", "finish"):
+                return None
+            if command is None and webhook.get_type_of_webhook() == 'text' and current_app.config.get("ASSISTANT_FALLBACK"):
+                self.ask_assistant(webhook)
+                return None
+            return self.message_handler.handle_message(webhook)
 
         except Exception as e:
-            logging.ERROR(f'Unexpected exception during webhook handling {e}', exc_info=True)
-            send_message("Ha habido un problema, vuelve a enviar tu mensaje.")
-            
+            logging.error(f'Unexpected exception during webhook handling {e}', exc_info=True)
+            self.reply_template(webhook, "retry_message")
+
+    def ask_assistant(self, webhook) -> None:
+        '''
+        Free text goes to the OpenAI assistant; its answer is sent when the run
+        ends, off this worker. A failed or timed-out run gets the retry prompt.
+        '''
+        from app.services.openai_service import submit_response
+
+        name, wa_id = webhook.get_user_contact_info()
+        sender = self.message_handler.message_sender
+        retry = message_templates.message("retry_message", wa_id)
+        submit_response(webhook.get_body_of_text_message(), wa_id, name,
+                        on_reply=lambda answer: sender.send(text_message(wa_id, answer)),
+                        on_error=lambda error: sender.send(retry))
+
 
 class TrainingManagementState(State):
-    def handle_webhook(self,webhook):
+    def handle_webhook(self, context, webhook):
         try:
-            
-            action = self.message_handler.handle_message(webhook)
-
-            if action == "END":
-                self.context.transition_to(IdleState())
+            command = self.route_text(context, webhook)
+            if command is not None and command.name not in ("menu", "finish"):
+                return None
+            return self.message_handler.handle_message(webhook)
 
-            elif action == "ADD TRAINING":
-                self.context.transition_to(AddTrainingState())
-        
         except Exception as e:
-            logging.ERROR(f"Unexpected expection {e}, returning to IDLE", exc_info=True)
-            self.context.transition_to(IdleState())
+            logging.error(f"Unexpected expection {e}, returning to IDLE", exc_info=True)
+            return "ERROR"
 
 class AddTrainingState(State):
-    def handle_webhook(self,webhook):
+    def handle_webhook(self, context, webhook):
         try:
             webhook_type = webhook.get_type_of_webhook()
 
             if webhook_type == 'text':
-                text_response = webhook.get_body_of_text_message()
-
-                if 'finitto' in text_response.lower():
-                    self.context.transition_to(IdleState())
-
-                else:
-                    send_message("Manda tus datos en csv o envía finitto para acabar la sesión.")
+                command = self.route_text(context, webhook)
+                if command is not None and command.name == "finish":
+                    return "END"
+                elif command is None or command.name == "menu":
+                    self.reply_template(webhook, "send_csv")
             elif webhook_type == 'interactive':
-                send_message("Ya has seleccionado una opción. Actualmente estás REGISTRANDO ENTRENAMIENTO\nPara acabar esta sesión, responde finitto")
+                self.reply_template(webhook, "already_adding_training")
 
             elif webhook_type == 'document':
-                process_document_webhook(webhook, self.context.user)
-                send_message("Envia más documentos o escribe finitto para acabar tu sesión")
+                # A file sent again is answered from the ledger, without downloading or parsing it
+                document = webhook.get_document_of_document_message()
+                ingested = find_ingested_document(context.session.user_id, document.sha256)
+                if ingested is not None:
+                    with self.reply_batch(webhook) as reply:
+                        reply.text(already_ingested_text(ingested))
+                        reply.template("send_more_documents")
+                    return None
+
+                new_reps = process_document_webhook(webhook, context.user, context.document)
+                with self.reply_batch(webhook) as reply:
+                    if new_reps is None:
+                        reply.template("invalid_document")
+                    else:
+                        reply.template("document_processed")
+                    reply.template("send_more_documents")
+
 
-        
         except Exception as e:
-            logging.ERROR(f"Unexpected expection {e}, returning to IDLE")
-            send_message("Ha habido un error con tu petición, vuelve a empezar :)")
-            self.context.transition_to(IdleState())
+            logging.error(f"Unexpected expection {e}, returning to IDLE", exc_info=True)
+            self.reply_template(webhook, "restart_error")
+            return "ERROR"
+
+def already_ingested_text(ingested: IngestedDocument) -> str:
+    return (f"Este documento ya lo habías enviado el {ingested.created_at:%d/%m/%Y}: "
+            f"{ingested.reps_added} repeticiones en {ingested.sets_added} series registradas.")
+
 
 class EstimateOneRMState(State):
-    def handle_webhook(self,webhook):
+    def handle_webhook(self, context, webhook):
         try:
-            send_message("Bienvenido a tu calculadora de RM. Selecciona tu ejercicio para empezar")
+            self.reply(webhook, "Bienvenido a tu calculadora de RM. Selecciona tu ejercicio para empezar")
             #Mandar lista de ejercicios disponibles (lo tengo que mirar en el encoder)
-            
-        
+
+
         except Exception as e:
             pass
 
 """
-class CreateVelocityProfileState(State):"""
\ No newline at end of file
+class CreateVelocityProfileState(State):"""
+
+
+'''
+State machine runtime
+'''
+# current state -> action returned by the state -> next state
+TRANSITIONS = {
+    'IdleState': {
+        'TRAINING SELECTED': 'TrainingManagementState',
+    },
+    'TrainingManagementState': {
+        'END': 'IdleState',
+        'ADD TRAINING': 'AddTrainingState',
+        'ERROR': 'IdleState',
+    },
+    'AddTrainingState': {
+        'END': 'IdleState',
+        'ERROR': 'IdleState',
+    },
+}
+
+
+class StateMachine:
+    '''
+    Holds one shared instance per state and the transition table compiled
+    to direct state -> action -> State lookups.
+    '''
+
+    def __init__(self, states: Dict[str, State], transitions: Dict[str, Dict[str, str]] = TRANSITIONS):
+        self.states = states
+        self._table = self._compile(states, transitions)
+
+    @staticmethod
+    def _compile(states, transitions) -> Dict[State, Dict[str, State]]:
+        table = {}
+        for state_name, actions in transitions.items():
+            if state_name not in states:
+                raise ValueError(f"State not defined {state_name}")
+            row = {}
+            for action, target in actions.items():
+                if target not in states:
+                    raise ValueError(f"Transition {state_name} --{action}--> {target}: state not defined")
+                row[action] = states[target]
+            table[states[state_name]] = row
+        return table
+
+    def get_state(self, state_name: str) -> State:
+        state = self.states.get(state_name)
+        if state is None:
+            raise ValueError(f"State not defined {state_name}")
+        return state
+
+    def next_state(self, state: State, action: Optional[str]) -> Optional[State]:
+        if action is None:
+            return None
+        return self._table.get(state, {}).get(action)
+
+
+def create_state_machine(message_sender: MessageSender) -> StateMachine:
+    ''' Builds the state and handler singletons around a shared message sender '''
+    states = {
+        'IdleState': IdleState(IdleStateMessageHandler(message_sender)),
+        'TrainingManagementState': TrainingManagementState(TrainingManagementStateMessageHandler(message_sender)),
+        'AddTrainingState': AddTrainingState(AddTrainingStateMessageHandler(message_sender)),
+        #'EstimateOneRMState': EstimateOneRMState(),
+        #'CreateVelocityProfileState': CreateVelocityProfileState()
+        # Add other states as needed
+    }
+    return StateMachine(states, TRANSITIONS)
+
+
+def init_app(app) -> StateMachine:
+    ''' Creates the shared WhatsApp API client and the state machine for this app '''
+    api_client = WhatsappAPIClient.from_config(app.config)
+    dispatcher = None
+    if app.config.get("OUTBOUND_QUEUE", True):
+        dispatcher = OutboundDispatcher.from_config(app.config, api_client.post_message, api_client.http.breaker)
+        atexit.register(dispatcher.close)
+    machine = create_state_machine(WhatsappMessageSender(api_client, dispatcher))
+    app.extensions["whatsapp_api_client"] = api_client
+    app.extensions["outbound_dispatcher"] = dispatcher
+    app.extensions["state_machine"] = machine
+    return machine
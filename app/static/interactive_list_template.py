@@ -0,0 +1,84 @@
+'''
+Interactive list messages of the bot menus, as JSON payloads.
+
+`to` is left empty: the recipient is filled in for every send (see
+app.core.messaging.templates, which validates these at startup).
+'''
+import json
+
+# Main menu, sent from IdleState
+interactive_list_1 = json.dumps({
+    "messaging_product": "whatsapp",
+    "recipient_type": "individual",
+    "to": "",
+    "type": "interactive",
+    "interactive": {
+        "type": "list",
+        "header": {
+            "type": "text",
+            "text": "Menú principal"
+        },
+        "body": {
+            "text": "¿Qué quieres hacer hoy?"
+        },
+        "footer": {
+            "text": "Elige una opción de la lista"
+        },
+        "action": {
+            "button": "Opciones",
+            "sections": [
+                {
+                    "title": "Entrenamiento",
+                    "rows": [
+                        {
+                            "id": "training",
+                            "title": "Opciones entrenamiento",
+                            "description": "Registra y consulta tus entrenamientos"
+                        }
+                    ]
+                }
+            ]
+        }
+    }
+}, ensure_ascii=False)
+
+# Training menu, sent from TrainingManagementState
+interactive_list_2 = json.dumps({
+    "messaging_product": "whatsapp",
+    "recipient_type": "individual",
+    "to": "",
+    "type": "interactive",
+    "interactive": {
+        "type": "list",
+        "header": {
+            "type": "text",
+            "text": "Entrenamiento"
+        },
+        "body": {
+            "text": "Elige qué quieres hacer en tu entrenamiento"
+        },
+        "footer": {
+            "text": "Responde finitto para acabar"
+        },
+        "action": {
+            "button": "Opciones",
+            "sections": [
+                {
+                    "title": "Entrenamiento",
+                    "rows": [
+                        {
+                            "id": "add_training",
+                            "title": "Añade un entrenamiento",
+                            "description": "Envía el csv exportado de tu encoder ADR"
+                        },
+                        {
+                            "id": "estimate_rm",
+                            "title": "Estima tu RM",
+                            "description": "Próximamente"
+                        }
+                    ]
+                }
+            ]
+        }
+    }
+}, ensure_ascii=False)
@@ -0,0 +1,18 @@
+'''
+Text prompts the bot sends verbatim, by template name.
+'''
+
+text_templates = {
+    "choose_option": "Por favor, elige una opcion de la lista",
+    "choose_training_option": "Elige qué quieres hacer en tu entrenamiento",
+    "option_not_ready": "Selecciona otra opción, esta aun no está lista.",
+    "send_csv": "Manda tus datos en csv o envía finitto para acabar la sesión.",
+    "already_adding_training": "Ya has seleccionado una opción. Actualmente estás REGISTRANDO ENTRENAMIENTO\nPara acabar esta sesión, responde finitto",
+    "document_received": "ADR document recibido correctamente",
+    "document_processed": "Document received and processed.",
+    "invalid_document": "Sorry, this is not a valid csv.",
+    "send_more_documents": "Envia más documentos o escribe finitto para acabar tu sesión",
+    "request_error": "Ha habido un error con tu petición, vuelve a seleccionar la opción",
+    "restart_error": "Ha habido un error con tu petición, vuelve a empezar :)",
+    "retry_message": "Ha habido un problema, vuelve a enviar tu mensaje.",
+}
@@ -3,6 +3,7 @@ from datetime import datetime, timezone, timedelta
 import hashlib
 from flask import current_app
 from app import db
+from app.extensions import run_read
 import sqlalchemy as sa
 import sqlalchemy.orm as so
 from app.models.models import User, TrainingSession, TrainingDetail, Exercise
@@ -192,10 +193,14 @@ def reorder_columns(df):
         logger.error(f"Exception in reorder_columns: {e}", exc_info=True)
         raise
 
-def preprocess_adr_data(new_adr_path):
-    logger.debug(f"Preprocessing ADR data from path: {new_adr_path}")
+def preprocess_adr_data(source):
+    '''
+    `source` is a path or a binary file object (the download buffer), which
+    pandas parses in place without a copy on disk.
+    '''
+    logger.debug(f"Preprocessing ADR data from {source}")
     try:
-        new_data = pd.read_csv(new_adr_path)
+        new_data = pd.read_csv(source)
         logger.info("CSV data read successfully.")
 
         new_data_copy = new_data.copy()
@@ -339,6 +344,22 @@ def add_or_return_training_session(user) -> TrainingSession:
         raise
 
 
+# Exercise names are unique: one lookup on ix_exercises_name, inserting the name the first time it is seen
+def get_or_create_exercise_id(name) -> int:
+    query = sa.select(Exercise.id).where(Exercise.name == name)
+    ejercicio_id = db.session.scalar(query)
+    if ejercicio_id is not None:
+        return ejercicio_id
+    try:
+        # Savepoint: another worker may insert the same new exercise meanwhile
+        with db.session.begin_nested():
+            new_exercise = Exercise(name=name)
+            db.session.add(new_exercise)
+        return new_exercise.id
+    except sa.exc.IntegrityError:
+        return db.session.scalar(query)
+
+
 # Adds the information to the database
 def add_dataframe_to_training_detail(df, user, training_session):
     logger.debug(f"Adding DataFrame to TrainingDetail for session ID: {training_session.id}")
@@ -346,23 +367,8 @@ def add_dataframe_to_training_detail(df, user, training_session):
         temp_dict_ejercicio_id = {}
         for index, row in df.iterrows():
             if row['ejercicio'] not in temp_dict_ejercicio_id:
-                query = sa.select(Exercise).where(
-                    Exercise.name == row['ejercicio']
-                )
-
-                query_results = db.session.execute(query).scalars().all()
-                print(query_results)
-                if not query_results:
-                    new_exercise = Exercise(name = row['ejercicio'])
-                    db.session.add(new_exercise)
-                    db.session.flush()  # This will assign the ID without committing
-                    ejercicio_id = new_exercise.id  # Now you can access the ID
-                    temp_dict_ejercicio_id[row['ejercicio']] = ejercicio_id
-                else:  
-                    ejercicio_id = query_results[0].id
-                    temp_dict_ejercicio_id[row['ejercicio']] = ejercicio_id
-            else:
-                ejercicio_id = temp_dict_ejercicio_id[row['ejercicio']]
+                temp_dict_ejercicio_id[row['ejercicio']] = get_or_create_exercise_id(row['ejercicio'])
+            ejercicio_id = temp_dict_ejercicio_id[row['ejercicio']]
 
             training_detail = TrainingDetail(
                 session_id=training_session.id,
@@ -389,7 +395,7 @@ def add_dataframe_to_training_detail(df, user, training_session):
         raise
 
 # Gets the training details of a training session and puts them in a dataframe
-def get_training_detail_to_dataframe(user, training_session):
+def get_training_detail_to_dataframe(user, training_session, fresh=False):
     logger.debug(f"Fetching TrainingDetail records for user ID: {user.id} and session ID: {training_session.id}")
     try:
         query = sa.select(TrainingDetail).where(
@@ -399,27 +405,32 @@ def get_training_detail_to_dataframe(user, training_session):
             )
         )
 
-        query_results = db.session.execute(query).scalars().all()
-        logger.debug(f"Number of TrainingDetail records fetched: {len(query_results)}")
-
-        data = []
-        for detail in query_results:
-            data.append({
-                'id': detail.id,
-                'session_id': detail.session_id,
-                'timestamp': detail.timestamp,
-                'serie': detail.serie,
-                'rep': detail.rep,
-                'kg': detail.kg,
-                'd': detail.d,
-                'vm': detail.vm,
-                'vmp': detail.vmp,
-                'rm': detail.rm,
-                'p_w': detail.p_w,
-                'ejercicio': detail.ejercicio,
-                'atleta_id': detail.atleta_id,
-                'hash_id': detail.hash_id
-            })
+        def read(session):
+            query_results = session.execute(query).scalars().all()
+            logger.debug(f"Number of TrainingDetail records fetched: {len(query_results)}")
+
+            data = []
+            for detail in query_results:
+                data.append({
+                    'id': detail.id,
+                    'session_id': detail.session_id,
+                    'timestamp': detail.timestamp,
+                    'serie': detail.serie,
+                    'rep': detail.rep,
+                    'kg': detail.kg,
+                    'd': detail.d,
+                    'vm': detail.vm,
+                    'vmp': detail.vmp,
+                    'rm': detail.rm,
+                    'p_w': detail.p_w,
+                    'ejercicio': detail.ejercicio,
+                    'atleta_id': detail.atleta_id,
+                    'hash_id': detail.hash_id
+                })
+            return data
+
+        # History reads go to the read-only bind, off the webhook's pool
+        data = run_read(read, fresh=fresh)
         logger.info("TrainingDetail records converted to DataFrame successfully.")
         df = pd.DataFrame(data)
         return df
@@ -432,11 +443,11 @@ def get_training_detail_to_dataframe(user, training_session):
 '''
 Combined function
 '''
-def process_incoming_training_data(document_path, user):
-    logger.debug(f"Processing incoming training data from path: {document_path}")
+def process_incoming_training_data(source, user):
+    logger.debug(f"Processing incoming training data from {source}")
     try:
-        # Preprocess the incoming ADR data
-        adr_data_processed = preprocess_adr_data(document_path)
+        # Preprocess the incoming ADR data (a path or the downloaded buffer)
+        adr_data_processed = preprocess_adr_data(source)
         logger.debug("ADR data preprocessed successfully.")
 
         # Retrieve the user associated with the data
@@ -446,8 +457,8 @@ def process_incoming_training_data(document_path, user):
         training_session = add_or_return_training_session(user)
         logger.debug(f"Training session ID: {training_session.id}")
 
-        # Fetch existing training details from the database
-        db_dataframe = get_training_detail_to_dataframe(user, training_session)
+        # Fetch existing training details from the database, every commit of them: the new reps are what is missing
+        db_dataframe = get_training_detail_to_dataframe(user, training_session, fresh=True)
         logger.debug(f"Database DataFrame fetched with {len(db_dataframe)} records.")
 
         # Filter out records that already exist in the database
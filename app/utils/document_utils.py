@@ -1,10 +1,20 @@
+import base64
+import hashlib
+import hmac
 import logging
+import tempfile
+import time
 from flask import Blueprint, request, jsonify, current_app
 import requests
-from typing import Optional
+from typing import IO, Optional
 from pathlib import Path
+import sqlalchemy as sa
+from app import db
+from app.models.models import IngestedDocument
 from .adr_processor import preprocess_adr_data, process_incoming_training_data
-from .send_utils import send_message, get_text_message_input
+from .raw_store import raw_documents
+from ..core.messaging.graph_http import graph_http
+from ..core.training.analytics import training_analytics
 
 def get_media_url(media_id: str) -> Optional[str]:
     """
@@ -21,10 +31,10 @@ def get_media_url(media_id: str) -> Optional[str]:
         "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
     }
 
-    url = f"https://graph.facebook.com/{current_app.config['VERSION']}/{media_id}/"
+    url = f"{current_app.config['GRAPH_API_URL']}/{current_app.config['VERSION']}/{media_id}/"
 
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        response = graph_http.get(url, headers=headers)
         response.raise_for_status()  # Raises HTTPError for bad responses
     except requests.Timeout:
         logging.error(f"Timeout occurred while fetching media URL for media_id: {media_id}")
@@ -53,56 +63,200 @@ def get_media_url(media_id: str) -> Optional[str]:
     return media_url
 
 
-def download_adr_document_from_webhook(webhook):
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
-    }
+class DocumentDownloadError(Exception):
+    ''' A media download was too large, too slow or did not match its checksum '''
+
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def sha256_matches(digest: bytes, expected: str) -> bool:
+    ''' Compares a sha256 digest with the webhook's value, which may be hex or base64 '''
+    expected = expected.strip()
+    return (hmac.compare_digest(expected.lower(), digest.hex())
+            or hmac.compare_digest(expected, base64.b64encode(digest).decode()))
+
+
+def sha256_key(value: str) -> str:
+    ''' The webhook's sha256 (hex or base64) as lowercase hex, the document ledger key '''
+    value = value.strip()
+    if len(value) == 64:
+        try:
+            return bytes.fromhex(value).hex()
+        except ValueError:
+            pass
+    try:
+        digest = base64.b64decode(value, validate=True)
+        if len(digest) == 32:
+            return digest.hex()
+    except ValueError:
+        pass
+    # Not a sha256 at all; still a stable key for the same value
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def find_ingested_document(user_id: int, sha256: str) -> Optional[IngestedDocument]:
+    ''' Ledger entry of a document this user already sent, None if it is new '''
+    return db.session.execute(
+        sa.select(IngestedDocument).where(
+            IngestedDocument.user_id == user_id,
+            IngestedDocument.sha256 == sha256_key(sha256),
+        )
+    ).scalar_one_or_none()
+
+
+def record_ingested_document(user_id: int, document, new_reps) -> IngestedDocument:
+    ''' Adds the ingest summary of `document` to the ledger, committed with the webhook '''
+    entry = IngestedDocument(
+        user_id=user_id,
+        sha256=sha256_key(document.sha256),
+        filename=document.filename[:255],
+        reps_added=len(new_reps),
+        sets_added=int(new_reps['serie'].nunique()) if not new_reps.empty else 0,
+    )
+    db.session.add(entry)
+    return entry
+
+
+class VerifiedDownload:
+    '''
+    Collects a download chunk by chunk in a SpooledTemporaryFile, hashing it on
+    the way. The file stays in memory up to `spill_bytes` and only larger ones
+    spill to an anonymous temporary file, so small and medium exports never
+    touch the disk and uploads of different users can't collide on a name.
+
+    commit() checks the size and sha256 and hands over the buffer rewound, so
+    nothing half written or tampered with is ever ingested. The caller closes it.
+
+        with VerifiedDownload(document.sha256, max_bytes, spill_bytes) as download:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                download.write(chunk)
+            buffer = download.commit()
+    '''
+
+    def __init__(self, sha256: Optional[str], max_bytes: int, spill_bytes: int = 4 * 1024 * 1024,
+                 name: str = "document"):
+        self.sha256 = sha256
+        self.max_bytes = max_bytes
+        self.spill_bytes = spill_bytes
+        self.name = name
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = None
+
+    def __enter__(self) -> "VerifiedDownload":
+        self._file = tempfile.SpooledTemporaryFile(max_size=self.spill_bytes)
+        return self
+
+    def spills(self, chunk: bytes) -> bool:
+        ''' Whether writing `chunk` goes to disk (async callers move that write off the loop) '''
+        return self.size + len(chunk) > self.spill_bytes
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise DocumentDownloadError(f"{self.name} is larger than {self.max_bytes} bytes")
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def commit(self) -> IO[bytes]:
+        if self.sha256 is not None and not sha256_matches(self._hash.digest(), self.sha256):
+            raise DocumentDownloadError(f"{self.name} does not match its sha256")
+        buffer, self._file = self._file, None
+        buffer.seek(0)
+        return buffer
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
 
+
+def download_media(media_url: str, sha256: Optional[str] = None, name: str = "document") -> Optional[IO[bytes]]:
+    """
+    Streams a media file into a buffer, verifying its size and sha256.
+
+    Args:
+        media_url (str): URL returned by get_media_url.
+        sha256 (Optional[str]): Checksum sent in the webhook, hex or base64.
+        name (str): Filename used in log messages.
+
+    Returns:
+        Optional[IO[bytes]]: The content, rewound, in memory unless larger than
+        DOCUMENT_SPILL_BYTES. None if the download failed or was rejected.
+    """
+    config = current_app.config
+    headers = {"Authorization": f"Bearer {config['ACCESS_TOKEN']}"}
+    max_bytes = config.get("DOCUMENT_MAX_BYTES", 16 * 1024 * 1024)
+    spill_bytes = config.get("DOCUMENT_SPILL_BYTES", 4 * 1024 * 1024)
+    deadline = time.monotonic() + config.get("DOCUMENT_DOWNLOAD_TIMEOUT", 60)
+
+    try:
+        with graph_http.get(media_url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            if int(response.headers.get("Content-Length") or 0) > max_bytes:
+                raise DocumentDownloadError(f"{name} is larger than {max_bytes} bytes")
+            with VerifiedDownload(sha256, max_bytes, spill_bytes, name) as download:
+                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    if time.monotonic() > deadline:
+                        raise DocumentDownloadError(f"Download of {name} timed out")
+                    download.write(chunk)
+                return download.commit()
+    except requests.RequestException as req_err:
+        logging.error(f"Failed to download media: {req_err}")
+    except DocumentDownloadError as e:
+        logging.error(f"Rejected media download: {e}")
+    return None
+
+
+def download_adr_document_from_webhook(webhook) -> Optional[IO[bytes]]:
     document = webhook.get_document_of_document_message()
     logging.info(f'Document message {document.filename} received.')
-    if "adr" in document.filename:
-        logging.info(f'Will attempt to get media_url.')
-        media_url = get_media_url(document.id)
-        logging.info(f'Media URL: {media_url}')
-
-        # Make the GET request
-        response = requests.get(media_url, headers=headers)
-        output_file = document.filename
-
-        # Define the path to save the file (e.g., app/data/)
-        flask_path = Path(current_app.root_path) / 'data'
-        flask_path.mkdir(parents=True, exist_ok=True)  # Ensure the directory exists
-
-        # Complete file path
-        output_path = flask_path / output_file
-        # Check if the request was successful
-        if response.status_code == 200:
-            # Write the content to the file
-            with open(output_path, 'wb') as file:
-                file.write(response.content)
-            logging.info(f"Media downloaded successfully and saved to '{output_path}'.")
-            return output_path
-        else:
-            logging.error(f"Failed to download media. Status code: {response.status_code}")
-            print(f"Response message: {response.text}")
-
-            return None
-    else:
+    if "adr" not in document.filename:
         logging.info(f'This is not an ADR file.')
         return None
 
+    logging.info(f'Will attempt to get media_url.')
+    media_url = get_media_url(document.id)
+    logging.info(f'Media URL: {media_url}')
+    if media_url is None:
+        return None
 
-def process_document_webhook(webhook, user):
-    document_path = download_adr_document_from_webhook(webhook)
-    
-    if 'adr' in document_path.name and document_path != None:
-        adr_dataframe = process_incoming_training_data(document_path, user)
-        print(adr_dataframe.head()) 
-        
-        response = send_message("Document received and processed.")
+    content = download_media(media_url, document.sha256, document.filename)
+    if content is not None:
+        logging.info(f"Media {document.filename} downloaded successfully.")
+    return content
+
+
+def process_document_webhook(webhook, user, content: Optional[IO[bytes]] = None):
+    """
+    Ingests an ADR document sent by the user, straight from the download buffer.
+
+    Args:
+        webhook: Validated document webhook.
+        user: Owner of the training data.
+        content (Optional[IO[bytes]]): Already downloaded document, if any. Closed here.
+
+    Returns:
+        The DataFrame of new reps added, or None if the document is not a valid ADR csv.
+    """
+    document = webhook.get_document_of_document_message()
+    if 'adr' not in document.filename:
+        logging.debug("This is not a valid adrcsv!")
+        return None
+
+    if content is None:
+        content = download_adr_document_from_webhook(webhook)
+    if content is None:
+        return None
 
-    else:
-        print("This is not a valid adrcsv!")
-        send_message("Sorry, this is not a valid csv.")
-    
+    with content:
+        if raw_documents.enabled:
+            # Original kept for reprocessing; the download was verified against this sha256
+            raw_documents.put(content, sha256_key(document.sha256))
+            content.seek(0)
+        adr_dataframe = process_incoming_training_data(content, user)
+    logging.debug(adr_dataframe.head())
+    record_ingested_document(user.id, document, adr_dataframe)
+    training_analytics.invalidate(user.id)
+    return adr_dataframe
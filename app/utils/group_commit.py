@@ -0,0 +1,217 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+import sqlalchemy as sa
+
+logger = logging.getLogger(__name__)
+
+
+class WriteResult(NamedTuple):
+    rowcount: int
+    inserted_primary_key: Optional[Tuple[Any, ...]]
+
+
+class _Write(NamedTuple):
+    work: Callable[[sa.engine.Connection], Any]
+    future: Future
+
+
+class GroupCommitWriter:
+    '''
+    Funnels small writes of concurrent requests through one connection and
+    commits them together.
+
+    A request thread hands its statement to execute() and blocks until the
+    transaction holding it has committed: the return value is the
+    acknowledgment. The writer thread takes whatever is queued (at most
+    `max_batch`; while the previous batch held several writes it also waits up
+    to `window` seconds for more, a lone writer is not delayed), runs it
+    in a single BEGIN IMMEDIATE ... COMMIT with a savepoint per write, and
+    answers every caller. On SQLite that is one fsync and one trip through the
+    write lock per batch instead of per request, so write throughput grows
+    with concurrency instead of collapsing into lock waits. A failing write
+    only fails its own caller.
+
+    Writes are grouped within a worker process; each gunicorn worker has its
+    own writer. Callers must not hold a write transaction of their own on the
+    same database, the writer would wait on it. If the writer cannot reach
+    the database the pending writes fail and the next one starts it again;
+    a caller never waits longer than `timeout` seconds.
+    '''
+
+    def __init__(self, window: float = 0.002, max_batch: int = 64, timeout: float = 30.0):
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.engine: Optional[sa.engine.Engine] = None
+        self._queue: "queue.Queue[Optional[_Write]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._grouping = False
+        self.batches = 0
+        self.writes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.engine is not None
+
+    def init_app(self, app) -> None:
+        from app import db
+
+        self.close()
+        self.window = app.config.get("GROUP_COMMIT_WINDOW", self.window)
+        self.max_batch = app.config.get("GROUP_COMMIT_MAX_BATCH", self.max_batch)
+        self.timeout = app.config.get("GROUP_COMMIT_TIMEOUT", self.timeout)
+        self.engine = None
+        if app.config.get("GROUP_COMMIT", False):
+            with app.app_context():
+                self.engine = db.engine
+            atexit.register(self.close)
+
+    def configure(self, engine: Optional[sa.engine.Engine]) -> None:
+        ''' Points the writer at an engine directly (None disables it) '''
+        self.close()
+        self.engine = engine
+
+    def submit(self, work: Callable[[sa.engine.Connection], Any]) -> Future:
+        ''' Runs work(connection) in the next batch; the Future resolves once that batch committed '''
+        future = Future()
+        # Queued under the lock, a writer thread that is stopping either fails it or is replaced
+        with self._lock:
+            self._ensure_thread()
+            self._queue.put(_Write(work, future))
+        return future
+
+    def execute(self, statement, parameters=None, timeout: Optional[float] = None) -> WriteResult:
+        '''
+        Executes a Core DML statement in the next batch and waits for its
+        commit, at most `timeout` seconds (TimeoutError; the write may still
+        commit afterwards)
+        '''
+        def work(connection):
+            result = connection.execute(statement, parameters)
+            primary_key = result.inserted_primary_key if result.is_insert else None
+            return WriteResult(result.rowcount, tuple(primary_key) if primary_key is not None else None)
+        return self.submit(work).result(timeout=self.timeout if timeout is None else timeout)
+
+    def close(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+        self._grouping = False
+        self.batches = self.writes = 0
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "writes": self.writes,
+                "writes_per_batch": self.writes / self.batches if self.batches else 0.0}
+
+    '''
+    Internals
+    '''
+    def _ensure_thread(self) -> None:
+        ''' Starts the writer thread if there is none running in this process; called with _lock held '''
+        if self.engine is None:
+            raise RuntimeError("GroupCommitWriter is not configured")
+        # A forked worker inherits the object but not the thread, nor what its parent had queued
+        if self._pid != os.getpid():
+            self._queue = queue.Queue()
+            self._thread = None
+        if self._thread is None or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        begin = "BEGIN IMMEDIATE" if self.engine.dialect.name == "sqlite" else "BEGIN"
+        batch: List[_Write] = []
+        try:
+            # Transactions are issued by hand, pysqlite's implicit ones would commit at every RELEASE
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                stopping = False
+                while not stopping:
+                    first = self._queue.get()
+                    if first is None:
+                        break
+                    batch, stopping = self._collect(first)
+                    self._commit(connection, batch, begin)
+                    batch = []
+        except Exception as e:
+            logger.error(f"Group-commit writer stopped: {e}", exc_info=True)
+            self._fail_pending(batch, e)
+
+    def _fail_pending(self, batch: List[_Write], error: Exception) -> None:
+        ''' Fails the writes the stopping thread holds or had queued; the next submit starts a new thread '''
+        with self._lock:
+            if self._thread is threading.current_thread():
+                self._thread = None
+            pending = list(batch)
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    pending.append(item)
+        for write in pending:
+            if not write.future.done():
+                write.future.set_exception(error)
+
+    def _collect(self, first: _Write) -> Tuple[List[_Write], bool]:
+        batch = [first]
+        deadline = time.monotonic() + (self.window if self._grouping else 0)
+        while len(batch) < self.max_batch:
+            try:
+                remaining = deadline - time.monotonic()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit(self, connection: sa.engine.Connection, batch: List[_Write], begin: str) -> None:
+        outcomes = []
+        try:
+            connection.exec_driver_sql(begin)
+            for write in batch:
+                connection.exec_driver_sql("SAVEPOINT group_write")
+                try:
+                    result = write.work(connection)
+                    connection.exec_driver_sql("RELEASE SAVEPOINT group_write")
+                    outcomes.append((write, result, None))
+                except Exception as e:
+                    connection.exec_driver_sql("ROLLBACK TO SAVEPOINT group_write")
+                    connection.exec_driver_sql("RELEASE SAVEPOINT group_write")
+                    outcomes.append((write, None, e))
+            connection.exec_driver_sql("COMMIT")
+        except Exception as e:
+            logger.error(f"Group commit of {len(batch)} writes failed: {e}", exc_info=True)
+            try:
+                connection.exec_driver_sql("ROLLBACK")
+            except Exception:
+                pass
+            for write in batch:
+                write.future.set_exception(e)
+            return
+
+        self._grouping = len(batch) > 1
+        self.batches += 1
+        self.writes += len(batch)
+        for write, result, error in outcomes:
+            if error is None:
+                write.future.set_result(result)
+            else:
+                write.future.set_exception(error)
+
+
+db_writer = GroupCommitWriter()
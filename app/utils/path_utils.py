@@ -7,3 +7,10 @@ def get_download_data_path():
     Retorna la ruta completa para descargar datos, basada en la configuración actual.
     """
     return Path(current_app.root_path) / (current_app.config.get("DOWNLOAD_DATA_PATH"))
+
+
+def instance_path(app, path) -> Path:
+    """
+    Ruta configurada; las relativas van dentro de la carpeta instance de la app, fuera del código.
+    """
+    return Path(app.instance_path) / path
@@ -0,0 +1,172 @@
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import IO, Iterator, Optional
+
+from app.utils.path_utils import instance_path
+
+logger = logging.getLogger(__name__)
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class RawDocumentStore:
+    '''
+    Content-addressed archive of the raw ADR exports, kept for reprocessing.
+
+    A file lives at `<directory>/<sha[:2]>/<sha>.csv.gz`: the path is its
+    sha256, so names never collide and a file sent twice is stored once. Files
+    are gzip compressed at rest (CSV exports shrink several times) and read
+    back as streams with open().
+
+    The archive is capped: at startup and whenever it grows past `max_bytes`,
+    files older than `max_age` seconds are dropped and then the least recently
+    used ones (by mtime, refreshed on every put and open) down to 90% of the cap.
+    '''
+
+    SUFFIX = ".csv.gz"
+
+    def __init__(self):
+        self.directory: Optional[Path] = None
+        self.max_bytes = 256 * 1024 * 1024
+        self.max_age = 365 * 24 * 3600.0
+        self.compresslevel = 6
+        self._size: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    def init_app(self, app) -> None:
+        directory = app.config.get("RAW_STORE_DIR")
+        if not directory:
+            return
+        self.configure(
+            instance_path(app, directory),
+            max_bytes=app.config.get("RAW_STORE_MAX_BYTES", self.max_bytes),
+            max_age=app.config.get("RAW_STORE_MAX_AGE", self.max_age),
+        )
+
+    def configure(self, directory, max_bytes: int = None, max_age: float = None) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes or self.max_bytes
+        self.max_age = max_age or self.max_age
+        with self._lock:
+            self._size = None
+        self.evict()
+
+    def path(self, digest: str) -> Path:
+        return self.directory / digest[:2] / f"{digest}{self.SUFFIX}"
+
+    def __contains__(self, digest: str) -> bool:
+        return self.enabled and self.path(digest).exists()
+
+    def put(self, source: IO[bytes], digest: Optional[str] = None) -> str:
+        '''
+        Stores the stream from its current position and returns its sha256.
+        Pass `digest` when the content was already verified against it, the
+        stream is then compressed without hashing it again.
+        '''
+        if digest is not None and digest in self:
+            self._touch(self.path(digest))
+            return digest
+
+        hasher = hashlib.sha256()
+        fd, temporary = tempfile.mkstemp(dir=self.directory, prefix=".put-", suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0,
+                                                          compresslevel=self.compresslevel) as compressed:
+                for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b""):
+                    if digest is None:
+                        hasher.update(chunk)
+                    compressed.write(chunk)
+            digest = digest or hasher.hexdigest()
+            path = self.path(digest)
+            path.parent.mkdir(exist_ok=True)
+            size = os.path.getsize(temporary)
+            existed = path.exists()
+            os.replace(temporary, path)
+        except BaseException:
+            Path(temporary).unlink(missing_ok=True)
+            raise
+
+        if not existed:
+            self._grow(size)
+        logger.debug(f"Stored raw document {digest} ({size} bytes compressed)")
+        return digest
+
+    def open(self, digest: str) -> IO[bytes]:
+        ''' The original bytes as a stream, decompressed while read; FileNotFoundError if evicted '''
+        path = self.path(digest)
+        stream = gzip.open(path, "rb")
+        self._touch(path)
+        return stream
+
+    def read(self, digest: str) -> bytes:
+        with self.open(digest) as stream:
+            return stream.read()
+
+    def copy_to(self, digest: str, target: IO[bytes]) -> None:
+        with self.open(digest) as stream:
+            shutil.copyfileobj(stream, target, COPY_CHUNK_SIZE)
+
+    def evict(self) -> int:
+        ''' Drops expired files, then the least recently used until under the cap; returns files removed '''
+        now = time.time()
+        files = sorted(self._files(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in files)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for path, mtime, size in files:
+            if now - mtime < self.max_age and total <= target:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        with self._lock:
+            self._size = total
+        if removed:
+            logger.info(f"Evicted {removed} raw documents, {total} bytes kept")
+        return removed
+
+    def size(self) -> int:
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._files())
+            return self._size
+
+    '''
+    Internals
+    '''
+    def _files(self) -> Iterator[tuple]:
+        for path in self.directory.glob(f"??/*{self.SUFFIX}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            yield path, stat.st_mtime, stat.st_size
+
+    @staticmethod
+    def _touch(path: Path) -> None:
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _grow(self, size: int) -> None:
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+        if self.size() > self.max_bytes:
+            self.evict()
+
+
+raw_documents = RawDocumentStore()
@@ -5,7 +5,8 @@ from flask import current_app
 import os
 import requests
 import logging
-from app.static.interactive_list_template import interactive_list_1, interactive_list_2
+from app.core.messaging.graph_http import graph_http
+from app.core.messaging.templates import message_templates
 
 load_dotenv()
 ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
@@ -33,14 +34,19 @@ def get_text_message_input(text):
         }
     )
 
-def send_message(text):
-    headers = {
+def get_messages_url():
+    config = current_app.config
+    return f"{config['GRAPH_API_URL']}/{config['VERSION']}/{config['PHONE_NUMBER_ID']}/messages"
+
+def get_headers():
+    return {
         "Content-type": "application/json",
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
+        "Authorization": f"Bearer {current_app.config['ACCESS_TOKEN']}",
     }
 
-
-    url = f"https://graph.facebook.com/{VERSION}/{PHONE_NUMBER_ID}/messages"
+def send_message(text):
+    headers = get_headers()
+    url = get_messages_url()
 
 
     ''' Response <class 'requests.models.Response'>
@@ -55,9 +61,7 @@ def send_message(text):
     data = get_text_message_input(text)
 
     try:
-        response = requests.post(
-            url, data=data, headers=headers, timeout=10
-        )  # 10 seconds timeout as an example
+        response = graph_http.post(url, data=data, headers=headers)
         response.raise_for_status()  # Raises an HTTPError if the HTTP request returned an unsuccessful status code
     except requests.Timeout:
         logging.error("Timeout occurred while sending message")
@@ -72,20 +76,18 @@ def send_message(text):
         log_http_response(response)
         return response
 
-def send_interactive_list(list_option):
-    headers = {
-        "Content-type": "application/json",
-        "Authorization": f"Bearer {ACCESS_TOKEN}",
-    }
+def send_interactive_list(list_option, to=None):
+    headers = get_headers()
+    to = to or current_app.config.get("RECIPIENT_WAID")
 
     if list_option == 1:
-        data = interactive_list_1
+        data = message_templates["main_menu"].body(to)
     if list_option == 2:
-        data = interactive_list_2  
+        data = message_templates["training_menu"].body(to)
 
-    url = f"https://graph.facebook.com/{VERSION}/{PHONE_NUMBER_ID}/messages"
+    url = get_messages_url()
 
-    response = requests.post(url, data=data, headers=headers)
+    response = graph_http.post(url, data=data, headers=headers)
     if response.status_code == 200:
         print("Status:", response.status_code)
         print("Content-type:", response.headers["content-type"])
@@ -0,0 +1,13 @@
+import logging
+
+from app.aio import create_asgi_app
+from app.config import ProductionConfig
+
+
+application = create_asgi_app(ProductionConfig)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    logging.info("ASGI app started")
+    uvicorn.run(application, host="0.0.0.0", port=8000)
@@ -0,0 +1,99 @@
+'''
+Reply latency of assistant runs against the local OpenAI stub: the old loop
+(assistant retrieved per message, runs polled every 0.5 s) against
+AssistantRunner with backoff polling, with the run event stream and with
+the response cache in front of it. --distinct N draws the questions from N
+common ones, the way athletes repeat them.
+
+Reported per message: time from the question to the answer beyond the run's
+own duration (what the waiting strategy adds) and the API requests made.
+
+    python -m benchmarks.bench_assistant_runs --messages 40 --run-latency 1.5 --jitter 1.0 --distinct 8
+'''
+import argparse
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app.services.assistant_runner import AssistantRunner
+from app.services.response_cache import ResponseCache
+from app.services.thread_store import ThreadStore
+from tools.loadtest import percentile
+from tools.openai_stub import OpenAIStub
+
+
+def legacy_generate_response(client, assistant_id: str, threads: ThreadStore, message_body: str, wa_id: str) -> str:
+    ''' openai_service before the runner: retrieve the assistant and poll every 0.5 s '''
+    thread_id = threads.get(wa_id)
+    if thread_id is None:
+        thread_id = threads.setdefault(wa_id, client.beta.threads.create().id)
+    client.beta.threads.messages.create(thread_id=thread_id, role="user", content=message_body)
+    assistant = client.beta.assistants.retrieve(assistant_id)
+    run = client.beta.threads.runs.create(thread_id=thread_id, assistant_id=assistant.id)
+    while run.status != "completed":
+        time.sleep(0.5)
+        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+    messages = client.beta.threads.messages.list(thread_id=thread_id)
+    return messages.data[0].content[0].text.value
+
+
+def legacy(client, threads: ThreadStore):
+    return lambda body, wa_id: legacy_generate_response(client, "asst_stub", threads, body, wa_id)
+
+
+def backoff_polling(client, threads: ThreadStore):
+    runner = AssistantRunner(client, "asst_stub", threads, stream=False)
+    return lambda body, wa_id: runner.generate_response(body, wa_id, "bench")
+
+
+def streaming(client, threads: ThreadStore):
+    runner = AssistantRunner(client, "asst_stub", threads, stream=True)
+    return lambda body, wa_id: runner.generate_response(body, wa_id, "bench")
+
+
+def cached(client, threads: ThreadStore):
+    runner = AssistantRunner(client, "asst_stub", threads, stream=True, cache=ResponseCache())
+    return lambda body, wa_id: runner.generate_response(body, wa_id, "bench")
+
+
+def measure(name: str, args, build) -> str:
+    client = OpenAIStub(run_latency=args.run_latency, jitter=args.jitter)
+    with tempfile.TemporaryDirectory() as directory:
+        respond = build(client, ThreadStore(str(Path(directory) / "threads.sqlite")))
+
+        def one(seq: int) -> float:
+            started = time.monotonic()
+            question = seq % args.distinct if args.distinct else seq
+            respond(f"¿Qué es la pérdida de velocidad? ({question})", f"346{seq % args.users:08d}")
+            return time.monotonic() - started
+
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            replies = [value * 1000 for value in executor.map(one, range(args.messages))]
+
+    # Per message, so cache hits count as runs that took no time
+    run_time = sum(run.done_at - run.created_at for run in client.runs.values()) * 1000 / args.messages
+    requests = sum(client.calls.values()) / args.messages
+    return (f"{name:<16} reply mean={sum(replies) / len(replies):6.0f}  p95={percentile(replies, 95):6.0f} ms  "
+            f"added to the run={sum(replies) / len(replies) - run_time:5.0f} ms  requests/message={requests:4.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--run-latency", type=float, default=1.5, help="seconds a run takes on the stub")
+    parser.add_argument("--jitter", type=float, default=1.0)
+    parser.add_argument("--distinct", type=int, default=0, help="distinct questions, 0 for all different")
+    args = parser.parse_args()
+
+    print(f"{args.messages} questions from {args.users} users (one question in flight per thread), runs of {args.run_latency}+/-{args.jitter} s")
+    print(measure("0.5 s polling", args, legacy))
+    print(measure("backoff polling", args, backoff_polling))
+    print(measure("streaming", args, streaming))
+    print(measure("cache+stream", args, cached))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+'''
+Per-message latency of outbound Graph API calls: a fresh connection per call
+(bare requests.post, how the bot used to send) against the pooled keep-alive
+GraphSession every synchronous path now shares.
+
+Messages go to the local Graph API stub by default, where the saving is the
+TCP connect plus the per-call session setup. Against a TLS endpoint such as
+graph.facebook.com the handshake round trips make the difference larger:
+
+    python -m benchmarks.bench_graph_client --messages 500
+    python -m benchmarks.bench_graph_client --url https://graph.example/v18.0/123/messages
+'''
+import argparse
+import time
+
+import requests
+
+from app.core.messaging.graph_http import GraphSession
+from tools.graph_stub import GraphStub, StubThread
+from tools.loadtest import percentile
+
+
+def payload(seq: int) -> dict:
+    return {
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": "34600000001",
+        "type": "text",
+        "text": {"preview_url": False, "body": f"Mensaje {seq}"},
+    }
+
+
+def measure(send, url: str, messages: int) -> list:
+    latencies = []
+    for seq in range(messages):
+        started = time.perf_counter()
+        response = send(url, json=payload(seq), headers={"Authorization": "Bearer bench"}, timeout=10)
+        latencies.append(time.perf_counter() - started)
+        response.raise_for_status()
+    return latencies
+
+
+def summary(name: str, latencies: list) -> str:
+    ms = [value * 1000 for value in latencies]
+    return (f"{name:<22} mean={sum(ms) / len(ms):7.2f}  p50={percentile(ms, 50):7.2f}  "
+            f"p95={percentile(ms, 95):7.2f}  p99={percentile(ms, 99):7.2f} ms")
+
+
+def run(url: str, messages: int) -> None:
+    session = GraphSession()
+    # Warm-up opens the pooled connection, as the first reply of a worker would
+    measure(session.post, url, 5)
+    measure(requests.post, url, 5)
+
+    fresh = measure(requests.post, url, messages)
+    pooled = measure(session.post, url, messages)
+    session.close()
+
+    print(f"{messages} messages to {url}")
+    print(summary("new connection", fresh))
+    print(summary("pooled keep-alive", pooled))
+    saving = (sum(fresh) - sum(pooled)) / messages * 1000
+    print(f"saving per message     {saving:.2f} ms ({100 * (1 - sum(pooled) / sum(fresh)):.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--url", help="messages endpoint; default starts the local Graph API stub")
+    parser.add_argument("--stub-port", type=int, default=8083)
+    args = parser.parse_args()
+
+    if args.url:
+        run(args.url, args.messages)
+        return
+    stub = GraphStub(port=args.stub_port)
+    with StubThread(stub):
+        run(f"{stub.url}/v18.0/bench/messages", args.messages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+'''
+State-change write throughput with and without the group-commit writer.
+
+`--threads` request threads of one worker each flip their athlete between
+IdleState and TrainingManagementState through user_sessions.write_state, the
+write every transition makes, for `--duration` seconds. Each combination of
+SQLite profile and GROUP_COMMIT starts from a fresh database file.
+
+    python -m benchmarks.bench_group_commit --threads 1 8 32 --duration 5
+'''
+import argparse
+import logging
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from tools.loadtest import percentile
+
+STATES = ("IdleState", "TrainingManagementState")
+
+
+def make_config(path: str, profile: str, group_commit: bool):
+    from app.config import TestingConfig
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{path}"
+        SQLITE_PROFILE = profile
+        GROUP_COMMIT = group_commit
+        OUTBOUND_QUEUE = False
+
+    return BenchConfig
+
+
+def measure(directory: str, profile: str, group_commit: bool, threads: int, duration: float) -> str:
+    from app import create_app, db
+    from app.state.session_cache import user_sessions
+    from app.utils.group_commit import db_writer
+
+    path = str(Path(directory).resolve() / f"{profile}-{group_commit}-{threads}.sqlite")
+    app = create_app(make_config(path, profile, group_commit))
+    logging.getLogger().setLevel(logging.ERROR)
+    with app.app_context():
+        db.create_all()
+        sessions = [user_sessions.resolve(f"346{number:08d}", "bench") for number in range(threads)]
+        db.session.commit()
+
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + duration
+
+    def worker(session):
+        timings = []
+        with app.app_context():
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    session = user_sessions.write_state(session, STATES[session.state == STATES[0]])
+                except Exception as e:
+                    errors.append(e)
+                    db.session.rollback()
+                    session = user_sessions.resolve(session.wa_id)
+                    continue
+                timings.append((time.perf_counter() - started) * 1000)
+        latencies.extend(timings)
+
+    workers = [threading.Thread(target=worker, args=(session,)) for session in sessions]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    batched = db_writer.stats()["writes_per_batch"] if group_commit else 1.0
+    db_writer.close()
+
+    mode = "group commit" if group_commit else "direct"
+    return (f"{profile:<12} {mode:<12} {threads:3d} threads  {len(latencies) / duration:7.0f} writes/s  "
+            f"p50={statistics.median(latencies):6.2f}  p99={percentile(latencies, 99):7.2f} ms  "
+            f"writes/commit={batched:5.1f}  errors={len(errors)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--profiles", nargs="+", default=["default", "performance"])
+    parser.add_argument("--dir", help="directory for the database files (the disk matters: fsync cost)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for profile in args.profiles:
+            for threads in args.threads:
+                for group_commit in (False, True):
+                    print(measure(directory, profile, group_commit, threads, args.duration))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+'''
+Build-and-encode microbenchmark for the outbound message types.
+
+Builds 10k messages (plain texts, interactive lists with two sections and a
+template reply) and encodes each to the request body, comparing the generic
+path (nested to_dict() then json) with Message.encode(). Also reports the
+memory held by the built messages.
+
+    python -m benchmarks.bench_message_encoding --messages 10000
+'''
+import argparse
+import gc
+import time
+import tracemalloc
+
+from app.core.messaging.sendMessage_types import (
+    ActionObject, FooterObject, InteractiveBodyObject, InteractiveMessage, InteractiveObject,
+    Row, SectionObject, TextHeader, encode_payload, text_message,
+)
+from app.core.messaging.templates import message_templates
+
+
+def interactive(to: str, seq: int) -> InteractiveMessage:
+    sections = [
+        SectionObject(title=f"Semana {week}", rows=[
+            Row(id=f"s{week}-{day}", title=f"Sesión {day}", description=f"Entrenamiento {seq}")
+            for day in range(3)
+        ])
+        for week in range(2)
+    ]
+    return InteractiveMessage(
+        to=to, status="", type="interactive", messaging_product="whatsapp",
+        interactive=InteractiveObject(
+            type="list",
+            action=ActionObject(sections=sections),
+            header=TextHeader(type="text", sub_text=None, text="Tus sesiones"),
+            body=InteractiveBodyObject(text="Elige una sesión"),
+            footer=FooterObject(text="Responde finitto para acabar"),
+        ),
+    )
+
+
+def build(count: int) -> list:
+    messages = []
+    for seq in range(count):
+        to = f"346{seq:08d}"
+        kind = seq % 3
+        if kind == 0:
+            messages.append(text_message(to, f"Has levantado {seq % 200} kg a 0.{seq % 9 + 1} m/s"))
+        elif kind == 1:
+            messages.append(interactive(to, seq))
+        else:
+            messages.append(message_templates.message("send_csv", to))
+    return messages
+
+
+def timed(function, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    messages = build(args.messages)
+    assert all(message.encode() for message in messages)
+
+    build_time = timed(lambda: build(args.messages), args.repeat)
+    generic_time = timed(lambda: [encode_payload(message.to_dict()) for message in messages], args.repeat)
+    encode_time = timed(lambda: [message.encode() for message in messages], args.repeat)
+
+    del messages
+    gc.collect()
+    tracemalloc.start()
+    kept = build(args.messages)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    per_message = 1e6 / args.messages
+    print(f"{args.messages} messages (texts, interactive lists, templates), best of {args.repeat}")
+    print(f"build                  {build_time * 1000:8.1f} ms  {build_time * per_message:6.2f} us/message")
+    print(f"to_dict() + json       {generic_time * 1000:8.1f} ms  {generic_time * per_message:6.2f} us/message")
+    print(f"encode()               {encode_time * 1000:8.1f} ms  {encode_time * per_message:6.2f} us/message")
+    print(f"memory held            {memory / 1024:8.1f} KiB {memory / len(kept):6.0f} B/message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+'''
+Query plans and latency of the hot queries before and after the indexes of
+migration 8d3f4a6b2c1e, on a synthetic SQLite database.
+
+The schema comes from the models. The indexes the migration adds are dropped
+to get the schema of 0cacbed1678f, the tables are filled with `--reps`
+synthetic reps (100 per session, sessions spread over `--users` athletes),
+and each query is explained and timed; then the indexes are created and the
+same queries run again. The queries are the SQL the ORM emits for:
+
+    session reps      get_training_detail_to_dataframe
+    recent sessions   add_or_return_training_session
+    exercise by name  get_or_create_exercise_id
+    rep by hash       hash_id lookups
+    analytics window  TrainingAnalytics
+
+    python -m benchmarks.bench_query_plans --reps 10000000
+'''
+import argparse
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import sqlalchemy as sa
+
+from app import db
+from app.models import models  # noqa: F401, registers the tables
+
+NEW_INDEXES = (
+    "ix_exercises_name",
+    "ix_training_sessions_user_id_created_at",
+    "ix_training_details_hash_id",
+    "ix_training_details_atleta_id_session_id",
+    "ix_training_details_atleta_id_timestamp",
+)
+REPS_PER_SESSION = 100
+EXERCISES = 40
+
+QUERIES = {
+    "session reps": (
+        "SELECT * FROM training_details WHERE training_details.atleta_id = ? AND training_details.session_id = ?",
+        lambda keys: (keys.user, keys.session),
+    ),
+    "recent sessions": (
+        "SELECT * FROM training_sessions WHERE training_sessions.user_id = ? "
+        "AND training_sessions.created_at >= ? AND training_sessions.created_at <= ?",
+        lambda keys: (keys.user, keys.at(-180), keys.at(0)),
+    ),
+    "exercise by name": (
+        "SELECT exercises.id FROM exercises WHERE exercises.name = ?",
+        lambda keys: (f"Ejercicio {keys.exercise}",),
+    ),
+    "rep by hash": (
+        "SELECT training_details.id FROM training_details WHERE training_details.hash_id = ?",
+        lambda keys: (keys.hash_id,),
+    ),
+    "analytics window": (
+        "SELECT training_details.session_id, training_details.serie, training_details.kg, training_details.vmp, "
+        "training_details.rm, training_details.timestamp, exercises.name FROM training_details "
+        "JOIN exercises ON training_details.ejercicio_id = exercises.id "
+        "WHERE training_details.atleta_id = ? AND training_details.timestamp >= ?",
+        # The last 90 days of data, as the window is counted from now
+        lambda keys: (keys.user, keys.at(keys.sessions * 5 - keys.minute - 90 * 24 * 60)),
+    ),
+}
+
+
+class Keys:
+    ''' Random existing keys: a session, its athlete and time, an exercise and a rep hash '''
+
+    def __init__(self, connection: sqlite3.Connection, sessions: int, users: int, seed: int):
+        self.random = random.Random(seed)
+        self.connection = connection
+        self.sessions = sessions
+        self.users = users
+
+    def next(self) -> "Keys":
+        self.session = self.random.randint(1, self.sessions)
+        self.user = self.session % self.users + 1
+        self.exercise = self.random.randint(1, EXERCISES)
+        self.hash_id = self.connection.execute(
+            "SELECT hash_id FROM training_details WHERE id = ?",
+            (self.random.randint(1, self.sessions * REPS_PER_SESSION),),
+        ).fetchone()[0]
+        self.minute = self.session * 5
+        return self
+
+    def at(self, minutes: int) -> str:
+        ''' Timestamp `minutes` after the session's start '''
+        return self.connection.execute(
+            "SELECT datetime('2024-01-01', ?)", (f"{self.minute + minutes:+d} minutes",)
+        ).fetchone()[0]
+
+
+def build(path: str, reps: int, users: int) -> int:
+    engine = sa.create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine)
+    engine.dispose()
+
+    sessions = reps // REPS_PER_SESSION
+    connection = sqlite3.connect(path)
+    for name in NEW_INDEXES:
+        connection.execute(f"DROP INDEX {name}")
+    connection.executescript(f"""
+        PRAGMA journal_mode=OFF;
+        PRAGMA synchronous=OFF;
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {users})
+        INSERT INTO users (id, phone_number, state, created_at, updated_at)
+        SELECT i, printf('346%08d', i), 'IdleState', '2024-01-01 00:00:00', '2024-01-01 00:00:00' FROM n;
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {EXERCISES})
+        INSERT INTO exercises (id, name) SELECT i, 'Ejercicio ' || i FROM n;
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {sessions})
+        INSERT INTO training_sessions (id, user_id, created_at, updated_at)
+        SELECT i, i % {users} + 1, datetime('2024-01-01', '+' || (i * 5) || ' minutes'),
+               datetime('2024-01-01', '+' || (i * 5) || ' minutes') FROM n;
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < {sessions * REPS_PER_SESSION - 1})
+        INSERT INTO training_details (session_id, timestamp, serie, rep, kg, vmp, rm, ejercicio_id, atleta_id,
+                                      hash_id, created_at, updated_at)
+        SELECT i / {REPS_PER_SESSION} + 1,
+               datetime('2024-01-01', '+' || ((i / {REPS_PER_SESSION} + 1) * 5) || ' minutes',
+                        '+' || (i % {REPS_PER_SESSION}) || ' seconds'),
+               (i % {REPS_PER_SESSION}) / 10 + 1, i % 10 + 1, 40 + ((i / 10) % 8) * 10,
+               1.2 - ((i / 10) % 8) * 0.1 - (i % 10) * 0.01, 100,
+               (i / {REPS_PER_SESSION}) % {EXERCISES} + 1, (i / {REPS_PER_SESSION} + 1) % {users} + 1,
+               hex(randomblob(16)), '2024-01-01 00:00:00', '2024-01-01 00:00:00'
+        FROM n;
+        ANALYZE;
+    """)
+    connection.close()
+    return sessions
+
+
+def add_indexes(path: str) -> None:
+    engine = sa.create_engine(f"sqlite:///{path}")
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in NEW_INDEXES:
+                index.create(engine)
+    with engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE")
+    engine.dispose()
+
+
+def measure(path: str, sessions: int, users: int, lookups: int, budget: float) -> dict:
+    connection = sqlite3.connect(path)
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        keys = Keys(connection, sessions, users, seed=len(name))
+        plan = " / ".join(row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", params(keys.next())))
+        timings = []
+        deadline = time.monotonic() + budget
+        # Full scans of a large table take seconds: stop at the time budget, after three runs at least
+        while len(timings) < lookups and (len(timings) < 3 or time.monotonic() < deadline):
+            arguments = params(keys.next())
+            started = time.perf_counter()
+            connection.execute(sql, arguments).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = (plan, statistics.median(timings))
+    connection.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reps", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=200, help="runs of each query")
+    parser.add_argument("--budget", type=float, default=10.0, help="seconds per query before stopping early")
+    parser.add_argument("--db", help="keep the database at this path instead of a temporary file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = args.db or str(Path(directory) / "bench.sqlite")
+        started = time.monotonic()
+        sessions = build(path, args.reps, args.users)
+        print(f"{sessions * REPS_PER_SESSION} reps, {sessions} sessions, {args.users} athletes "
+              f"built in {time.monotonic() - started:.0f} s")
+        before = measure(path, sessions, args.users, args.lookups, args.budget)
+        started = time.monotonic()
+        add_indexes(path)
+        print(f"indexes created in {time.monotonic() - started:.0f} s")
+        after = measure(path, sessions, args.users, args.lookups, args.budget)
+
+    for name in QUERIES:
+        (plan_before, before_ms), (plan_after, after_ms) = before[name], after[name]
+        print(f"\n{name}: {before_ms:.3f} ms -> {after_ms:.3f} ms ({before_ms / after_ms:.0f}x)")
+        print(f"  before: {plan_before}")
+        print(f"  after:  {plan_after}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+'''
+Webhook writes next to analytics reads, with and without the read-only bind.
+
+One worker process on a SQLite file under the performance profile, filled
+with `--reps` reps of `--users` athletes. `--writers` threads flip their
+athlete's state through user_sessions.write_state (the write of every
+transition) while `--readers` threads recompute TrainingAnalytics for random
+athletes, the history read of the analytics commands, one every
+`--read-interval` seconds each (the same analytics load in both runs), for
+`--duration` seconds. Each run reads from the primary or, with
+SQLITE_READ_ONLY_BIND, from a read-only pool on the same file; the database
+is rebuilt for every run.
+
+    python -m benchmarks.bench_read_routing --writers 8 --readers 4 --pool-size 8 --order bind primary bind primary
+'''
+import argparse
+import logging
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from tools.loadtest import percentile
+
+STATES = ("IdleState", "TrainingManagementState")
+REPS_PER_SESSION = 100
+
+
+def make_config(path: str, read_bind: bool, pool_size: int):
+    from app.config import TestingConfig
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{path}"
+        SQLITE_PROFILE = "performance"
+        SQLITE_READ_ONLY_BIND = read_bind
+        SQLALCHEMY_ENGINE_OPTIONS = {"pool_size": pool_size, "max_overflow": 0}
+        OUTBOUND_QUEUE = False
+        ANALYTICS_CACHE_TTL = 0
+
+    return BenchConfig
+
+
+def fill(path: str, reps: int, users: int) -> None:
+    sessions = reps // REPS_PER_SESSION
+    connection = sqlite3.connect(path)
+    connection.executescript(f"""
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 8)
+        INSERT INTO exercises (id, name) SELECT i, 'Ejercicio ' || i FROM n;
+        WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {sessions})
+        INSERT INTO training_sessions (id, user_id, created_at, updated_at)
+        SELECT i, i % {users} + 1, datetime('now', '-' || (i % 60) || ' days'), datetime('now') FROM n;
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < {sessions * REPS_PER_SESSION - 1})
+        INSERT INTO training_details (session_id, timestamp, serie, rep, kg, vmp, rm, ejercicio_id, atleta_id,
+                                      hash_id, created_at, updated_at)
+        SELECT i / {REPS_PER_SESSION} + 1, datetime('now', '-' || ((i / {REPS_PER_SESSION} + 1) % 60) || ' days'),
+               (i % {REPS_PER_SESSION}) / 10 + 1, i % 10 + 1, 40 + ((i / 10) % 8) * 10,
+               1.2 - ((i / 10) % 8) * 0.1 - (i % 10) * 0.01, 100, (i / {REPS_PER_SESSION}) % 8 + 1,
+               (i / {REPS_PER_SESSION} + 1) % {users} + 1, hex(randomblob(16)), datetime('now'), datetime('now')
+        FROM n;
+        ANALYZE;
+    """)
+    connection.commit()
+    connection.close()
+
+
+def measure(directory: str, run: int, read_bind: bool, args) -> str:
+    from app import create_app, db
+    from app.core.training.analytics import training_analytics
+    from app.state.session_cache import user_sessions
+
+    path = str(Path(directory).resolve() / f"run-{run}.sqlite")
+    app = create_app(make_config(path, read_bind, args.pool_size))
+    logging.getLogger().setLevel(logging.ERROR)
+    with app.app_context():
+        db.create_all()
+        # Athletes 1..users own the history; the writers get athletes of their own
+        users = [user_sessions.resolve(f"346{number:08d}", "bench") for number in range(args.users)]
+        writers = [user_sessions.resolve(f"347{number:08d}", "bench") for number in range(args.writers)]
+        db.session.commit()
+    fill(path, args.reps, args.users)
+
+    writes, reads = [], []
+    deadline = time.monotonic() + args.duration
+
+    def writer(session):
+        with app.app_context():
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                session = user_sessions.write_state(session, STATES[session.state == STATES[0]])
+                writes.append((time.perf_counter() - started) * 1000)
+
+    def reader(seed):
+        chooser = random.Random(seed)
+        with app.app_context():
+            next_read = time.monotonic()
+            while next_read < deadline:
+                time.sleep(max(0.0, next_read - time.monotonic()))
+                next_read += args.read_interval
+                started = time.perf_counter()
+                training_analytics.for_user(chooser.choice(users).user_id)
+                db.session.remove()
+                reads.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=writer, args=(session,)) for session in writers]
+    threads += [threading.Thread(target=reader, args=(seed,)) for seed in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    mode = "read bind" if read_bind else "primary"
+    return (f"{mode:<10} writes {len(writes) / args.duration:6.0f}/s p50={statistics.median(writes):6.2f} "
+            f"p99={percentile(writes, 99):7.2f} ms   analytics {len(reads) / args.duration:5.1f}/s "
+            f"p50={statistics.median(reads):6.1f} p99={percentile(reads, 99):6.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--reps", type=int, default=500_000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--read-interval", type=float, default=0.5, help="seconds between reads of a reader")
+    parser.add_argument("--pool-size", type=int, default=10, help="primary pool size (and of the read bind)")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--dir", help="directory for the database files")
+    parser.add_argument("--order", type=lambda value: value == "bind", nargs="+", default=[False, True],
+                        help="runs to make, 'primary' or 'bind' each; alternate them on a noisy machine")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for run, read_bind in enumerate(args.order):
+            print(measure(directory, run, read_bind, args))
+
+
+if __name__ == "__main__":
+    main()
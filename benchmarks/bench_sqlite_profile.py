@@ -0,0 +1,171 @@
+'''
+Concurrent ingest and webhook load on a SQLite file, per SQLITE_PROFILE.
+
+Worker processes share one database file, as gunicorn workers do:
+  webhook  walks its athletes through Idle -> TrainingManagement -> Idle
+           (session cache, state machine, write-through of the new state)
+  ingest   adds a 200-rep ADR set to the athlete's current session
+           (add_or_return_training_session + add_dataframe_to_training_detail)
+
+For each profile the database starts empty, the workers run for
+`--duration` seconds and the throughput, latency percentiles and "database is
+locked" errors are reported (also those the states catch and log).
+
+    python -m benchmarks.bench_sqlite_profile --webhook-workers 4 --ingest-workers 2 --duration 15
+'''
+import argparse
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from tools.loadtest import percentile
+
+REPS_PER_INGEST = 200
+USERS_PER_WORKER = 20
+
+
+def make_config(profile: str, path: str):
+    from app.config import TestingConfig
+
+    class BenchConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{path}"
+        SQLITE_PROFILE = profile
+        OUTBOUND_QUEUE = False
+        TRAFFIC_CAPTURE_DIR = None
+
+    return BenchConfig
+
+
+class LockCounter(logging.Handler):
+    ''' Counts the lock errors the states catch and only log '''
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.locked = 0
+
+    def emit(self, record):
+        text = record.getMessage() + (logging.Formatter().formatException(record.exc_info) if record.exc_info else "")
+        if "database is locked" in text:
+            self.locked += 1
+
+
+def ingest_frame(worker: int, seq: int) -> pd.DataFrame:
+    now = pd.Timestamp.now(tz="UTC")
+    return pd.DataFrame({
+        "timestamp": [now] * REPS_PER_INGEST,
+        "serie": [rep // 10 + 1 for rep in range(REPS_PER_INGEST)],
+        "rep": [rep % 10 + 1 for rep in range(REPS_PER_INGEST)],
+        "kg": [60.0 + (rep // 10) * 5 for rep in range(REPS_PER_INGEST)],
+        "d": [50.0] * REPS_PER_INGEST,
+        "vm": [0.8] * REPS_PER_INGEST,
+        "vmp": [0.9 - (rep // 10) * 0.03 for rep in range(REPS_PER_INGEST)],
+        "rm": [120] * REPS_PER_INGEST,
+        "p_w": [400.0] * REPS_PER_INGEST,
+        "ejercicio": ["Sentadilla profunda"] * REPS_PER_INGEST,
+        "hash_id": [f"{worker}-{seq}-{rep}" for rep in range(REPS_PER_INGEST)],
+    })
+
+
+def worker_main(kind: str, worker: int, profile: str, path: str, duration: float, results) -> None:
+    from app import create_app, db
+    from app.models.models import User
+    from app.state.session_cache import user_sessions
+    from app.state.states.states import UserContext, create_state_machine
+    from app.utils.adr_processor import add_dataframe_to_training_detail, add_or_return_training_session
+    from benchmarks.bench_state_machine import NullSender, list_reply, text
+
+    # The handlers print every message they get
+    sys.stdout = open(os.devnull, "w")
+    app = create_app(make_config(profile, path))
+    logging.getLogger().setLevel(logging.ERROR)
+    for handler in logging.getLogger().handlers:
+        handler.setLevel(logging.CRITICAL)
+    counter = LockCounter()
+    logging.getLogger().addHandler(counter)
+
+    latencies, errors = [], 0
+    wa_ids = [f"346{worker:03d}{user:05d}" for user in range(USERS_PER_WORKER)]
+    with app.app_context():
+        machine = create_state_machine(NullSender())
+        webhooks = {wa_id: [list_reply(wa_id, "training", "Opciones entrenamiento"), text(wa_id, "finitto")]
+                    for wa_id in wa_ids}
+        deadline = time.monotonic() + duration
+        seq = 0
+        while time.monotonic() < deadline:
+            wa_id = wa_ids[seq % len(wa_ids)]
+            started = time.perf_counter()
+            try:
+                if kind == "webhook":
+                    session = user_sessions.resolve(wa_id, "bench")
+                    UserContext(session, machine).handle_webhook(webhooks[wa_id][seq // len(wa_ids) % 2])
+                    db.session.commit()
+                else:
+                    user = db.session.get(User, user_sessions.resolve(wa_id, "bench").user_id)
+                    training_session = add_or_return_training_session(user)
+                    add_dataframe_to_training_detail(ingest_frame(worker, seq), user, training_session)
+                latencies.append((time.perf_counter() - started) * 1000)
+            except Exception as e:
+                db.session.rollback()
+                errors += 1
+                if "database is locked" not in str(e):
+                    raise
+            seq += 1
+    results.put((kind, latencies, errors + counter.locked))
+
+
+def run(profile: str, args) -> str:
+    from app import create_app, db
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "bench.sqlite")
+        app = create_app(make_config(profile, path))
+        with app.app_context():
+            db.create_all()
+        logging.getLogger().setLevel(logging.ERROR)
+
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        kinds = ["webhook"] * args.webhook_workers + ["ingest"] * args.ingest_workers
+        workers = [context.Process(target=worker_main, args=(kind, number, profile, path, args.duration, results))
+                   for number, kind in enumerate(kinds)]
+        for process in workers:
+            process.start()
+        collected = [results.get(timeout=args.duration + 120) for _ in workers]
+        for process in workers:
+            process.join()
+
+    lines = [f"{profile}:"]
+    for kind in ("webhook", "ingest"):
+        latencies = [value for name, values, _ in collected if name == kind for value in values]
+        errors = sum(count for name, _, count in collected if name == kind)
+        if not latencies:
+            lines.append(f"  {kind:<8} no operation completed, {errors} lock errors")
+            continue
+        lines.append(f"  {kind:<8} {len(latencies) / args.duration:7.1f} ops/s  "
+                     f"p50={statistics.median(latencies):7.1f}  p95={percentile(latencies, 95):7.1f}  "
+                     f"p99={percentile(latencies, 99):7.1f} ms  lock errors={errors}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--webhook-workers", type=int, default=4)
+    parser.add_argument("--ingest-workers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--profiles", nargs="+", default=["default", "performance"])
+    args = parser.parse_args()
+
+    print(f"{args.webhook_workers} webhook and {args.ingest_workers} ingest workers, {args.duration:g} s per profile")
+    for profile in args.profiles:
+        print(run(profile, args))
+
+
+if __name__ == "__main__":
+    main()
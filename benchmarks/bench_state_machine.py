@@ -0,0 +1,97 @@
+'''
+Transitions-per-second benchmark for the state machine runtime.
+
+Drives one user around the menu cycle
+    IdleState -> TrainingManagementState -> AddTrainingState -> IdleState
+through the same path handle_message uses (session cache -> UserContext ->
+state -> transition table -> write-through), on an in-memory SQLite database
+and with outbound messages discarded.
+
+    python -m benchmarks.bench_state_machine --cycles 2000
+'''
+import argparse
+import json
+import time
+
+from pydantic import TypeAdapter
+
+from app import create_app, db
+from app.config import TestingConfig
+from app.models.payload_models import ValidatedWebhookPayload
+from app.state.session_cache import user_sessions
+from app.state.states.states import UserContext, create_state_machine
+from tests.fixtures.payloads import VALID_LIST_REPLY, VALID_TEXT_MESSAGE_PAYLOAD
+
+
+class BenchConfig(TestingConfig):
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+
+
+class NullSender:
+    def send(self, message) -> bool:
+        return True
+
+
+def list_reply(wa_id, row_id, title):
+    payload = json.loads(VALID_LIST_REPLY)
+    value = payload["entry"][0]["changes"][0]["value"]
+    value["contacts"][0]["wa_id"] = wa_id
+    value["messages"][0]["from"] = wa_id
+    value["messages"][0]["interactive"]["list_reply"].update(id=row_id, title=title)
+    return TypeAdapter(ValidatedWebhookPayload).validate_python(payload)
+
+
+def text(wa_id, body):
+    payload = json.loads(VALID_TEXT_MESSAGE_PAYLOAD)
+    value = payload["entry"][0]["changes"][0]["value"]
+    value["contacts"][0]["wa_id"] = wa_id
+    value["messages"][0]["from"] = wa_id
+    value["messages"][0]["text"]["body"] = body
+    return TypeAdapter(ValidatedWebhookPayload).validate_python(payload)
+
+
+def run(machine, wa_id, webhooks, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for webhook in webhooks:
+            session = user_sessions.resolve(wa_id, "bench")
+            UserContext(session, machine).handle_webhook(webhook)
+            db.session.commit()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cycles", type=int, default=2000)
+    args = parser.parse_args()
+
+    app = create_app(BenchConfig)
+    wa_id = "34600000000"
+    machine = create_state_machine(NullSender())
+
+    cycle = [
+        list_reply(wa_id, "training", "Opciones entrenamiento"),
+        list_reply(wa_id, "add_training", "Añade un entrenamiento"),
+        text(wa_id, "finitto"),
+    ]
+    # Interactive reply the Idle handler ignores: dispatch without a transition
+    no_transition = [list_reply(wa_id, "unknown", "Unknown")]
+
+    with app.app_context():
+        db.create_all()
+        user_sessions.resolve(wa_id, "bench")
+        db.session.commit()
+
+        elapsed = run(machine, wa_id, cycle, args.cycles)
+        transitions = args.cycles * len(cycle)
+        print(f"transitions:        {transitions / elapsed:10.0f} /s  ({elapsed / transitions * 1e6:7.1f} us each)")
+
+        elapsed = run(machine, wa_id, no_transition, args.cycles * len(cycle))
+        dispatches = args.cycles * len(cycle)
+        print(f"no-op dispatches:   {dispatches / elapsed:10.0f} /s  ({elapsed / dispatches * 1e6:7.1f} us each)")
+
+        db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""Add ingested documents ledger
+
+Revision ID: 5b2e7c1d9a4f
+Revises: 0cacbed1678f
+Create Date: 2026-10-19 15:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e7c1d9a4f'
+down_revision = '0cacbed1678f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ingested_documents',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('reps_added', sa.Integer(), nullable=False),
+    sa.Column('sets_added', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], name='fk_ingested_documents_user'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'sha256', name='uq_ingested_documents_user_sha256')
+    )
+
+
+def downgrade():
+    op.drop_table('ingested_documents')
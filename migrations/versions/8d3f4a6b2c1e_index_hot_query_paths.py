@@ -0,0 +1,71 @@
+"""Index the hot query paths, unique exercise names
+
+Revision ID: 8d3f4a6b2c1e
+Revises: 5b2e7c1d9a4f
+Create Date: 2026-10-19 16:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3f4a6b2c1e'
+down_revision = '5b2e7c1d9a4f'
+branch_labels = None
+depends_on = None
+
+# Lowest id of each exercise name, the row duplicates are merged into
+KEEPERS = "SELECT MIN(id) FROM exercises GROUP BY name"
+KEEPER_OF = "(SELECT MIN(keeper.id) FROM exercises keeper WHERE keeper.name = (SELECT name FROM exercises WHERE id = {column}))"
+
+
+def merge_duplicate_exercises():
+    ''' Exercises were inserted without a unique name; point everything at one row per name '''
+    op.execute(
+        f"UPDATE training_details SET ejercicio_id = {KEEPER_OF.format(column='training_details.ejercicio_id')} "
+        f"WHERE ejercicio_id NOT IN ({KEEPERS})"
+    )
+    # user_stats is keyed by (user, exercise): keep one row per user and name, the lowest exercise id (the
+    # kept exercise's own row when there is one), so repointing the rest cannot collide
+    op.execute(
+        "DELETE FROM user_stats WHERE EXISTS ("
+        "SELECT 1 FROM user_stats other "
+        "JOIN exercises other_exercise ON other_exercise.id = other.exercise_id "
+        "JOIN exercises this_exercise ON this_exercise.name = other_exercise.name "
+        "WHERE this_exercise.id = user_stats.exercise_id AND other.user_id = user_stats.user_id "
+        "AND other.exercise_id < user_stats.exercise_id)"
+    )
+    op.execute(
+        f"UPDATE user_stats SET exercise_id = {KEEPER_OF.format(column='user_stats.exercise_id')} "
+        f"WHERE exercise_id NOT IN ({KEEPERS})"
+    )
+    op.execute(f"DELETE FROM exercises WHERE id NOT IN ({KEEPERS})")
+
+
+def upgrade():
+    merge_duplicate_exercises()
+
+    with op.batch_alter_table('exercises', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_exercises_name'), ['name'], unique=True)
+
+    with op.batch_alter_table('training_sessions', schema=None) as batch_op:
+        batch_op.create_index('ix_training_sessions_user_id_created_at', ['user_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('training_details', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_training_details_hash_id'), ['hash_id'], unique=False)
+        batch_op.create_index('ix_training_details_atleta_id_session_id', ['atleta_id', 'session_id'], unique=False)
+        batch_op.create_index('ix_training_details_atleta_id_timestamp', ['atleta_id', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('training_details', schema=None) as batch_op:
+        batch_op.drop_index('ix_training_details_atleta_id_timestamp')
+        batch_op.drop_index('ix_training_details_atleta_id_session_id')
+        batch_op.drop_index(batch_op.f('ix_training_details_hash_id'))
+
+    with op.batch_alter_table('training_sessions', schema=None) as batch_op:
+        batch_op.drop_index('ix_training_sessions_user_id_created_at')
+
+    with op.batch_alter_table('exercises', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_exercises_name'))
@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+import hmac
+import json
+
+import pytest
+import sqlalchemy as sa
+from app.aio import AsyncWebhookApp
+from app.models.models import IngestedDocument
+from app.state.session_cache import user_sessions
+from tools.traffic import adr_document, build_webhook
+
+APP_SECRET = "test-secret"
+
+
+class FakeGraphClient:
+    def __init__(self):
+        self.sent = []
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def send_message(self, payload):
+        await asyncio.sleep(0.001)
+        self.sent.append(json.loads(payload) if isinstance(payload, bytes) else payload)
+        return {"messages": [{"id": f"wamid.{len(self.sent)}"}]}
+
+
+def sign(body: str) -> bytes:
+    digest = hmac.new(APP_SECRET.encode("latin-1"), body.encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"sha256={digest}".encode()
+
+
+async def call(asgi_app, method, body="", query_string=b"", signature=b""):
+    messages = [{"type": "http.request", "body": body.encode(), "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "method": method, "path": "/webhook", "query_string": query_string,
+        "headers": [(b"x-hub-signature-256", signature)],
+    }
+    await asgi_app(scope, receive, send)
+    return sent[0]["status"], sent[1]["body"]
+
+
+@pytest.fixture
+def asgi_app(app, monkeypatch):
+    monkeypatch.setitem(app.config, "APP_SECRET", APP_SECRET)
+    monkeypatch.setitem(app.config, "VERIFY_TOKEN", "verify-me")
+    monkeypatch.setitem(app.extensions, "state_machine", app.extensions["state_machine"])
+    user_sessions.clear()
+    return AsyncWebhookApp(app, graph_client=FakeGraphClient())
+
+
+def test_text_message_is_acknowledged_and_answered(db, asgi_app, valid_text_message_payload):
+    async def scenario():
+        status, body = await call(asgi_app, "POST", valid_text_message_payload, signature=sign(valid_text_message_payload))
+        await asgi_app.drain()
+        return status, body
+
+    status, body = asyncio.run(scenario())
+
+    assert status == 200
+    assert json.loads(body) == {"status": "ok"}
+    sent = asgi_app.graph_client.sent
+    assert [payload["to"] for payload in sent] == ["15551234567", "15551234567"]
+    assert sent[0]["type"] == "text"
+    assert sent[1]["type"] == "interactive"
+
+
+def test_invalid_signature_is_rejected(db, asgi_app, valid_text_message_payload):
+    status, _ = asyncio.run(call(asgi_app, "POST", valid_text_message_payload, signature=b"sha256=bad"))
+
+    assert status == 403
+    assert asgi_app.graph_client.sent == []
+
+
+def test_verification_challenge(asgi_app):
+    query = b"hub.mode=subscribe&hub.verify_token=verify-me&hub.challenge=1234"
+
+    status, body = asyncio.run(call(asgi_app, "GET", query_string=query))
+
+    assert status == 200
+    assert body == b"1234"
+
+
+class SlowMediaGraphClient(FakeGraphClient):
+    ''' Serves each media id its encoder export, after `latency` seconds '''
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+
+    async def get_media_url(self, media_id):
+        return f"https://media.example/{media_id}"
+
+    async def iter_media(self, media_url, chunk_size=64 * 1024, timeout=None):
+        await asyncio.sleep(self.latency)
+        yield adr_document(media_url.rsplit("/", 1)[1])
+
+
+def test_document_downloading_is_handled_before_the_next_message(db, app, monkeypatch):
+    monkeypatch.setitem(app.config, "APP_SECRET", APP_SECRET)
+    monkeypatch.setitem(app.extensions, "state_machine", app.extensions["state_machine"])
+    user_sessions.clear()
+    asgi_app = AsyncWebhookApp(app, graph_client=SlowMediaGraphClient(latency=0.2))
+    wa_id = "34600000091"
+    user_sessions.write_state(user_sessions.resolve(wa_id, "Lucia"), "AddTrainingState")
+    db.session.commit()
+    document = json.dumps(build_webhook("document", "adrencoder.csv", wa_id, 1))
+    finish = json.dumps(build_webhook("text", "finitto", wa_id, 2))
+
+    async def scenario():
+        await call(asgi_app, "POST", document, signature=sign(document))
+        await call(asgi_app, "POST", finish, signature=sign(finish))
+        await asgi_app.drain()
+
+    asyncio.run(scenario())
+
+    assert db.session.scalar(sa.select(sa.func.count()).select_from(IngestedDocument)) == 1
+    assert user_sessions.resolve(wa_id).state == "IdleState"
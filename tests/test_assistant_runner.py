@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from app.services.assistant_runner import AssistantRunError, AssistantRunner
+from app.services.thread_store import ThreadStore
+from tools.openai_stub import OpenAIStub
+
+
+def make_runner(tmp_path, client, **kwargs):
+    return AssistantRunner(client, "asst_stub", ThreadStore(str(tmp_path / "threads.sqlite")), **kwargs)
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_answer_is_returned_and_assistant_retrieved_once(tmp_path, stream):
+    client = OpenAIStub(run_latency=0.05)
+    runner = make_runner(tmp_path, client, stream=stream)
+
+    assert runner.generate_response("¿Qué es el RIR?", "34600000001", "Ana") == "Respuesta a: ¿Qué es el RIR?"
+    assert runner.generate_response("¿Y el RPE?", "34600000001", "Ana") == "Respuesta a: ¿Y el RPE?"
+    assert client.calls["assistants.retrieve"] == 1
+    assert client.calls["threads.create"] == 1
+
+
+def test_streaming_makes_no_status_requests(tmp_path):
+    client = OpenAIStub(run_latency=0.3)
+    make_runner(tmp_path, client, stream=True).generate_response("Hola", "34600000001", "Ana")
+
+    assert client.calls["runs.retrieve"] == 0
+    assert client.calls["messages.list"] == 0
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_failed_run_raises(tmp_path, stream):
+    runner = make_runner(tmp_path, OpenAIStub(run_latency=0.01, status="failed"), stream=stream)
+
+    with pytest.raises(AssistantRunError) as error:
+        runner.generate_response("Hola", "34600000001", "Ana")
+    assert error.value.status == "failed"
+
+
+@pytest.mark.parametrize("stream", [True, False])
+def test_run_past_the_timeout_is_cancelled(tmp_path, stream):
+    # Events keep arriving well within the client's per-read timeout: only the run's deadline stops it
+    client = OpenAIStub(run_latency=5.0, event_interval=0.02)
+    runner = make_runner(tmp_path, client, stream=stream, timeout=0.2)
+
+    started = time.monotonic()
+    with pytest.raises(AssistantRunError) as error:
+        runner.generate_response("Hola", "34600000001", "Ana")
+    assert error.value.status == "timeout"
+    assert time.monotonic() - started < 1.0
+    assert client.calls["runs.cancel"] == 1
+    assert all(run.cancelled for run in client.runs.values())
+
+
+def test_submit_delivers_the_reply_off_the_caller_thread(tmp_path):
+    runner = make_runner(tmp_path, OpenAIStub(run_latency=0.05))
+    delivered = []
+    done = threading.Event()
+
+    def on_reply(text):
+        delivered.append((text, threading.current_thread() is not threading.main_thread()))
+        done.set()
+
+    future = runner.submit("Hola", "34600000001", "Ana", on_reply=on_reply)
+    assert future.result(timeout=5) == "Respuesta a: Hola"
+    assert done.wait(timeout=5)
+    runner.close()
+
+    assert delivered == [("Respuesta a: Hola", True)]
+
+
+def test_user_locks_are_dropped_once_free(tmp_path):
+    runner = make_runner(tmp_path, OpenAIStub(run_latency=0.01))
+    futures = [runner.submit("Hola", f"3460000{user:04d}", "Ana") for user in range(20)]
+    for future in futures:
+        future.result(timeout=5)
+    runner.close()
+
+    assert runner._turns == {}
+
+
+def test_submit_reports_a_failed_run(tmp_path):
+    runner = make_runner(tmp_path, OpenAIStub(run_latency=0.01, status="failed"))
+    errors = []
+    done = threading.Event()
+
+    def on_error(error):
+        errors.append(error)
+        done.set()
+
+    runner.submit("Hola", "34600000001", "Ana", on_reply=lambda text: None, on_error=on_error)
+    assert done.wait(timeout=5)
+    runner.close()
+
+    assert [error.status for error in errors] == ["failed"]
@@ -0,0 +1,115 @@
+import time
+
+import pytest
+import requests
+from app.core.messaging.circuit_breaker import CircuitBreaker
+from app.core.messaging.dispatcher import OutboundDispatcher
+from app.core.messaging.graph_http import CircuitOpenError, GraphSession
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def breaker(clock, **kwargs):
+    options = dict(window=10, buckets=10, min_calls=4, failure_rate=0.5, slow_call_seconds=1.0,
+                   slow_call_rate=0.5, open_seconds=5, half_open_probes=2, clock=clock)
+    options.update(kwargs)
+    return CircuitBreaker(**options)
+
+
+def test_opens_on_failure_rate_and_probes_back(clock):
+    circuit = breaker(clock)
+    for success in (True, False, True, False):
+        assert circuit.allow()
+        circuit.record(success, 0.1)
+
+    assert circuit.state == CircuitBreaker.OPEN
+    assert not circuit.allow()
+    assert circuit.blocked_for() == 5
+
+    clock.now += 5
+    assert circuit.state == CircuitBreaker.HALF_OPEN
+    assert circuit.allow() and circuit.allow()
+    assert not circuit.allow()  # Only two probes
+    circuit.record(True, 0.1)
+    circuit.record(True, 0.1)
+    assert circuit.state == CircuitBreaker.CLOSED
+
+
+def test_failed_probe_opens_again(clock):
+    circuit = breaker(clock)
+    for _ in range(4):
+        circuit.record(False, 0.1)
+    clock.now += 5
+
+    assert circuit.allow()
+    circuit.record(False, 0.1)
+    assert circuit.state == CircuitBreaker.OPEN
+
+
+def test_opens_on_slow_calls(clock):
+    circuit = breaker(clock)
+    for duration in (0.1, 2.0, 3.0, 0.1):
+        circuit.record(True, duration)
+
+    assert circuit.state == CircuitBreaker.OPEN
+
+
+def test_old_outcomes_leave_the_window(clock):
+    circuit = breaker(clock)
+    for _ in range(3):
+        circuit.record(False, 0.1)
+    clock.now += 11
+    circuit.record(False, 0.1)
+
+    assert circuit.state == CircuitBreaker.CLOSED
+    assert circuit.stats()["calls"] == 1
+
+
+def test_session_fails_fast_while_open(clock):
+    circuit = breaker(clock)
+    for _ in range(4):
+        circuit.record(False, 0.1)
+    session = GraphSession(breaker=circuit)
+
+    started = time.monotonic()
+    with pytest.raises(requests.RequestException) as error:
+        session.get("http://10.255.255.1/v18.0/media")  # Never reached
+
+    assert isinstance(error.value, CircuitOpenError)
+    assert time.monotonic() - started < 0.1
+
+
+def test_dispatcher_holds_replies_while_open():
+    circuit = breaker(time.monotonic, min_calls=1, open_seconds=0.2, half_open_probes=1)
+    circuit.record(False, 0.1)
+    sent = []
+
+    class Response:
+        status_code = 200
+        headers = {}
+
+    def transmit(payload):
+        sent.append(time.monotonic())
+        return Response()
+
+    dispatcher = OutboundDispatcher(transmit, rate=1000, workers=2, max_retries=0, breaker=circuit)
+    started = time.monotonic()
+    dispatcher.submit({"to": "34600000001", "type": "text"})
+
+    assert dispatcher.drain(timeout=5)
+    dispatcher.close()
+
+    # Not dropped although max_retries=0: it waited for the circuit instead
+    assert len(sent) == 1 and sent[0] - started >= 0.15
+    assert dispatcher.stats()["deferred"] >= 1
@@ -0,0 +1,112 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pydantic import TypeAdapter
+
+from app import db as _db
+from app.core.messaging.commands import command_router
+from app.core.training.analytics import training_analytics
+from app.models.models import Exercise, TrainingDetail, TrainingSession
+from app.models.payload_models import ValidatedWebhookPayload
+from app.state.session_cache import user_sessions
+from app.state.states.states import UserContext, create_state_machine
+
+
+class RecordingSender:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+        return True
+
+    def texts(self):
+        return [message.text.body for message in self.sent if getattr(message, "type", None) == "text"]
+
+
+def text_webhook(payload, body):
+    payload = json.loads(payload)
+    payload["entry"][0]["changes"][0]["value"]["messages"][0]["text"]["body"] = body
+    return TypeAdapter(ValidatedWebhookPayload).validate_python(payload)
+
+
+def add_sets(user_id, exercise_name, sets):
+    ''' sets: (kg, [vmp of each rep]) '''
+    exercise = Exercise(name=exercise_name)
+    session = TrainingSession(user_id=user_id)
+    _db.session.add_all([exercise, session])
+    _db.session.flush()
+    started = datetime.now(timezone.utc) - timedelta(hours=1)
+    for serie, (kg, velocities) in enumerate(sets, start=1):
+        for rep, vmp in enumerate(velocities, start=1):
+            _db.session.add(TrainingDetail(
+                session_id=session.id, timestamp=started + timedelta(minutes=serie, seconds=rep), serie=serie,
+                rep=rep, kg=kg, vmp=vmp, rm=int(kg * 1.5), ejercicio_id=exercise.id, atleta_id=user_id,
+            ))
+    _db.session.commit()
+
+
+@pytest.mark.parametrize("text, name, args, values", [
+    ("Finitto", "finish", (), {}),
+    ("vale, finitto!", "finish", (), {}),
+    ("Hola", "menu", (), {}),
+    ("¡Resumen!", "summary", (), {}),
+    ("RM Sentadilla profunda", "one_rm", ("sentadilla", "profunda"), {}),
+    ("mi rm en press de banca", "one_rm", ("press", "de", "banca"), {}),
+    ("100kg 0.6 m/s", "load_velocity", (), {"kg": "100", "velocity": "0.6"}),
+    ("100 kg a 0,55 m/s sentadilla", "load_velocity", ("sentadilla",), {"kg": "100", "velocity": "0.55"}),
+])
+def test_commands_are_recognised(text, name, args, values):
+    command = command_router.route(text)
+    assert (command.name, command.args, command.values) == (name, args, values)
+
+
+@pytest.mark.parametrize("text", ["hola, ¿qué es la pérdida de velocidad?", "el fin de semana entreno", "¿Cómo exporto?"])
+def test_free_text_is_not_a_command(text):
+    assert command_router.route(text) is None
+
+
+@pytest.fixture
+def athlete(db):
+    user_sessions.clear()
+    training_analytics.clear()
+    session = user_sessions.resolve("15551234567", "Alice")
+    add_sets(session.user_id, "Sentadilla profunda", [(60, [0.92, 0.90]), (80, [0.71, 0.69]), (100, [0.51, 0.50])])
+    return session
+
+
+def test_one_rm_and_summary_come_from_the_load_velocity_profile(athlete):
+    analytics = training_analytics.for_user(athlete.user_id)
+    profile = analytics.find_profile(["sentadilla"])
+
+    # kg = 149.6 - 97.5 * vmp through the three sets, 1RM at 0.3 m/s
+    assert profile.one_rm == pytest.approx(120.3, abs=0.1)
+    assert analytics.last_session_exercises[0].reps == 6
+    assert training_analytics.for_user(athlete.user_id) is analytics
+
+
+def test_commands_are_answered_without_leaving_the_state(athlete, valid_text_message_payload):
+    sender = RecordingSender()
+    machine = create_state_machine(sender)
+    context = UserContext(athlete, machine)
+
+    context.handle_webhook(text_webhook(valid_text_message_payload, "rm sentadilla"))
+    context.handle_webhook(text_webhook(valid_text_message_payload, "100kg 0.6 m/s"))
+    context.handle_webhook(text_webhook(valid_text_message_payload, "resumen"))
+
+    rm_text, load_velocity_text, summary = sender.texts()
+    assert "RM estimado 120 kg" in rm_text
+    assert "77% de un RM estimado de 129 kg" in load_velocity_text
+    assert "3 series, 6 repeticiones" in summary
+    assert context.state is machine.get_state("IdleState")
+
+
+def test_finitto_ends_adding_training(athlete, valid_text_message_payload):
+    machine = create_state_machine(RecordingSender())
+    context = UserContext(athlete, machine)
+    context.transition_to(machine.get_state("AddTrainingState"))
+
+    context.handle_webhook(text_webhook(valid_text_message_payload, "Ya está, finitto"))
+
+    assert context.state is machine.get_state("IdleState")
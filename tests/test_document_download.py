@@ -0,0 +1,96 @@
+import base64
+import hashlib
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.utils.document_utils import DocumentDownloadError, VerifiedDownload, download_media
+
+CONTENT = b"Set,Rep,KG,Mean Velocity\n" + b"1,1,80,0.61\n" * 400_000  # ~4.8 MB
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(len(CONTENT)))
+        self.end_headers()
+        view = memoryview(CONTENT)
+        for start in range(0, len(CONTENT), 256 * 1024):
+            self.wfile.write(view[start:start + 256 * 1024])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def media_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MediaHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/media/1"
+    server.shutdown()
+    server.server_close()
+
+
+def test_checksum_is_verified_before_the_content_is_handed_over():
+    digest = hashlib.sha256(b"a,b\n").digest()
+
+    for sha256 in (digest.hex(), base64.b64encode(digest).decode()):
+        with VerifiedDownload(sha256, max_bytes=100) as download:
+            download.write(b"a,b\n")
+            with download.commit() as content:
+                assert content.read() == b"a,b\n"
+
+    with pytest.raises(DocumentDownloadError):
+        with VerifiedDownload(digest.hex(), max_bytes=100) as download:
+            download.write(b"a,c\n")
+            download.commit()
+    with pytest.raises(DocumentDownloadError):
+        with VerifiedDownload(None, max_bytes=5) as download:
+            download.write(b"a,b\n1,2\n")
+
+
+def test_download_streams_with_flat_memory(app, media_url, monkeypatch, tmp_path):
+    sha256 = hashlib.sha256(CONTENT).hexdigest()
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    with app.app_context():
+        app.config["DOCUMENT_SPILL_BYTES"] = 64 * 1024
+        tracemalloc.start()
+        content = download_media(media_url, sha256)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        with content:
+            assert content.read() == CONTENT
+            assert len(list(tmp_path.iterdir())) == 0  # spilled to an unlinked temporary file
+
+        assert download_media(media_url, "0" * 64) is None
+        app.config["DOCUMENT_MAX_BYTES"] = len(CONTENT) - 1
+        try:
+            assert download_media(media_url, sha256) is None
+        finally:
+            app.config["DOCUMENT_MAX_BYTES"] = 16 * 1024 * 1024
+            app.config["DOCUMENT_SPILL_BYTES"] = 4 * 1024 * 1024
+
+    # Spill threshold, its copy at rollover and the socket buffers; not the file size
+    assert peak < 512 * 1024
+
+
+def test_small_documents_stay_in_memory(app, media_url, monkeypatch):
+    opened = []
+    monkeypatch.setattr(tempfile, "TemporaryFile", lambda *args, **kwargs: opened.append(args))
+
+    with app.app_context():
+        app.config["DOCUMENT_SPILL_BYTES"] = len(CONTENT)
+        try:
+            content = download_media(media_url, hashlib.sha256(CONTENT).hexdigest())
+        finally:
+            app.config["DOCUMENT_SPILL_BYTES"] = 4 * 1024 * 1024
+
+    assert content.read(4) == b"Set," and opened == []
@@ -0,0 +1,63 @@
+import io
+
+import sqlalchemy as sa
+from pydantic import TypeAdapter
+
+from app.models.models import IngestedDocument
+from app.models.payload_models import ValidatedWebhookPayload
+from app.state.session_cache import user_sessions
+from app.state.states.states import UserContext, create_state_machine
+from app.utils import document_utils
+from app.utils.document_utils import sha256_key
+from tools.traffic import adr_document, build_webhook
+
+
+class RecordingSender:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+        return True
+
+
+def document_webhook(wa_id, seq):
+    payload = build_webhook("document", "adrencoder.csv", wa_id, seq)
+    return TypeAdapter(ValidatedWebhookPayload).validate_python(payload)
+
+
+def test_sha256_key_accepts_hex_and_base64():
+    digest = bytes(range(32))
+    assert sha256_key(digest.hex().upper()) == digest.hex()
+    assert sha256_key("AAECAwQFBgcICQoLDA0ODxAREhMUFRYXGBkaGxwdHh8=") == digest.hex()
+    assert len(sha256_key("fake_sha256_hash_value")) == 64
+
+
+def test_document_sent_again_is_answered_from_the_ledger(db, monkeypatch):
+    user_sessions.clear()
+    sender = RecordingSender()
+    machine = create_state_machine(sender)
+    session = user_sessions.resolve("34600000077", "Lucia")
+    session = user_sessions.write_state(session, "AddTrainingState")
+    webhook = document_webhook("34600000077", 1)
+    document = webhook.get_document_of_document_message()
+    content = io.BytesIO(adr_document(document.id))
+
+    UserContext(session, machine, document=content).handle_webhook(webhook)
+
+    entry = db.session.scalar(sa.select(IngestedDocument))
+    assert entry.sha256 == sha256_key(document.sha256) and entry.reps_added > 0
+    assert content.closed
+    assert [message.template.name for message in sender.sent] == ["document_processed", "send_more_documents"]
+
+    def no_download(*args):
+        raise AssertionError("a known document must not be downloaded")
+
+    monkeypatch.setattr(document_utils, "get_media_url", no_download)
+    monkeypatch.setattr(document_utils, "process_incoming_training_data", no_download)
+    sender.sent.clear()
+
+    UserContext(session, machine).handle_webhook(webhook)
+
+    assert f"{entry.reps_added} repeticiones" in sender.sent[0].text.body
+    assert db.session.scalar(sa.select(sa.func.count()).select_from(IngestedDocument)) == 1
@@ -0,0 +1,40 @@
+import importlib.util
+from pathlib import Path
+
+import sqlalchemy as sa
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+MIGRATION = Path(__file__).parent.parent / "migrations" / "versions" / "8d3f4a6b2c1e_index_hot_query_paths.py"
+
+
+def load_migration():
+    spec = importlib.util.spec_from_file_location("index_hot_query_paths", MIGRATION)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_duplicates_are_merged_without_user_stats_collisions():
+    migration = load_migration()
+    engine = sa.create_engine("sqlite://")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE exercises (id INTEGER PRIMARY KEY, name TEXT)")
+        connection.exec_driver_sql("CREATE TABLE training_details (id INTEGER PRIMARY KEY, ejercicio_id INTEGER)")
+        connection.exec_driver_sql(
+            "CREATE TABLE user_stats (user_id INTEGER, exercise_id INTEGER, ecuacion TEXT, "
+            "PRIMARY KEY (user_id, exercise_id))")
+        connection.exec_driver_sql("INSERT INTO exercises VALUES (1, 'X'), (2, 'X'), (3, 'X'), (4, 'Y')")
+        connection.exec_driver_sql("INSERT INTO training_details VALUES (1, 2), (2, 3), (3, 4)")
+        # User 7 only has stats of the two duplicates, user 8 of the kept exercise and a duplicate
+        connection.exec_driver_sql(
+            "INSERT INTO user_stats VALUES (7, 2, 'a'), (7, 3, 'b'), (8, 1, 'c'), (8, 3, 'd'), (9, 4, 'e')")
+
+        migration.op = Operations(MigrationContext.configure(connection))
+        migration.merge_duplicate_exercises()
+
+        assert connection.exec_driver_sql("SELECT id, name FROM exercises ORDER BY id").all() == [(1, "X"), (4, "Y")]
+        assert connection.exec_driver_sql(
+            "SELECT ejercicio_id FROM training_details ORDER BY id").scalars().all() == [1, 1, 4]
+        assert connection.exec_driver_sql("SELECT * FROM user_stats ORDER BY user_id").all() == [
+            (7, 1, "a"), (8, 1, "c"), (9, 4, "e")]
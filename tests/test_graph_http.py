@@ -0,0 +1,56 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from app.core.messaging.graph_http import GraphSession
+
+
+class UnavailableHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _unavailable(self):
+        self.server.hits.append((self.command, self.client_address[1]))
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_GET = _unavailable
+    do_POST = _unavailable
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), UnavailableHandler)
+    server.hits = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_get_is_retried_post_is_not(server):
+    session = GraphSession(retries=2, backoff_factor=0)
+    url = f"http://127.0.0.1:{server.server_port}/v18.0/media"
+
+    assert session.get(url).status_code == 503
+    assert [method for method, _ in server.hits] == ["GET"] * 3
+
+    server.hits.clear()
+    assert session.post(url, json={"to": "34600000001"}).status_code == 503
+    assert [method for method, _ in server.hits] == ["POST"]
+
+
+def test_connection_is_kept_alive(server):
+    session = GraphSession(retries=0)
+    url = f"http://127.0.0.1:{server.server_port}/v18.0/messages"
+
+    for _ in range(3):
+        session.post(url, json={})
+
+    assert len({port for _, port in server.hits}) == 1
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+import sqlalchemy as sa
+
+from app.utils.group_commit import GroupCommitWriter
+
+metadata = sa.MetaData()
+counters = sa.Table("counters", metadata, sa.Column("id", sa.Integer, primary_key=True),
+                    sa.Column("value", sa.Integer, nullable=False))
+
+
+@pytest.fixture
+def writer(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'writes.db'}")
+    metadata.create_all(engine)
+    writer = GroupCommitWriter(window=0.01)
+    writer.configure(engine)
+    yield writer
+    writer.close()
+    engine.dispose()
+
+
+def test_concurrent_writes_share_commits_and_are_acknowledged(writer):
+    results = []
+
+    def insert(value):
+        results.append(writer.execute(sa.insert(counters).values(value=value)))
+
+    threads = [threading.Thread(target=insert, args=(value,)) for value in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(result.inserted_primary_key[0] for result in results) == list(range(1, 41))
+    with writer.engine.connect() as connection:
+        assert connection.execute(sa.select(sa.func.count()).select_from(counters)).scalar() == 40
+    assert writer.stats()["batches"] < 40
+
+
+def test_a_failing_write_only_fails_its_caller(writer):
+    writer.execute(sa.insert(counters).values(id=1, value=1))
+    duplicate = writer.submit(lambda connection: connection.execute(sa.insert(counters).values(id=1, value=2)))
+    update = writer.submit(lambda connection: connection.execute(
+        sa.update(counters).where(counters.c.id == 1).values(value=3)).rowcount)
+
+    with pytest.raises(sa.exc.IntegrityError):
+        duplicate.result(timeout=5)
+    assert update.result(timeout=5) == 1
+    with writer.engine.connect() as connection:
+        assert connection.execute(sa.select(counters.c.value)).scalar() == 3
+
+
+def test_unreachable_database_fails_the_writes_and_the_writer_recovers(tmp_path):
+    writer = GroupCommitWriter(timeout=5)
+    writer.configure(sa.create_engine(f"sqlite:///{tmp_path / 'missing' / 'writes.db'}"))
+
+    for _ in range(2):
+        with pytest.raises(sa.exc.OperationalError):
+            writer.execute(sa.insert(counters).values(value=1))
+
+    (tmp_path / "missing").mkdir()
+    metadata.create_all(writer.engine)
+    assert writer.execute(sa.insert(counters).values(value=1)).rowcount == 1
+    writer.close()
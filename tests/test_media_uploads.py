@@ -0,0 +1,94 @@
+import socket
+import threading
+import time
+
+from app.core.messaging.media import MediaUploader
+from app.core.messaging.message_sender import ReplyBatch, WhatsappAPIClient
+from tools.graph_stub import GraphStub, StubThread
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakeMediaEndpoint:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def upload(self, data, mime_type, filename):
+        time.sleep(self.latency)
+        with self.lock:
+            self.calls.append((filename, mime_type))
+            return FakeResponse(200, {"id": f"media.{len(self.calls)}"})
+
+
+class FakeSender:
+    def __init__(self):
+        self.sent = []
+
+    def send_batch(self, messages):
+        self.sent.extend(messages)
+        return True
+
+
+def test_identical_bytes_reuse_the_media_id_until_it_expires():
+    now = [1000.0]
+    endpoint = FakeMediaEndpoint()
+    uploader = MediaUploader(endpoint.upload, ttl=60, clock=lambda: now[0])
+
+    first = uploader.upload(b"informe", "application/pdf", "informe.pdf")
+    assert uploader.upload(b"informe", "application/pdf", "copia.pdf") == first
+    assert uploader.upload(b"informe", "text/plain", "informe.txt") != first
+    assert len(endpoint.calls) == 2
+
+    now[0] += 61
+    assert uploader.get(b"informe", "application/pdf") is None
+    assert uploader.upload(b"informe", "application/pdf", "informe.pdf") != first
+    assert len(endpoint.calls) == 3
+
+    uploader.forget("media.3")
+    assert uploader.get(b"informe", "application/pdf") is None
+
+
+def test_upload_runs_while_the_reply_is_composed():
+    endpoint = FakeMediaEndpoint(latency=0.2)
+    uploader = MediaUploader(endpoint.upload)
+    sender = FakeSender()
+
+    started = time.monotonic()
+    upload = uploader.start(b"chart", "image/png", "chart.png")
+    same = uploader.start(b"chart", "image/png", "chart.png")
+    time.sleep(0.15)  # composing the text
+    with ReplyBatch(sender, "34600000001") as reply:
+        reply.text("Tu progreso")
+        reply.media(upload, "image")
+    elapsed = time.monotonic() - started
+
+    assert elapsed < 0.3
+    assert same is upload and len(endpoint.calls) == 1
+    assert sender.sent[1].media_id == "media.1"
+    assert sender.sent[1].encode() == (
+        b'{"messaging_product":"whatsapp","recipient_type":"individual","to":"34600000001",'
+        b'"type":"image","image":{"id":"media.1"}}'
+    )
+
+
+def test_upload_media_against_graph_stub():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    stub = GraphStub(port=port)
+    with StubThread(stub):
+        client = WhatsappAPIClient("token", "v18.0", "123", graph_url=stub.url)
+        uploader = MediaUploader(client.upload_media)
+        media_id = uploader.upload(b"a,b\n1,2\n", "text/csv", "adr.csv")
+        assert uploader.upload(b"a,b\n1,2\n", "text/csv", "adr.csv") == media_id
+
+    assert stub.uploads == [(media_id, "adr.csv", 8)]
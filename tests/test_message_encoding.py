@@ -0,0 +1,52 @@
+import dataclasses
+import json
+
+import pytest
+from app.core.messaging.sendMessage_types import (
+    ActionObject, FooterObject, InteractiveBodyObject, InteractiveMessage, InteractiveObject,
+    MediaMessage, Row, SectionObject, TextHeader, payload_message, text_message,
+)
+from app.models.payload_send_models import parse_send_payload
+
+
+def list_message(to):
+    return InteractiveMessage(
+        to=to, status="", type="", messaging_product="whatsapp",
+        interactive=InteractiveObject(
+            type="list",
+            action=ActionObject(sections=[
+                SectionObject(title="Entrenamiento", rows=[
+                    Row(id="add_training", title="Añade un entrenamiento", description="csv del encoder"),
+                    Row(id="estimate_rm", title="Estima tu RM"),
+                ]),
+                SectionObject(),
+            ]),
+            header=TextHeader(type="text", sub_text=None, text="Entrenamiento"),
+            body=InteractiveBodyObject(text="Elige una opción"),
+            footer=FooterObject(text="Responde finitto"),
+        ),
+    )
+
+
+@pytest.mark.parametrize("message", [
+    text_message("34600000001", 'Dijo "hola"\ny se fue ñ'),
+    text_message("34600000001", "https://example.com", preview_url=True),
+    list_message("34600000001"),
+    MediaMessage(to="34600000001", status="", type="", messaging_product="whatsapp",
+                 media_id="media.1", media_type="document", filename="adr.csv"),
+    payload_message("34600000001", {"type": "interactive", "interactive": {"type": "list"}}),
+])
+def test_encode_matches_to_dict(message):
+    assert json.loads(message.encode()) == message.to_dict()
+
+
+def test_encoded_text_is_a_valid_send_payload():
+    payload = parse_send_payload(text_message("34600000001", "Hola").encode().decode())
+    assert payload.text.body == "Hola"
+
+
+def test_messages_are_frozen_and_slotted():
+    message = text_message("34600000001", "Hola")
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        message.to = "34600000002"
+    assert not hasattr(message, "__dict__")
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+from pydantic import ValidationError
+from app.core.messaging.templates import TemplateRegistry, message_templates
+from app.models.payload_send_models import parse_send_payload
+
+
+def test_static_templates_are_valid_send_payloads():
+    for name in ("main_menu", "training_menu", "send_csv"):
+        body = message_templates[name].body("34600000001")
+        payload = parse_send_payload(body.decode())
+
+        assert payload is not None
+        assert payload.to == "34600000001"
+
+
+def test_menu_rows_match_the_handlers():
+    rows = [
+        (row["id"], row["title"])
+        for name in ("main_menu", "training_menu")
+        for section in message_templates[name].payload("")["interactive"]["action"]["sections"]
+        for row in section["rows"]
+    ]
+
+    assert ("training", "Opciones entrenamiento") in rows
+    assert ("add_training", "Añade un entrenamiento") in rows
+
+
+def test_body_splices_recipient_into_cached_bytes():
+    template = message_templates["send_csv"]
+    message = template.message('34600000001"')
+
+    assert json.loads(message.encode()) == message.to_dict()
+    assert message.to_dict()["to"] == '34600000001"'
+    assert message.to_dict()["text"]["body"].startswith("Manda tus datos en csv")
+
+
+def test_invalid_template_fails_at_registration():
+    registry = TemplateRegistry()
+    with pytest.raises(ValidationError):
+        registry.register("broken", {"messaging_product": "whatsapp", "type": "interactive", "to": ""})
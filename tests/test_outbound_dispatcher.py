@@ -0,0 +1,163 @@
+import threading
+import time
+
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from app.core.messaging.dispatcher import OutboundDispatcher, TokenBucket
+from app.core.messaging.message_sender import ReplyBatch
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class FakeGraph:
+    ''' Records what was sent; `answers` maps a message body to the statuses it gets in turn '''
+
+    def __init__(self, answers=None, latency=0.0):
+        self.answers = answers or {}
+        self.latency = latency
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def transmit(self, payload):
+        time.sleep(self.latency)
+        body = payload["text"]["body"]
+        with self.lock:
+            statuses = self.answers.get(body)
+            status = statuses.pop(0) if statuses else 200
+            if status == 200:
+                self.sent.append((payload["to"], body))
+        return FakeResponse(status)
+
+
+def message(to, body):
+    return {"messaging_product": "whatsapp", "to": to, "type": "text", "text": {"body": body}}
+
+
+def test_order_per_recipient_survives_retries():
+    graph = FakeGraph(answers={"a1": [429, 503]}, latency=0.001)
+    dispatcher = OutboundDispatcher(graph.transmit, rate=1000, workers=4, backoff_base=0.01)
+    for n in range(5):
+        dispatcher.submit(message("a", f"a{n}"))
+        dispatcher.submit(message("b", f"b{n}"))
+
+    assert dispatcher.drain(timeout=5)
+    dispatcher.close()
+
+    assert [body for to, body in graph.sent if to == "a"] == [f"a{n}" for n in range(5)]
+    assert [body for to, body in graph.sent if to == "b"] == [f"b{n}" for n in range(5)]
+    assert dispatcher.stats()["retried"] == 2
+    assert dispatcher.stats()["sent"] == 10
+
+
+def test_client_errors_are_not_retried():
+    graph = FakeGraph(answers={"bad": [400]})
+    dispatcher = OutboundDispatcher(graph.transmit, rate=1000, workers=2, backoff_base=0.01)
+    dispatcher.submit(message("a", "bad"))
+    dispatcher.submit(message("a", "good"))
+
+    assert dispatcher.drain(timeout=5)
+    dispatcher.close()
+
+    assert graph.sent == [("a", "good")]
+    assert dispatcher.stats()["failed"] == 1
+
+
+def test_sends_that_may_have_delivered_are_not_retried():
+    attempts = []
+
+    def transmit(payload):
+        body = payload["text"]["body"]
+        attempts.append(body)
+        if body == "refused" and attempts.count(body) == 1:
+            cause = NewConnectionError(None, "Connection refused")
+            raise requests.ConnectionError(MaxRetryError(None, "/messages", cause))
+        if body == "timeout":
+            raise requests.ReadTimeout("read timed out")
+        return FakeResponse(500 if body == "error" else 200)
+
+    dispatcher = OutboundDispatcher(transmit, rate=1000, workers=2, backoff_base=0.01)
+    for body in ("refused", "timeout", "error"):
+        dispatcher.submit(message("a", body))
+
+    assert dispatcher.drain(timeout=5)
+    dispatcher.close()
+
+    assert attempts == ["refused", "refused", "timeout", "error"]
+    assert dispatcher.stats()["sent"] == 1 and dispatcher.stats()["failed"] == 2
+
+
+def test_rate_limit_is_global():
+    graph = FakeGraph()
+    dispatcher = OutboundDispatcher(graph.transmit, rate=100, burst=1, workers=8)
+    started = time.monotonic()
+    for n in range(21):
+        dispatcher.submit(message(f"user-{n}", "hola"))
+
+    assert dispatcher.drain(timeout=5)
+    dispatcher.close()
+
+    assert time.monotonic() - started >= 0.18
+    assert len(graph.sent) == 21
+
+
+def test_token_bucket_allows_bursts():
+    bucket = TokenBucket(rate=1, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() > 0.9
+
+
+def test_reply_batch_parts_start_after_the_previous_one_is_answered():
+    graph = FakeGraph(latency=0.02)
+    events = []
+    transmit = graph.transmit
+
+    def recording_transmit(payload):
+        events.append(("start", payload["text"]["body"]))
+        response = transmit(payload)
+        events.append(("answer", payload["text"]["body"]))
+        return response
+
+    dispatcher = OutboundDispatcher(recording_transmit, rate=1000, workers=2)
+    dispatcher.submit_batch([message("a", f"part{n}") for n in range(3)])
+    dispatcher.submit(message("a", "after"))
+
+    assert dispatcher.drain(timeout=5)
+    dispatcher.close()
+
+    bodies = ["part0", "part1", "part2", "after"]
+    assert events == [(event, body) for body in bodies for event in ("start", "answer")]
+
+
+def test_retried_batch_part_resumes_the_batch_without_resending():
+    graph = FakeGraph(answers={"part1": [429]})
+    dispatcher = OutboundDispatcher(graph.transmit, rate=1000, workers=2, backoff_base=0.01)
+    dispatcher.submit_batch([message("a", f"part{n}") for n in range(3)])
+
+    assert dispatcher.drain(timeout=5)
+    dispatcher.close()
+
+    assert [body for _, body in graph.sent] == ["part0", "part1", "part2"]
+    assert dispatcher.stats()["sent"] == 3 and dispatcher.stats()["retried"] == 1
+
+
+def test_reply_batch_falls_back_to_send():
+    class PlainSender:
+        def __init__(self):
+            self.sent = []
+
+        def send(self, message):
+            self.sent.append(message.to_dict())
+            return True
+
+    sender = PlainSender()
+    with ReplyBatch(sender, "34600000001") as reply:
+        reply.text("Elige una opción")
+        reply.payload({"type": "interactive", "interactive": {"type": "list"}})
+
+    assert [payload["type"] for payload in sender.sent] == ["text", "interactive"]
+    assert {payload["to"] for payload in sender.sent} == {"34600000001"}
@@ -0,0 +1,49 @@
+import hashlib
+import io
+import os
+import time
+
+from app.utils.raw_store import RawDocumentStore
+from tools.traffic import adr_document
+
+
+def test_documents_are_stored_once_compressed_by_content(tmp_path):
+    store = RawDocumentStore()
+    store.configure(tmp_path)
+    content = adr_document("media.1") * 20
+
+    digest = store.put(io.BytesIO(content))
+    assert digest == hashlib.sha256(content).hexdigest()
+    assert store.put(io.BytesIO(content), digest) == digest
+    assert store.put(io.BytesIO(content)) == digest
+
+    path = store.path(digest)
+    assert path == tmp_path / digest[:2] / f"{digest}.csv.gz"
+    assert [p for p in tmp_path.rglob("*") if p.is_file()] == [path]
+    assert path.stat().st_size < len(content) / 3
+    assert store.read(digest) == content
+    with store.open(digest) as stream:
+        assert stream.read(4) == content[:4]
+
+
+def test_least_recently_used_and_expired_files_are_evicted(tmp_path):
+    store = RawDocumentStore()
+    store.configure(tmp_path, max_age=3600)
+    documents = [os.urandom(2000) for _ in range(4)]  # incompressible
+    digests = [store.put(io.BytesIO(document)) for document in documents]
+
+    now = time.time()
+    for age, digest in zip((300, 200, 100, 0), digests):
+        os.utime(store.path(digest), (now - age, now - age))
+    store.read(digests[0])  # used again, now the most recent
+
+    store.max_bytes = int(3.5 * store.path(digests[0]).stat().st_size)  # room for 3 after eviction
+    store.put(io.BytesIO(os.urandom(2000)))
+
+    assert digests[0] in store and digests[3] in store
+    assert digests[1] not in store and digests[2] not in store
+
+    old = now - 7200
+    os.utime(store.path(digests[3]), (old, old))
+    store.max_bytes = 1024 * 1024
+    assert store.evict() == 1 and digests[3] not in store
@@ -0,0 +1,57 @@
+import pytest
+import sqlalchemy as sa
+from flask import Flask
+
+from app.config import Config
+from app.extensions import (READ_BIND, configure_engine_options, db, init_read_bind, init_sqlite_profile, run_read,
+                            sqlite_read_only_uri)
+
+
+def make_app(path, **config):
+    app = Flask(__name__)
+    app.config.update(SQLITE_PROFILES=Config.SQLITE_PROFILES, SQLITE_PROFILE="performance",
+                      SQLALCHEMY_DATABASE_URI=f"sqlite:///{path}", **config)
+    configure_engine_options(app)
+    db.init_app(app)
+    init_sqlite_profile(app)
+    init_read_bind(app)
+    return app
+
+
+def test_read_only_uri_opens_the_same_file():
+    url = sqlite_read_only_uri(sa.engine.make_url("sqlite:////data/app.db"))
+    assert url.database == "file:/data/app.db"
+    assert dict(url.query) == {"mode": "ro", "uri": "true"}
+
+
+def test_sqlite_read_bind_sees_commits_and_refuses_writes(tmp_path):
+    app = make_app(tmp_path / "app.db", SQLITE_READ_ONLY_BIND=True)
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql("CREATE TABLE reps (kg REAL)")
+            connection.exec_driver_sql("INSERT INTO reps VALUES (100.0)")
+
+        assert run_read(lambda session: session.execute(sa.text("SELECT kg FROM reps")).scalars().all()) == [100.0]
+        with app.extensions[READ_BIND].connect() as connection:
+            # The primary put the file in WAL mode, the read-only pool keeps the rest of the profile
+            assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert connection.exec_driver_sql("PRAGMA mmap_size").scalar() == 256 * 1024 * 1024
+            with pytest.raises(sa.exc.OperationalError):
+                connection.exec_driver_sql("INSERT INTO reps VALUES (1.0)")
+
+
+def test_reads_fall_back_to_the_primary(tmp_path):
+    def work(session):
+        session.execute(sa.text("SELECT 1"))
+        return session
+
+    # The read-only pool cannot create the file the primary has not written yet
+    missing = make_app(tmp_path / "missing.db", SQLITE_READ_ONLY_BIND=True)
+    with missing.app_context():
+        assert missing.extensions[READ_BIND] is not None
+        assert run_read(work) is db.session
+
+    replica = make_app(tmp_path / "app.db", READ_DATABASE_URI=f"sqlite:///{tmp_path / 'replica.db'}")
+    with replica.app_context():
+        assert run_read(work) is not db.session
+        assert run_read(work, fresh=True) is db.session
@@ -0,0 +1,138 @@
+import threading
+from types import SimpleNamespace
+
+from app.services.assistant_runner import AssistantRunner
+from app.services.response_cache import ResponseCache, assistant_fingerprint, normalize_question
+from app.services.thread_store import ThreadStore
+from tools.openai_stub import OpenAIStub
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_runner(tmp_path, client, cache):
+    return AssistantRunner(client, "asst_stub", ThreadStore(str(tmp_path / "threads.sqlite")), cache=cache)
+
+
+def test_questions_are_normalized():
+    assert normalize_question("¿Qué es la  PÉRDIDA de velocidad?") == "que es la perdida de velocidad"
+    assert normalize_question("que es la perdida de velocidad") == "que es la perdida de velocidad"
+
+
+def test_repeated_question_is_answered_without_a_run(tmp_path):
+    client = OpenAIStub(run_latency=0.01)
+    cache = ResponseCache()
+    runner = make_runner(tmp_path, client, cache)
+
+    first = runner.generate_response("¿Qué es la pérdida de velocidad?", "34600000001", "Ana")
+    second = runner.generate_response("que es la perdida de velocidad", "34600000002", "Luis")
+
+    assert second == first
+    assert client.calls["runs.stream"] == 1
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+    runner.close()
+    # The exchange is in Luis's thread, a follow-up of his is asked in context
+    luis = client.threads[runner.threads.get("34600000002")]
+    assert [(message.role, message.content[0].text.value) for message in luis] == [
+        ("user", "que es la perdida de velocidad"), ("assistant", first)]
+
+
+def test_cached_answer_is_delivered_before_it_is_recorded(tmp_path):
+    client = OpenAIStub(run_latency=0.01)
+    runner = make_runner(tmp_path, client, ResponseCache())
+    answer = runner.generate_response("¿Qué es la pérdida de velocidad?", "34600000001", "Ana")
+    recording = threading.Event()
+    create_message = client.beta.threads.messages.create
+
+    def slow_create(**kwargs):
+        assert recording.wait(timeout=5)
+        return create_message(**kwargs)
+
+    client.beta.threads.messages.create = slow_create
+    replies = []
+    delivered = threading.Event()
+    runner.submit("que es la perdida de velocidad", "34600000002", "Luis",
+                  on_reply=lambda text: (replies.append(text), delivered.set()))
+    assert delivered.wait(timeout=5)
+    assert replies == [answer] and client.calls["messages.create"] == 1
+
+    # Luis's follow-up waits for the record, so it is asked after the cached exchange
+    follow_up = runner.submit("¿Y para press banca?", "34600000002", "Luis")
+    recording.set()
+    follow_up.result(timeout=5)
+    runner.close()
+    luis = client.threads[runner.threads.get("34600000002")]
+    assert [message.content[0].text.value for message in luis][:3] == [
+        "que es la perdida de velocidad", answer, "¿Y para press banca?"]
+
+
+def test_answers_given_inside_a_conversation_are_not_cached(tmp_path):
+    client = OpenAIStub(run_latency=0.01)
+    cache = ResponseCache()
+    runner = make_runner(tmp_path, client, cache)
+
+    runner.generate_response("Hola, me llamo Ana y entreno sentadilla", "34600000001", "Ana")
+    runner.generate_response("¿Cuál es mi mejor serie?", "34600000001", "Ana")
+    runner.generate_response("¿Cuál es mi mejor serie?", "34600000002", "Luis")
+
+    assert client.calls["runs.stream"] == 3
+    assert cache.stats()["cached"] == 2
+
+
+def test_editing_the_assistant_reaches_the_cache_without_a_restart(tmp_path):
+    client = OpenAIStub(run_latency=0.01)
+    runner = AssistantRunner(client, "asst_stub", ThreadStore(str(tmp_path / "threads.sqlite")),
+                             cache=ResponseCache(), assistant_ttl=0)
+
+    runner.generate_response("¿Qué es el RIR?", "34600000001", "Ana")
+    client.instructions = "Responde en una frase"
+    runner.generate_response("¿Qué es el RIR?", "34600000002", "Luis")
+
+    assert client.calls["runs.stream"] == 2
+
+
+def test_short_follow_ups_bypassed_users_and_use_cache_false_get_fresh_runs(tmp_path):
+    client = OpenAIStub(run_latency=0.01)
+    cache = ResponseCache(bypass=["34600000009"])
+    runner = make_runner(tmp_path, client, cache)
+
+    for _ in range(2):
+        runner.generate_response("¿Y eso?", "34600000001", "Ana")
+    runner.generate_response("¿Cómo exporto desde el encoder?", "34600000001", "Ana")
+    runner.generate_response("¿Cómo exporto desde el encoder?", "34600000009", "Coach")
+    runner.generate_response("¿Cómo exporto desde el encoder?", "34600000001", "Ana", use_cache=False)
+
+    assert client.calls["runs.stream"] == 5
+    assert cache.stats()["bypassed"] == 1
+
+
+def test_entries_expire_and_least_recently_used_go_first():
+    clock = Clock()
+    cache = ResponseCache(ttl=60, max_entries=2, min_words=1, clock=clock)
+    a, b, c = (cache.key(question, "config") for question in ("uno", "dos", "tres"))
+
+    cache.put(a, "1")
+    cache.put(b, "2")
+    assert cache.get(a) == "1"
+    cache.put(c, "3")
+    assert cache.get(b) is None
+    assert cache.get(a) == "1"
+
+    clock.now += 61
+    assert cache.get(a) is None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_changing_the_assistant_invalidates_answers():
+    before = SimpleNamespace(id="asst_1", model="gpt-4o", instructions="Sé breve", tools=[])
+    after = SimpleNamespace(id="asst_1", model="gpt-4o", instructions="Sé detallado", tools=[])
+    cache = ResponseCache()
+    cache.put(cache.key("¿Qué es el RIR?", assistant_fingerprint(before)), "Repeticiones en reserva")
+
+    assert cache.get(cache.key("¿Qué es el RIR?", assistant_fingerprint(after))) is None
+    assert cache.get(cache.key("¿Qué es el RIR?", assistant_fingerprint(before))) == "Repeticiones en reserva"
@@ -0,0 +1,69 @@
+import pytest
+import sqlalchemy as sa
+from app.models.models import User
+from app.state.session_cache import UserSessionCache
+
+
+@pytest.fixture
+def cache():
+    return UserSessionCache(ttl=60)
+
+
+def count_queries(db):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    sa.event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    return statements, lambda: sa.event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_resolve_creates_user(db, cache):
+    session = cache.resolve("34600000001", "Alice")
+
+    user = db.session.get(User, session.user_id)
+    assert user.phone_number == "34600000001"
+    assert session.state == "IdleState"
+
+
+def test_resolve_hit_does_not_query(db, cache):
+    cache.resolve("34600000001", "Alice")
+
+    statements, stop = count_queries(db)
+    try:
+        session = cache.resolve("34600000001", "Alice")
+    finally:
+        stop()
+
+    assert session.state == "IdleState"
+    assert statements == []
+
+
+def test_write_state_is_write_through(db, cache):
+    session = cache.resolve("34600000001", "Alice")
+
+    updated = cache.write_state(session, "TrainingManagementState")
+
+    assert updated.state == "TrainingManagementState"
+    assert cache.get("34600000001").state == "TrainingManagementState"
+    state = db.session.scalar(sa.select(User.state).where(User.id == session.user_id))
+    assert state == "TrainingManagementState"
+
+
+def test_write_state_rejects_stale_session(db, cache):
+    session = cache.resolve("34600000001", "Alice")
+    # Another worker moves the user on
+    db.session.execute(sa.update(User).where(User.id == session.user_id).values(state="AddTrainingState"))
+    db.session.commit()
+
+    assert cache.write_state(session, "TrainingManagementState") is None
+    assert cache.get("34600000001") is None
+    assert cache.resolve("34600000001").state == "AddTrainingState"
+
+
+def test_expired_entry_is_reloaded(db, cache):
+    cache.resolve("34600000001", "Alice")
+    cache.ttl = 0
+
+    assert cache.get("34600000001") is None
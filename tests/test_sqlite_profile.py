@@ -0,0 +1,43 @@
+import pytest
+import sqlalchemy as sa
+from flask import Flask
+
+from app.config import Config
+from app.extensions import apply_sqlite_pragmas, configure_engine_options, sqlite_profile
+
+
+def make_app(**config):
+    app = Flask(__name__)
+    app.config.update(SQLITE_PROFILES=Config.SQLITE_PROFILES, **config)
+    return app
+
+
+def test_performance_pragmas_are_set_on_every_connection(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    apply_sqlite_pragmas(engine, Config.SQLITE_PROFILES["performance"]["pragmas"])
+
+    with engine.connect() as first, engine.connect() as second:
+        for connection in (first, second):
+            assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert connection.exec_driver_sql("PRAGMA synchronous").scalar() == 1  # NORMAL
+            assert connection.exec_driver_sql("PRAGMA busy_timeout").scalar() == 10000
+            assert connection.exec_driver_sql("PRAGMA mmap_size").scalar() == 256 * 1024 * 1024
+
+
+def test_pool_options_come_from_the_profile_unless_configured(tmp_path):
+    app = make_app(SQLITE_PROFILE="performance", SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'app.db'}",
+                   SQLALCHEMY_ENGINE_OPTIONS={"pool_size": 3})
+    configure_engine_options(app)
+
+    assert app.config["SQLALCHEMY_ENGINE_OPTIONS"]["pool_size"] == 3
+    assert app.config["SQLALCHEMY_ENGINE_OPTIONS"]["max_overflow"] == 10
+
+    memory = make_app(SQLITE_PROFILE="performance", SQLALCHEMY_DATABASE_URI="sqlite://")
+    configure_engine_options(memory)
+    assert "SQLALCHEMY_ENGINE_OPTIONS" not in memory.config
+
+
+def test_unknown_profile_is_rejected():
+    assert sqlite_profile(make_app(SQLITE_PROFILE="default")) == {}
+    with pytest.raises(ValueError):
+        sqlite_profile(make_app(SQLITE_PROFILE="turbo"))
@@ -0,0 +1,95 @@
+import json
+import pytest
+import sqlalchemy as sa
+from pydantic import TypeAdapter
+from app.api.webhooks.views import dispatch_webhook
+from app.models.models import User
+from app.models.payload_models import ValidatedWebhookPayload
+from app.state.session_cache import StateConflict, user_sessions
+from app.state.states.states import UserContext, StateMachine, create_state_machine, IdleState
+
+
+class RecordingSender:
+    def __init__(self):
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+        return True
+
+
+def list_reply(payload, row_id, title):
+    payload = json.loads(payload)
+    payload["entry"][0]["changes"][0]["value"]["messages"][0]["interactive"]["list_reply"].update(id=row_id, title=title)
+    return TypeAdapter(ValidatedWebhookPayload).validate_python(payload)
+
+
+@pytest.fixture
+def machine():
+    return create_state_machine(RecordingSender())
+
+
+def test_unknown_transition_target_is_rejected():
+    with pytest.raises(ValueError):
+        StateMachine({'IdleState': IdleState()}, {'IdleState': {'GO': 'MissingState'}})
+
+
+def test_states_are_shared_between_contexts(db, machine):
+    user_sessions.clear()
+    first = UserContext(user_sessions.resolve("34600000001", "Alice"), machine)
+    second = UserContext(user_sessions.resolve("34600000002", "Bob"), machine)
+
+    assert first.state is second.state
+
+
+def test_transition_is_persisted(db, machine, valid_list_reply_payload):
+    user_sessions.clear()
+    context = UserContext(user_sessions.resolve("16505551234", "Pablo"), machine)
+
+    context.handle_webhook(list_reply(valid_list_reply_payload, "training", "Opciones entrenamiento"))
+
+    assert context.state is machine.get_state("TrainingManagementState")
+    state = db.session.scalar(sa.select(User.state).where(User.phone_number == "16505551234"))
+    assert state == "TrainingManagementState"
+
+
+def test_transition_lost_to_another_worker_is_reported(db, machine, valid_list_reply_payload):
+    user_sessions.clear()
+    context = UserContext(user_sessions.resolve("16505551234", "Pablo"), machine)
+    # Another worker moves the user after this one resolved the session
+    db.session.execute(sa.update(User).where(User.phone_number == "16505551234").values(state="AddTrainingState"))
+    db.session.commit()
+
+    with pytest.raises(StateConflict):
+        context.handle_webhook(list_reply(valid_list_reply_payload, "training", "Opciones entrenamiento"))
+
+    assert user_sessions.get("16505551234") is None
+
+
+def test_webhook_is_handled_again_on_the_stored_state(app, db, machine, monkeypatch, valid_list_reply_payload):
+    monkeypatch.setitem(app.extensions, "state_machine", machine)
+    user_sessions.clear()
+    user_sessions.resolve("16505551234", "Pablo")
+    db.session.execute(sa.update(User).where(User.phone_number == "16505551234").values(state="AddTrainingState"))
+    db.session.commit()
+
+    dispatch_webhook(list_reply(valid_list_reply_payload, "training", "Opciones entrenamiento"))
+
+    sender = machine.get_state("IdleState").message_handler.message_sender
+    assert sender.sent[-1].template.name == "already_adding_training"
+    assert user_sessions.resolve("16505551234").state == "AddTrainingState"
+
+
+def test_no_transition_does_not_write(db, machine, valid_list_reply_payload):
+    user_sessions.clear()
+    context = UserContext(user_sessions.resolve("16505551234", "Pablo"), machine)
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    sa.event.listen(db.engine, "before_cursor_execute", listener)
+    try:
+        context.handle_webhook(list_reply(valid_list_reply_payload, "unknown", "Unknown"))
+    finally:
+        sa.event.remove(db.engine, "before_cursor_execute", listener)
+
+    assert context.state is machine.get_state("IdleState")
+    assert statements == []
@@ -0,0 +1,67 @@
+import multiprocessing
+import shelve
+
+from flask import Flask
+
+from app.services.thread_store import ThreadStore
+
+
+def _create_threads(path, worker, results):
+    store = ThreadStore(path)
+    results.put([store.setdefault(f"3460000{user:04d}", f"thread_{worker}_{user}") for user in range(50)])
+
+
+def test_lookups_are_cached_and_survive_restarts(tmp_path):
+    path = str(tmp_path / "threads.sqlite")
+    store = ThreadStore(path)
+    assert store.get("34600000001") is None
+
+    store.put("34600000001", "thread_a")
+    assert store.get("34600000001") == "thread_a"
+    assert store.setdefault("34600000001", "thread_b") == "thread_a"
+
+    restarted = ThreadStore(path)
+    assert restarted.get("34600000001") == "thread_a"
+    assert ThreadStore(path).get("34600000001") == "thread_a"
+
+
+def test_workers_creating_threads_at_once_agree(tmp_path):
+    path = str(tmp_path / "threads.sqlite")
+    ThreadStore(path).get("warm up")  # creates the table
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [context.Process(target=_create_threads, args=(path, worker, results)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    answers = [results.get(timeout=30) for _ in workers]
+    for process in workers:
+        process.join()
+
+    assert all(answer == answers[0] for answer in answers)
+
+
+def test_shelve_threads_are_imported(tmp_path):
+    with shelve.open(str(tmp_path / "threads_db")) as threads_shelf:
+        threads_shelf["34600000001"] = "thread_old"
+    store = ThreadStore(str(tmp_path / "threads.sqlite"))
+    store.put("34600000002", "thread_new")
+
+    assert store.import_shelve(str(tmp_path / "threads_db")) == 1
+    assert store.import_shelve(str(tmp_path / "missing")) == 0
+    assert store.get("34600000001") == "thread_old"
+
+
+def test_store_lives_in_the_instance_folder_and_imports_the_shelve_on_demand(tmp_path):
+    app = Flask(__name__, instance_path=str(tmp_path / "instance"))
+    app.config["OPENAI_THREADS_DB"] = "threads.sqlite"
+    store = ThreadStore()
+    store.init_app(app)
+    assert store.path == str(tmp_path / "instance" / "threads.sqlite")
+
+    with shelve.open(str(tmp_path / "threads_db")) as threads_shelf:
+        threads_shelf["34600000001"] = "thread_a"
+    assert store.get("34600000001") is None
+
+    result = app.test_cli_runner().invoke(args=["import-threads", str(tmp_path / "threads_db")])
+    assert "1 threads read" in result.output
+    assert store.get("34600000001") == "thread_a"
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import socket
+
+import pytest
+import sqlalchemy as sa
+
+from app import create_app
+from app.core.messaging.capture import TrafficRecorder, capture_files, read_capture
+from app.models.models import IngestedDocument, db as _db
+from app.state.session_cache import user_sessions
+from tools.graph_stub import GraphStub, StubThread
+from tools.replay import Replay, replay_config
+from tools.traffic import CONVERSATION, build_webhook
+
+
+def recorder(directory, **kwargs):
+    traffic = TrafficRecorder()
+    traffic.configure(directory, salt="capture-salt-for-tests", flush_interval=0.01, **kwargs)
+    return traffic
+
+
+def test_capture_anonymises_phone_numbers(tmp_path):
+    traffic = recorder(tmp_path)
+    for seq, wa_id in enumerate(["34600000001", "34600000002", "34600000001"]):
+        traffic.record(json.dumps(build_webhook("text", "Hola", wa_id, seq)).encode())
+    traffic.record(json.dumps(build_webhook("status", "delivered", "34600000001", 3)).encode())
+    traffic.close()
+
+    records = list(read_capture(capture_files(tmp_path)))
+    assert len(records) == 4
+    assert "34600000001" not in json.dumps(records)
+
+    values = [json.loads(record["body"])["entry"][0]["changes"][0]["value"] for record in records]
+    senders = [value["messages"][0]["from"] for value in values[:3]]
+    # Stable per athlete, so replayed conversations keep their shape
+    assert senders[0] == senders[2] != senders[1]
+    assert values[0]["contacts"][0]["wa_id"] == senders[0]
+    assert values[3]["statuses"][0]["recipient_id"] == senders[0]
+    assert [record["ts"] for record in records] == sorted(record["ts"] for record in records)
+
+
+def test_capture_rotates_and_prunes(tmp_path):
+    traffic = recorder(tmp_path, max_bytes=1, max_files=3, batch_size=1)
+    for seq in range(6):
+        traffic.record(json.dumps(build_webhook("text", "Hola", "34600000001", seq)).encode())
+    traffic.close()
+
+    files = capture_files(tmp_path)
+    assert len(files) == 3
+    assert len(list(read_capture(files))) == 3
+
+
+def test_capture_refuses_to_start_without_a_salt(tmp_path):
+    for salt in ("", "short"):
+        with pytest.raises(ValueError, match="TRAFFIC_CAPTURE_SALT"):
+            TrafficRecorder().configure(tmp_path, salt=salt)
+
+
+def test_prune_leaves_files_other_workers_are_writing(tmp_path):
+    # The parent process stands in for another worker that is still writing its file
+    busy = tmp_path / f"traffic-20240101T000000-000000000-{os.getppid()}.jsonl.gz"
+    busy.touch()
+    os.utime(busy, (0, 0))
+    traffic = recorder(tmp_path, max_bytes=1, max_files=1, batch_size=1)
+    for seq in range(3):
+        traffic.record(json.dumps(build_webhook("text", "Hola", "34600000001", seq)).encode())
+    traffic.close()
+
+    assert busy.exists()
+    assert len(capture_files(tmp_path)) == 2
+
+
+def test_replayed_capture_ingests_the_captured_document(app, tmp_path):
+    traffic = recorder(tmp_path / "captures")
+    for seq, (kind, arg) in enumerate(CONVERSATION):
+        payload = build_webhook(kind, arg, "34600000001", seq)
+        if kind == "document":
+            # The athlete's own export: the stub cannot serve these bytes
+            document = payload["entry"][0]["changes"][0]["value"]["messages"][0]["document"]
+            document["sha256"] = hashlib.sha256(b"athlete export").hexdigest()
+        traffic.record(json.dumps(payload).encode())
+    traffic.close()
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    stub = GraphStub(port=port)
+    with StubThread(stub):
+        replay_app = create_app(replay_config(tmp_path / "replay.db", stub.url))
+        with replay_app.app_context():
+            _db.create_all()
+        user_sessions.clear()
+        Replay(replay_app, speed=0).run(read_capture(capture_files(tmp_path / "captures")))
+        dispatcher = replay_app.extensions.get("outbound_dispatcher")
+        if dispatcher is not None:
+            dispatcher.drain(timeout=10)
+        with replay_app.app_context():
+            assert _db.session.scalar(sa.select(sa.func.count()).select_from(IngestedDocument)) == 1
+            _db.session.remove()
+    user_sessions.clear()
@@ -0,0 +1,141 @@
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from app.core.messaging.ordering import UserSerializer, sender_wa_id
+
+
+class Recorder:
+    '''Tracks processing order per user and how many users ran at the same time'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processed = defaultdict(list)
+        self.active = set()
+        self.max_parallel_users = 0
+        self.overlaps = 0
+
+    def handle(self, wa_id, seq):
+        with self.lock:
+            if wa_id in self.active:
+                self.overlaps += 1
+            self.active.add(wa_id)
+            self.max_parallel_users = max(self.max_parallel_users, len(self.active))
+        time.sleep(random.uniform(0, 0.002))
+        with self.lock:
+            self.processed[wa_id].append(seq)
+            self.active.discard(wa_id)
+
+
+def flood(serializer, recorder, users=40, messages_per_user=25, workers=16):
+    inbox = [(f"346000{u:05d}", seq) for seq in range(messages_per_user) for u in range(users)]
+
+    def work(ticket, wa_id, seq):
+        with ticket:
+            recorder.handle(wa_id, seq)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        # Tickets are taken in arrival order, exactly like handle_message does on receipt
+        for wa_id, seq in inbox:
+            futures.append(pool.submit(work, serializer.ticket(wa_id), wa_id, seq))
+        for future in futures:
+            future.result(timeout=30)
+    return inbox
+
+
+def test_flood_keeps_per_user_order_and_runs_users_in_parallel():
+    serializer = UserSerializer()
+    recorder = Recorder()
+
+    inbox = flood(serializer, recorder)
+
+    expected = defaultdict(list)
+    for wa_id, seq in inbox:
+        expected[wa_id].append(seq)
+    assert recorder.processed == expected
+    assert recorder.overlaps == 0
+    assert recorder.max_parallel_users > 1
+    assert serializer._queues == {}
+
+
+def test_flood_across_serializers_sharing_lock_dir(tmp_path):
+    pytest.importorskip("fcntl")
+    # Two serializers with separate lock files stand in for two worker processes
+    workers = [UserSerializer(lock_dir=tmp_path), UserSerializer(lock_dir=tmp_path)]
+    recorder = Recorder()
+
+    def work(wa_id, seq):
+        with workers[seq % 2].hold(wa_id):
+            recorder.handle(wa_id, seq)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        futures = [pool.submit(work, f"346000{u:05d}", seq) for seq in range(10) for u in range(20)]
+        for future in futures:
+            future.result(timeout=30)
+
+    assert recorder.overlaps == 0
+    assert sum(len(seqs) for seqs in recorder.processed.values()) == 200
+
+
+def test_order_across_serializers_is_the_order_tickets_were_taken(tmp_path):
+    pytest.importorskip("fcntl")
+    workers = [UserSerializer(lock_dir=tmp_path), UserSerializer(lock_dir=tmp_path)]
+    processed = []
+
+    def work(ticket, seq):
+        with ticket:
+            processed.append(seq)
+
+    # Each worker has one message in flight; they are entered in the opposite order of receipt
+    tickets = [workers[seq % 2].ticket("34600000001") for seq in range(2)]
+    threads = [threading.Thread(target=work, args=(tickets[seq], seq)) for seq in (1, 0)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert processed == [0, 1]
+
+
+def test_ticket_of_a_dead_worker_is_skipped(tmp_path):
+    pytest.importorskip("fcntl")
+    serializer = UserSerializer(lock_dir=tmp_path)
+    pid = os.fork()
+    if pid == 0:
+        # A worker killed while it held the user's turn
+        serializer.ticket("34600000001")
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    done = threading.Event()
+
+    def work():
+        with serializer.hold("34600000001"):
+            done.set()
+
+    threading.Thread(target=work, daemon=True).start()
+    assert done.wait(timeout=5)
+
+
+def test_ticket_released_when_holder_fails():
+    serializer = UserSerializer()
+
+    with pytest.raises(RuntimeError):
+        with serializer.hold("34600000001"):
+            raise RuntimeError("handler failed")
+
+    assert serializer.pending("34600000001") == 0
+    with serializer.hold("34600000001"):
+        pass
+
+
+def test_sender_is_read_from_the_raw_body(valid_text_message_payload, valid_status_update_payload):
+    assert sender_wa_id(valid_text_message_payload.encode()) == "15551234567"
+    assert sender_wa_id(valid_status_update_payload.encode()) is None
+    assert sender_wa_id(b"not json") is None
@@ -0,0 +1,169 @@
+'''
+Local stand-in for graph.facebook.com.
+
+Accepts outbound messages, resolves media ids and serves media, each with a
+configurable latency. Point the app at it with GRAPH_API_URL:
+
+    python -m tools.graph_stub --port 8081 --latency 0.05
+    GRAPH_API_URL=http://127.0.0.1:8081 flask run
+'''
+import argparse
+import asyncio
+import hashlib
+import itertools
+import random
+import threading
+import time
+from typing import Callable, List, Optional
+
+from aiohttp import web
+
+from .traffic import adr_document
+
+
+class GraphStub:
+    '''
+    Minimal Graph API: POST /{version}/{phone_number_id}/messages,
+    POST /{version}/{phone_number_id}/media, GET /{version}/{media_id}/ and
+    GET /media/{media_id}.
+
+    Every accepted message is appended to `messages` as (received_at, payload)
+    and passed to `on_message`, which the load test uses to time replies.
+    '''
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8081, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0,
+                 on_message: Optional[Callable[[float, dict], None]] = None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.on_message = on_message
+        self.messages: List[tuple] = []
+        self.uploads: List[tuple] = []  # (media id, filename, size)
+        self._ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+        self.app = web.Application()
+        self.app.router.add_post("/{version}/{phone_number_id}/messages", self.post_message)
+        self.app.router.add_post("/{version}/{phone_number_id}/media", self.post_media)
+        self.app.router.add_get("/media/{media_id}", self.get_media)
+        self.app.router.add_get("/{version}/{media_id}/", self.get_media_url)
+        self.app.router.add_get("/{version}/{media_id}", self.get_media_url)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _delay(self) -> None:
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _fail(self) -> bool:
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    async def post_message(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        await self._delay()
+        if self._fail():
+            return web.json_response({"error": {"message": "Service unavailable", "code": 2}}, status=503)
+
+        received_at = time.perf_counter()
+        self.messages.append((received_at, payload))
+        if self.on_message is not None:
+            self.on_message(received_at, payload)
+
+        return web.json_response({
+            "messaging_product": "whatsapp",
+            "contacts": [{"input": payload.get("to"), "wa_id": payload.get("to")}],
+            "messages": [{"id": f"wamid.stub.{next(self._ids)}"}],
+        })
+
+    async def post_media(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        upload = form["file"]
+        size = len(upload.file.read())
+        await self._delay()
+        media_id = f"media.stub.{next(self._ids)}"
+        self.uploads.append((media_id, upload.filename, size))
+        return web.json_response({"id": media_id})
+
+    async def get_media_url(self, request: web.Request) -> web.Response:
+        await self._delay()
+        media_id = request.match_info["media_id"]
+        content = adr_document(media_id)
+        return web.json_response({
+            "messaging_product": "whatsapp",
+            "url": f"{self.url}/media/{media_id}",
+            "mime_type": "text/csv",
+            "sha256": hashlib.sha256(content).hexdigest(),
+            "file_size": len(content),
+            "id": media_id,
+        })
+
+    async def get_media(self, request: web.Request) -> web.Response:
+        await self._delay()
+        return web.Response(body=adr_document(request.match_info["media_id"]), content_type="text/csv")
+
+
+class StubThread:
+    ''' Runs a GraphStub on its own event loop so the synchronous app can call it '''
+
+    def __init__(self, stub: GraphStub):
+        self.stub = stub
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="graph-stub", daemon=True)
+
+    def __enter__(self) -> GraphStub:
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.stub.start(), self.loop).result()
+        return self.stub
+
+    def __exit__(self, *exc) -> None:
+        asyncio.run_coroutine_threadsafe(self.stub.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+async def _serve(args) -> None:
+    stub = GraphStub(host=args.host, port=args.port, latency=args.latency,
+                     jitter=args.jitter, error_rate=args.error_rate)
+    await stub.start()
+    print(f"Graph API stub listening on {stub.url}")
+    try:
+        while True:
+            await asyncio.sleep(3600)
+    finally:
+        await stub.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds of random latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of messages answered with 503")
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
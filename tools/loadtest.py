@@ -0,0 +1,160 @@
+'''
+Load test for the webhook endpoint.
+
+Sends signed webhooks (text, interactive list replies, documents and statuses)
+for `--users` athletes at `--rate` webhooks per second. Each athlete walks
+through tools.traffic.CONVERSATION. An in-process Graph API stub receives the
+replies so end-to-end latency can be measured. Start the app against the stub
+and with the same secret:
+
+    GRAPH_API_URL=http://127.0.0.1:8081 APP_SECRET=load-secret flask run --port 8000
+    python -m tools.loadtest --target http://127.0.0.1:8000/webhook --app-secret load-secret \\
+        --rate 50 --users 200 --duration 60 --graph-latency 0.1
+
+Reported latencies:
+  ack    time until the webhook POST is answered
+  reply  time from sending a webhook until the first message the bot sends
+         to that athlete afterwards. Webhooks still waiting for a reply at the
+         end (after --drain seconds) are counted as unanswered.
+'''
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import defaultdict, deque
+from typing import Dict, List
+
+import aiohttp
+
+from .graph_stub import GraphStub
+from .traffic import CONVERSATION, build_webhook, expects_reply, sign
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LoadTest:
+    def __init__(self, target: str, app_secret: str, rate: float, users: int, duration: float,
+                 drain: float, first_wa_id: int = 34600000000):
+        self.target = target
+        self.app_secret = app_secret
+        self.rate = rate
+        self.duration = duration
+        self.drain = drain
+        self.wa_ids = [str(first_wa_id + n) for n in range(users)]
+
+        self.ack_latencies: List[float] = []
+        self.reply_latencies: List[float] = []
+        self.sent = 0
+        self.errors = 0
+        self.by_kind: Dict[str, int] = defaultdict(int)
+        # wa_id -> send times of webhooks still waiting for a reply
+        self._pending: Dict[str, deque] = defaultdict(deque)
+
+    def on_reply(self, received_at: float, payload: dict) -> None:
+        pending = self._pending.get(payload.get("to"))
+        # One reply answers every webhook of that athlete sent before it
+        while pending:
+            self.reply_latencies.append(received_at - pending.popleft())
+
+    async def _post(self, session: aiohttp.ClientSession, kind: str, payload: dict, wa_id: str) -> None:
+        body = json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json", "X-Hub-Signature-256": sign(self.app_secret, body)}
+        started = time.perf_counter()
+        if expects_reply(kind):
+            self._pending[wa_id].append(started)
+        try:
+            async with session.post(self.target, data=body, headers=headers) as response:
+                await response.read()
+                if response.status != 200:
+                    self.errors += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.errors += 1
+        finally:
+            self.ack_latencies.append(time.perf_counter() - started)
+
+    async def run(self) -> None:
+        # Round robin over athletes; each one advances through its conversation
+        steps = {wa_id: itertools.cycle(CONVERSATION) for wa_id in self.wa_ids}
+        athletes = itertools.cycle(self.wa_ids)
+        interval = 1.0 / self.rate
+        tasks = set()
+
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(timeout=timeout, connector=aiohttp.TCPConnector(limit=0)) as session:
+            start = time.perf_counter()
+            for seq in itertools.count():
+                # Open loop: webhooks go out on schedule whether or not earlier ones were answered
+                scheduled = start + seq * interval
+                if scheduled - start >= self.duration:
+                    break
+                await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+
+                wa_id = next(athletes)
+                kind, arg = next(steps[wa_id])
+                payload = build_webhook(kind, arg, wa_id, seq)
+                self.sent += 1
+                self.by_kind[kind] += 1
+                task = asyncio.create_task(self._post(session, kind, payload, wa_id))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            if tasks:
+                await asyncio.gather(*tasks)
+        await asyncio.sleep(self.drain)
+
+    def report(self, elapsed: float) -> str:
+        unanswered = sum(len(pending) for pending in self._pending.values())
+        lines = [
+            f"webhooks sent      {self.sent} in {elapsed:.1f}s ({self.sent / elapsed:.1f}/s)",
+            "  " + ", ".join(f"{kind}={count}" for kind, count in sorted(self.by_kind.items())),
+            f"errors             {self.errors} ({100 * self.errors / max(self.sent, 1):.2f}%)",
+            f"unanswered         {unanswered}",
+        ]
+        for name, values in (("ack", self.ack_latencies), ("reply", self.reply_latencies)):
+            ms = [value * 1000 for value in values]
+            lines.append(
+                f"{name:<6} latency ms  p50={percentile(ms, 50):8.1f}  p95={percentile(ms, 95):8.1f}  "
+                f"p99={percentile(ms, 99):8.1f}  max={max(ms, default=float('nan')):8.1f}  n={len(ms)}"
+            )
+        return "\n".join(lines)
+
+
+async def _main(args) -> None:
+    load = LoadTest(args.target, args.app_secret, args.rate, args.users, args.duration, args.drain)
+    stub = GraphStub(host=args.stub_host, port=args.stub_port, latency=args.graph_latency,
+                     jitter=args.graph_jitter, error_rate=args.graph_error_rate, on_message=load.on_reply)
+    await stub.start()
+    print(f"Graph API stub on {stub.url}; sending to {args.target}")
+    try:
+        started = time.perf_counter()
+        await load.run()
+        print(load.report(time.perf_counter() - started))
+    finally:
+        await stub.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", default="http://127.0.0.1:8000/webhook")
+    parser.add_argument("--app-secret", required=True, help="APP_SECRET of the app under test")
+    parser.add_argument("--rate", type=float, default=20.0, help="webhooks per second")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of traffic")
+    parser.add_argument("--drain", type=float, default=5.0, help="seconds to wait for late replies")
+    parser.add_argument("--stub-host", default="127.0.0.1")
+    parser.add_argument("--stub-port", type=int, default=8081)
+    parser.add_argument("--graph-latency", type=float, default=0.05)
+    parser.add_argument("--graph-jitter", type=float, default=0.0)
+    parser.add_argument("--graph-error-rate", type=float, default=0.0)
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
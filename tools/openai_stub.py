@@ -0,0 +1,190 @@
+'''
+Local stand-in for the OpenAI client used by app.services.
+
+Implements the Assistants calls the bot makes (assistants.retrieve, threads,
+messages, runs with polling and streaming) in memory. A run takes
+`run_latency` seconds (+/- `jitter`) and then ends with `status`, so assistant
+latency can be measured offline:
+
+    from tools.openai_stub import OpenAIStub
+    runner = AssistantRunner(OpenAIStub(run_latency=2.0), "asst_stub", thread_store)
+'''
+import itertools
+import random
+import threading
+import time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+
+def _message(message_id: str, role: str, text: str) -> SimpleNamespace:
+    return SimpleNamespace(id=message_id, role=role,
+                           content=[SimpleNamespace(type="text", text=SimpleNamespace(value=text))])
+
+
+class _Run:
+    def __init__(self, stub: "OpenAIStub", run_id: str, thread_id: str, latency: float):
+        self.stub = stub
+        self.id = run_id
+        self.thread_id = thread_id
+        self.created_at = time.monotonic()
+        self.done_at = self.created_at + latency
+        self.cancelled = False
+        self.answered = False
+
+    def snapshot(self) -> SimpleNamespace:
+        now = time.monotonic()
+        if self.cancelled:
+            status = "cancelled"
+        elif now < self.done_at:
+            status = "in_progress"
+        else:
+            status = self.stub.status
+            if status == "completed" and not self.answered:
+                self.answered = True
+                question = self.stub.threads[self.thread_id][-1].content[0].text.value
+                self.stub._add_message(self.thread_id, "assistant", self.stub.answer(question))
+        error = SimpleNamespace(code="server_error", message="Stub failure") if status == "failed" else None
+        return SimpleNamespace(id=self.id, thread_id=self.thread_id, status=status, last_error=error)
+
+
+class _RunStream:
+    '''
+    The part of openai's AssistantStreamManager the runner uses. An event
+    arrives every `event_interval` seconds while the run is in progress;
+    `timeout` bounds the wait for each one, as httpx's read timeout does.
+    '''
+
+    def __init__(self, run: _Run, timeout: Optional[float], event_interval: float):
+        self.run = run
+        self.timeout = timeout
+        self.event_interval = event_interval
+        self.instructions = "Stub instructions"
+        self.current_run = run.snapshot()
+        self._first_message = len(run.stub.threads[run.thread_id])
+
+    def __enter__(self) -> "_RunStream":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def __iter__(self):
+        while not self.run.cancelled:
+            wait = min(self.run.done_at - time.monotonic(), self.event_interval)
+            if wait <= 0:
+                break
+            if self.timeout is not None and wait > self.timeout:
+                time.sleep(max(0.0, self.timeout))
+                raise TimeoutError("Stub stream timed out")
+            time.sleep(wait)
+            yield SimpleNamespace(event="thread.run.step.delta", data=None)
+        self.current_run = self.run.snapshot()
+        yield SimpleNamespace(event=f"thread.run.{self.current_run.status}", data=self.current_run)
+
+    def until_done(self) -> None:
+        for _ in self:
+            pass
+
+    def get_final_run(self) -> SimpleNamespace:
+        return self.current_run
+
+    def get_final_messages(self) -> List[SimpleNamespace]:
+        return self.run.stub.threads[self.run.thread_id][self._first_message:]
+
+
+class _Namespace:
+    def __init__(self, **members):
+        self.__dict__.update(members)
+
+
+class OpenAIStub:
+    '''
+    In-memory OpenAI client. `calls` counts requests per endpoint, the way
+    they would reach the API (a stream counts as one request).
+    '''
+
+    def __init__(self, run_latency: float = 1.0, jitter: float = 0.0, status: str = "completed",
+                 answer: Optional[Callable[[str], str]] = None, event_interval: float = 0.05):
+        self.run_latency = run_latency
+        self.event_interval = event_interval
+        self.jitter = jitter
+        self.status = status
+        self.answer = answer or (lambda question: f"Respuesta a: {question}")
+        self.instructions = "Stub instructions"
+        self.calls: Counter = Counter()
+        self.threads: Dict[str, List[SimpleNamespace]] = {}
+        self.runs: Dict[str, _Run] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        runs = _Namespace(create=self._create_run, retrieve=self._retrieve_run, cancel=self._cancel_run,
+                          stream=self._stream_run)
+        messages = _Namespace(create=self._create_message, list=self._list_messages)
+        threads = _Namespace(create=self._create_thread, retrieve=self._retrieve_thread,
+                             messages=messages, runs=runs)
+        assistants = _Namespace(retrieve=self._retrieve_assistant)
+        self.beta = _Namespace(assistants=assistants, threads=threads)
+
+    def _count(self, endpoint: str) -> None:
+        with self._lock:
+            self.calls[endpoint] += 1
+
+    def _next_id(self, prefix: str) -> str:
+        with self._lock:
+            return f"{prefix}_{next(self._ids)}"
+
+    def _add_message(self, thread_id: str, role: str, text: str) -> SimpleNamespace:
+        message = _message(self._next_id("msg"), role, text)
+        self.threads[thread_id].append(message)
+        return message
+
+    def _latency(self) -> float:
+        return max(0.0, self.run_latency + random.uniform(-self.jitter, self.jitter))
+
+    def _retrieve_assistant(self, assistant_id: str) -> SimpleNamespace:
+        self._count("assistants.retrieve")
+        return SimpleNamespace(id=assistant_id, name="Stub assistant", instructions=self.instructions)
+
+    def _create_thread(self) -> SimpleNamespace:
+        self._count("threads.create")
+        thread_id = self._next_id("thread")
+        self.threads[thread_id] = []
+        return SimpleNamespace(id=thread_id)
+
+    def _retrieve_thread(self, thread_id: str) -> SimpleNamespace:
+        self._count("threads.retrieve")
+        return SimpleNamespace(id=thread_id)
+
+    def _create_message(self, thread_id: str, role: str, content: str) -> SimpleNamespace:
+        self._count("messages.create")
+        return self._add_message(thread_id, role, content)
+
+    def _list_messages(self, thread_id: str, order: str = "desc", limit: int = 20) -> SimpleNamespace:
+        self._count("messages.list")
+        messages = self.threads[thread_id]
+        ordered = list(reversed(messages)) if order == "desc" else list(messages)
+        return SimpleNamespace(data=ordered[:limit])
+
+    def _new_run(self, thread_id: str) -> _Run:
+        run = _Run(self, self._next_id("run"), thread_id, self._latency())
+        self.runs[run.id] = run
+        return run
+
+    def _create_run(self, thread_id: str, assistant_id: str, **kwargs) -> SimpleNamespace:
+        self._count("runs.create")
+        return self._new_run(thread_id).snapshot()
+
+    def _retrieve_run(self, thread_id: str, run_id: str) -> SimpleNamespace:
+        self._count("runs.retrieve")
+        return self.runs[run_id].snapshot()
+
+    def _cancel_run(self, thread_id: str, run_id: str) -> SimpleNamespace:
+        self._count("runs.cancel")
+        self.runs[run_id].cancelled = True
+        return self.runs[run_id].snapshot()
+
+    def _stream_run(self, thread_id: str, assistant_id: str, timeout: Optional[float] = None, **kwargs) -> _RunStream:
+        self._count("runs.stream")
+        return _RunStream(self._new_run(thread_id), timeout, self.event_interval)
@@ -0,0 +1,136 @@
+'''
+Replays captured webhook traffic against a scratch database.
+
+Capture is enabled in the app with TRAFFIC_CAPTURE_DIR. The captured,
+anonymised bodies are re-signed with a replay secret and posted through the
+Flask /webhook endpoint (signature check, validation and handle_message) of an
+app using a fresh SQLite database. An in-process Graph API stub receives the
+replies and serves the documents:
+
+    python -m tools.replay captures/ --speed 1       # original timing
+    python -m tools.replay captures/ --speed 10      # ten times faster
+    python -m tools.replay captures/ --speed 0       # as fast as possible
+
+Athletes in a capture are replayed in their original order, so the same
+capture always drives the state machine through the same transitions. The
+stub serves a generated encoder export for every document, so each captured
+document's sha256 is replaced by that export's before it is posted.
+'''
+import argparse
+import hashlib
+import json
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Iterable
+
+from app import create_app
+from app.config import TestingConfig
+from app.core.messaging.capture import capture_files, read_capture
+from app.models.models import db
+from .graph_stub import GraphStub, StubThread
+from .loadtest import percentile
+from .traffic import adr_document, sign
+
+REPLAY_SECRET = "replay-secret"
+
+
+def replay_config(database: Path, graph_url: str) -> type:
+    class ReplayConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{database}"
+        GRAPH_API_URL = graph_url
+        APP_SECRET = REPLAY_SECRET
+        USER_LOCK_DIR = None
+        TRAFFIC_CAPTURE_DIR = None
+
+    return ReplayConfig
+
+
+def with_stub_documents(body: str) -> str:
+    ''' The webhook body with the sha256 of each document set to the content the stub serves for it '''
+    payload = json.loads(body)
+    documents = [message["document"]
+                 for entry in payload.get("entry", []) for change in entry.get("changes", [])
+                 for message in change.get("value", {}).get("messages", []) if "document" in message]
+    if not documents:
+        return body
+    for document in documents:
+        document["sha256"] = hashlib.sha256(adr_document(document["id"])).hexdigest()
+    return json.dumps(payload)
+
+
+class Replay:
+    def __init__(self, app, speed: float = 1.0):
+        self.app = app
+        self.speed = speed
+        self.sent = 0
+        self.statuses: Counter = Counter()
+        self.latencies = []
+
+    def run(self, records: Iterable[dict]) -> None:
+        client = self.app.test_client()
+        started = time.perf_counter()
+        first_ts = None
+        for record in records:
+            if first_ts is None:
+                first_ts = record["ts"]
+            if self.speed > 0:
+                # Keep the original gaps between webhooks, divided by speed
+                scheduled = started + (record["ts"] - first_ts) / self.speed
+                time.sleep(max(0.0, scheduled - time.perf_counter()))
+
+            body = with_stub_documents(record["body"]).encode()
+            sent_at = time.perf_counter()
+            response = client.post("/webhook", data=body, headers={
+                "Content-Type": "application/json",
+                "X-Hub-Signature-256": sign(REPLAY_SECRET, body),
+            })
+            self.latencies.append(time.perf_counter() - sent_at)
+            self.statuses[response.status_code] += 1
+            self.sent += 1
+
+    def report(self, elapsed: float, replies: int) -> str:
+        ms = [value * 1000 for value in self.latencies]
+        return "\n".join([
+            f"webhooks replayed  {self.sent} in {elapsed:.1f}s ({self.sent / max(elapsed, 1e-9):.1f}/s)",
+            "  statuses " + ", ".join(f"{status}={count}" for status, count in sorted(self.statuses.items())),
+            f"replies sent       {replies}",
+            f"handle latency ms  p50={percentile(ms, 50):8.1f}  p95={percentile(ms, 95):8.1f}  "
+            f"p99={percentile(ms, 99):8.1f}  max={max(ms, default=float('nan')):8.1f}",
+        ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("capture", help="TRAFFIC_CAPTURE_DIR or a single capture file")
+    parser.add_argument("--speed", type=float, default=1.0, help="time scale; 0 replays as fast as possible")
+    parser.add_argument("--database", help="scratch SQLite file (default: a temporary file)")
+    parser.add_argument("--stub-port", type=int, default=8082)
+    parser.add_argument("--graph-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    capture = Path(args.capture)
+    paths = capture_files(capture) if capture.is_dir() else [capture]
+    if not paths:
+        parser.error(f"No capture files in {capture}")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        database = Path(args.database) if args.database else Path(scratch) / "replay.db"
+        stub = GraphStub(port=args.stub_port, latency=args.graph_latency)
+        with StubThread(stub):
+            app = create_app(replay_config(database, stub.url))
+            with app.app_context():
+                db.create_all()
+
+            replay = Replay(app, speed=args.speed)
+            started = time.perf_counter()
+            replay.run(read_capture(paths))
+            dispatcher = app.extensions.get("outbound_dispatcher")
+            if dispatcher is not None:
+                dispatcher.drain(timeout=30)
+            print(replay.report(time.perf_counter() - started, len(stub.messages)))
+
+
+if __name__ == "__main__":
+    main()
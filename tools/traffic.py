@@ -0,0 +1,96 @@
+'''
+Builds signed WhatsApp webhook payloads from the test fixtures, for the load
+test and replay tools.
+'''
+import hashlib
+import hmac
+import json
+import time
+import zlib
+from typing import Optional
+
+from tests.fixtures.payloads import (
+    VALID_STATUS_UPDATE_PAYLOAD,
+    VALID_TEXT_MESSAGE_PAYLOAD,
+    VALID_DOCUMENT_MESSAGE_PAYLOAD,
+    VALID_LIST_REPLY,
+)
+from tests.fixtures.adr_dataframes import ADR_CSV_1
+
+# One user's conversation, repeated: menu -> training -> add training -> upload -> end
+CONVERSATION = [
+    ("text", "Hola"),
+    ("list_reply", ("training", "Opciones entrenamiento")),
+    ("list_reply", ("add_training", "Añade un entrenamiento")),
+    ("document", "adrencoder.csv"),
+    ("text", "finitto"),
+    ("status", "delivered"),
+]
+
+
+def sign(app_secret: str, body: bytes) -> str:
+    ''' Value of the X-Hub-Signature-256 header Meta sends '''
+    digest = hmac.new(app_secret.encode("latin-1"), body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def adr_document(media_id: str) -> bytes:
+    '''
+    Encoder export served for media_id. The load varies with the id so each
+    upload carries new reps, and the bytes are stable so the sha256 in the
+    webhook matches what the stub serves.
+    '''
+    document = ADR_CSV_1.copy()
+    document["KG"] = 40 + zlib.crc32(media_id.encode()) % 60
+    return document.to_csv(index=False).encode()
+
+
+def _message_value(payload: dict) -> dict:
+    return payload["entry"][0]["changes"][0]["value"]
+
+
+def _address(payload: dict, wa_id: str, name: str, message_id: str, timestamp: int) -> dict:
+    value = _message_value(payload)
+    value["contacts"][0]["wa_id"] = wa_id
+    value["contacts"][0]["profile"]["name"] = name
+    message = value["messages"][0]
+    message["from"] = wa_id
+    message["id"] = message_id
+    message["timestamp"] = str(timestamp)
+    return payload
+
+
+def build_webhook(kind: str, arg, wa_id: str, seq: int, timestamp: Optional[int] = None) -> dict:
+    '''
+    Webhook payload of the given kind ("text", "list_reply", "document" or "status")
+    sent by wa_id. `seq` makes message and media ids unique.
+    '''
+    timestamp = timestamp or int(time.time())
+    message_id = f"wamid.load.{wa_id}.{seq}"
+    name = f"Athlete {wa_id[-4:]}"
+
+    if kind == "text":
+        payload = _address(json.loads(VALID_TEXT_MESSAGE_PAYLOAD), wa_id, name, message_id, timestamp)
+        _message_value(payload)["messages"][0]["text"]["body"] = arg
+    elif kind == "list_reply":
+        payload = _address(json.loads(VALID_LIST_REPLY), wa_id, name, message_id, timestamp)
+        row_id, title = arg
+        _message_value(payload)["messages"][0]["interactive"]["list_reply"].update(id=row_id, title=title)
+    elif kind == "document":
+        payload = _address(json.loads(VALID_DOCUMENT_MESSAGE_PAYLOAD), wa_id, name, message_id, timestamp)
+        media_id = f"media.{wa_id}.{seq}"
+        _message_value(payload)["messages"][0]["document"].update(
+            filename=arg, mime_type="text/csv", id=media_id,
+            sha256=hashlib.sha256(adr_document(media_id)).hexdigest(),
+        )
+    elif kind == "status":
+        payload = json.loads(VALID_STATUS_UPDATE_PAYLOAD)
+        status = _message_value(payload)["statuses"][0]
+        status.update(id=message_id, status=arg, recipient_id=wa_id, timestamp=str(timestamp))
+    else:
+        raise ValueError(f"Unknown webhook kind {kind}")
+    return payload
+
+
+def expects_reply(kind: str) -> bool:
+    return kind != "status"